@@ -17,6 +17,17 @@ def create_app():
     load_dotenv()  # ← .env を読み込む
 
     app = Flask(__name__)
+
+    # jsonify のJSON変換（orjson があれば使う）と、レスポンスの gzip / brotli 圧縮
+    from app.utils.json_provider import FastJSONProvider
+    from app.utils import compression
+    app.json = FastJSONProvider(app)
+    compression.init_app(app)
+
+    # アップロードされたファイルをメモリ/ディスクにスプールするリクエストクラスを使用
+    from app.utils.upload_stream import SpooledUploadRequest, MAX_CONTENT_LENGTH
+    app.request_class = SpooledUploadRequest
+    app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
     
     # CORS設定
     # 環境変数から許可するオリジンのリストを取得
@@ -80,12 +91,38 @@ def create_app():
         
         return response
 
+    # リクエストサイズ上限を超えた場合もCORSヘッダー付きのJSONで返す
+    @app.errorhandler(413)
+    def handle_413_error(e):
+        origin = request.headers.get('Origin', allowed_origins[0] if allowed_origins else 'http://localhost:3000')
+        
+        response = app.response_class(
+            response='{"error": "ファイルサイズが大きすぎます"}',
+            status=413,
+            mimetype='application/json'
+        )
+        
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With'
+        
+        return response
+
     app.config['ENV'] = os.getenv('FLASK_ENV', 'production') # FLASK_ENVに値を入れてたら自動的に開発モード（development）になる。本番では絶対に debug=True にしない：セキュリティリスクが極めて高くなるから。アプリの内部情報（ソースコード・環境変数・サーバー情報）まで外部から丸見えになる。。
     app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', '') # .env に FLASK_SECRET_KEY が定義されてなければ 'fallback-key' を代わりに使うことで、開発中の事故防止
     
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # 接続プールの大きさ・接続の再作成・貸し出し前の生存確認（DB_POOL_* で調整する）
+    from app.utils.db_config import build_engine_options, instrument_engine
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    # 読み取り専用のレプリカ（DATABASE_REPLICA_URLS）。GETのリクエストの読み取りはレプリカに送る（app/utils/db_routing.py）
+    from app.utils.db_routing import replica_binds
+    app.config['SQLALCHEMY_BINDS'] = replica_binds(engine_options=build_engine_options)
+
     # JWT設定
     app.config['JWT_SECRET_KEY'] = app.config['SECRET_KEY']
     app.config['JWT_TOKEN_LOCATION'] = ['headers']
@@ -98,6 +135,26 @@ def create_app():
 
     # SQLAlchemyとFlaskを接続
     db.init_app(app)
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            instrument_engine(engine, name=bind_key or 'primary')
+
+    # 応答後に行う副作用（ボットの返信、未読数の更新など）を実行するワーカー
+    from app.utils.background import background
+    background.init_app(app)
+
+    # いいね数・メッセージ数のカラムを、行の追加・削除に合わせて更新するリスナーを登録する
+    from app.utils import counters
+
+    # イベント・スレッドの作成・編集・削除を全文検索のインデックスに反映するリスナーを登録する
+    from app.utils import search_index
+
+    # 一覧などのETagの元になるリソースのバージョンを、変更のコミット後に上げるリスナーを登録する
+    from app.utils import http_cache
+
+    # リアルタイム配信のバックエンド（REALTIME_BACKEND=redis で複数ワーカー間に配信）
+    from app.utils.realtime import broker
+    broker.configure()
 
     # Blueprint登録（example_bp というBlueprintをFlaskのappのモジュールとして追加。ルートの先頭に /api を付けて登録する）
     from app.routes.protected.routes import protected_bp
@@ -136,9 +193,23 @@ def create_app():
     from app.routes.voice.routes import voice_bp
     app.register_blueprint(voice_bp, url_prefix="/api/voice")
 
+    from app.routes.metrics_routes import metrics_bp
+    app.register_blueprint(metrics_bp, url_prefix="/api/metrics")
+
+    from app.routes.search_routes import search_bp
+    app.register_blueprint(search_bp, url_prefix="/api/search")
+
     # modelsに定義されたモデルクラスと見て、対応するテーブルをデータベースに作成し、appではモデルクラスを介してデータベーステーブルと対話する。
+    # 既存のテーブルへのカラムやインデックスの追加は、バージョン管理されたマイグレーション（app/utils/migrations.py）で行う。
+    # AUTO_MIGRATE=false の場合は起動時に何もせず、backend/migrate.py で明示的に適用する。
     with app.app_context():
-        db.create_all()
+        if os.getenv('AUTO_MIGRATE', 'true') == 'true':
+            from app.utils.migrations import upgrade
+            upgrade()
+
+        # エリア・タグ・キャラクターをメモリに読み込む（以降の参照はDBに問い合わせない）
+        from app.utils import refdata
+        refdata.load_all()
         
         # ストレージの初期化（バケットの確認/作成）
         try:
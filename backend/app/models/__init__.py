@@ -1,21 +1,26 @@
 from flask_sqlalchemy import SQLAlchemy
+from app.utils.db_routing import RoutingSession
 
-db = SQLAlchemy()
+# 読み取りはレプリカ、書き込みはプライマリに振り分ける（DATABASE_REPLICA_URLS が未設定ならすべてプライマリ）
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # モデルのインポート
 from app.models.user import User, get_user_by_email
 from app.models.area import AreaList
-from app.models.file import ImageList
+from app.models.file import ImageList, StoredObject
 from app.models.event import (
     Event, UserMemberGroup, UserHeartEvent, 
-    TagMaster, UserTagAssociation, EventTagAssociation, ThreadTagAssociation
+    TagMaster, UserTagAssociation, EventTagAssociation, ThreadTagAssociation,
+    UserTimeline
 )
 from app.models.thread import (
     Thread, ThreadMessage, 
     UserHeartThread
 )
 from app.models.message import (
-    EventMessage, MessageReadStatus,
-    FriendRelationship, DirectMessage
+    EventMessage, MessageReadStatus, EventReadWatermark,
+    FriendRelationship, DirectMessage, DirectConversation
 )
 from app.models.character import Character
+from app.models.search import SearchDocument
+from app.models.cache import ResourceVersion
@@ -0,0 +1,18 @@
+from app.models import db
+from datetime import datetime, timezone, timedelta
+
+JST = timezone(timedelta(hours=9))  # 日本時間タイムゾーンを定義
+
+
+class ResourceVersion(db.Model):
+    """
+    APIレスポンスの元になるデータ（イベント・スレッド・ユーザーなど）の更新回数（utils.http_cache が更新する）
+
+    ETagはこのバージョンから計算するため、変更がなければ1回の小さなクエリで304を返せる。
+    一覧ごとの行（events など）と、ユーザーごとの行（user:<ユーザーID>）がある。
+    """
+    __tablename__ = 'resource_version'
+
+    name = db.Column(db.String(50), primary_key=True)  # リソース名（ユーザーごとの場合は user:<ユーザーID>）
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now(JST))
@@ -7,6 +7,13 @@ JST = timezone(timedelta(hours=9))  # 日本時間タイムゾーンを定義
 
 class Event(db.Model):
     __tablename__ = 'event'
+    __table_args__ = (
+        # 一覧は削除されていないイベントを公開日時の新しい順に取得し、エリア・ステータス・作成者で絞り込む
+        db.Index('ix_event_deleted_published_at', 'is_deleted', 'published_at'),
+        db.Index('ix_event_area_deleted_published_at', 'area_id', 'is_deleted', 'published_at'),
+        db.Index('ix_event_status_deleted_published_at', 'status', 'is_deleted', 'published_at'),
+        db.Index('ix_event_author_deleted_published_at', 'author_user_id', 'is_deleted', 'published_at'),
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -21,6 +28,9 @@ class Event(db.Model):
     area_id = db.Column(db.String(36), db.ForeignKey('area_list.area_id'))
     published_at = db.Column(db.DateTime, default=datetime.now(JST))
     status = db.Column(db.String(20), default='pending')  # pending/started/ended
+    # いいね数・メッセージ数（utils.counters が行の追加・削除と同じトランザクションで更新する）
+    hearts_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    messages_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # リレーションシップ
     image = db.relationship('ImageList', backref='events')
@@ -30,6 +40,8 @@ class Event(db.Model):
     
     def to_dict(self):
         """辞書形式でデータを返す（APIレスポンス用）"""
+        from app.utils import refdata
+
         return {
             'id': self.id,
             'title': self.title,
@@ -40,11 +52,10 @@ class Event(db.Model):
             'limit_persons': self.limit_persons,
             'is_request': self.is_request,
             'status': self.status,
+            'hearts_count': self.hearts_count,
+            'messages_count': self.messages_count,
             'author': self.author.to_dict() if self.author else None,
-            'area': {
-                'id': self.area.area_id,
-                'name': self.area.area_name
-            } if self.area else None,
+            'area': refdata.areas.get(self.area_id),
             'image_url': self.image.image_url if self.image else None
         }
 
@@ -86,6 +97,9 @@ class TagMaster(db.Model):
 
 class UserTagAssociation(db.Model):
     __tablename__ = 'user_tag_association'
+    __table_args__ = (
+        db.Index('ix_user_tag_association_user_tag', 'user_id', 'tag_id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     tag_id = db.Column(db.String(36), db.ForeignKey('tag_master.id'), nullable=False)
@@ -95,6 +109,11 @@ class UserTagAssociation(db.Model):
 
 class EventTagAssociation(db.Model):
     __tablename__ = 'event_tag_association'
+    __table_args__ = (
+        # イベントのタグ取得と、タグからのイベント検索の両方向
+        db.Index('ix_event_tag_association_event_tag', 'event_id', 'tag_id'),
+        db.Index('ix_event_tag_association_tag_event', 'tag_id', 'event_id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     tag_id = db.Column(db.String(36), db.ForeignKey('tag_master.id'), nullable=False)
@@ -104,8 +123,30 @@ class EventTagAssociation(db.Model):
 
 class ThreadTagAssociation(db.Model):
     __tablename__ = 'thread_tag_association'
+    __table_args__ = (
+        # タグからのスレッド検索（GROUP BY thread_id）と、スレッドのタグ取得の両方向
+        db.Index('ix_thread_tag_association_tag_thread', 'tag_id', 'thread_id'),
+        db.Index('ix_thread_tag_association_thread_tag', 'thread_id', 'tag_id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     tag_id = db.Column(db.String(36), db.ForeignKey('tag_master.id'), nullable=False)
     thread_id = db.Column(db.String(36), db.ForeignKey('thread.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(JST))
+
+
+class UserTimeline(db.Model):
+    """
+    フレンドのイベントのタイムライン（ユーザーごとに新しいものから一定件数）
+
+    イベント作成時にフォロワーのタイムラインへ書き込み、読み出しは範囲検索1回で済ませる。
+    """
+    __tablename__ = 'user_timeline'
+    __table_args__ = (
+        db.Index('ix_user_timeline_user_published_at', 'user_id', 'published_at', 'event_id'),
+    )
+    
+    user_id = db.Column(db.String(36), db.ForeignKey('user.id'), primary_key=True)
+    event_id = db.Column(db.String(36), db.ForeignKey('event.id'), primary_key=True)
+    author_user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
+    published_at = db.Column(db.DateTime, nullable=False)
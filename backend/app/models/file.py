@@ -16,13 +16,17 @@ class ImageList(db.Model):
     entity_type = db.Column(db.String(50))  # 'thread', 'event', 'thread_message', 'event_message', 'direct_message', 'user_profile'
     entity_id = db.Column(db.String(36))  # 関連するエンティティのID
     
-    def __init__(self, id, image_url, uploaded_by, entity_type=None, entity_id=None, upload_date=None):
+    # 画像内容のSHA-256（同一内容の画像は同じStoredObjectを参照する）
+    content_hash = db.Column(db.String(64), index=True)
+    
+    def __init__(self, id, image_url, uploaded_by, entity_type=None, entity_id=None, upload_date=None, content_hash=None):
         self.id = id
         self.image_url = image_url
         self.uploaded_by = uploaded_by
         self.entity_type = entity_type
         self.entity_id = entity_id
         self.upload_date = upload_date if upload_date else datetime.now(JST)
+        self.content_hash = content_hash
             
     def to_dict(self):
         """APIレスポンス用の辞書形式でデータを返す"""
@@ -34,3 +38,25 @@ class ImageList(db.Model):
             'entity_type': self.entity_type,
             'entity_id': self.entity_id
         }
+
+
+class StoredObject(db.Model):
+    """内容ハッシュで識別されるストレージ上の実体（ImageListから参照カウントされる）"""
+    __tablename__ = 'stored_object'
+    
+    content_hash = db.Column(db.String(64), primary_key=True)
+    object_key = db.Column(db.String(512), nullable=False)
+    image_url = db.Column(db.String(512), nullable=False)
+    content_type = db.Column(db.String(100))
+    size = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now(JST))
+    
+    def __init__(self, content_hash, object_key, image_url, content_type=None, size=None, ref_count=0, created_at=None):
+        self.content_hash = content_hash
+        self.object_key = object_key
+        self.image_url = image_url
+        self.content_type = content_type
+        self.size = size
+        self.ref_count = ref_count
+        self.created_at = created_at if created_at else datetime.now(JST)
@@ -5,6 +5,10 @@ JST = timezone(timedelta(hours=9))  # 日本時間タイムゾーンを定義
 
 class EventMessage(db.Model):
     __tablename__ = 'event_message'
+    __table_args__ = (
+        # イベントごとのメッセージ履歴を (timestamp, id) のキーセットで辿るためのインデックス
+        db.Index('ix_event_message_event_timestamp', 'event_id', 'timestamp', 'id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     event_id = db.Column(db.String(36), db.ForeignKey('event.id'), nullable=False)
@@ -20,8 +24,14 @@ class EventMessage(db.Model):
     read_statuses = db.relationship('MessageReadStatus', backref='message', lazy=True,
                                   cascade='all, delete-orphan')
     
-    def to_dict(self):
-        """辞書形式でデータを返す（APIレスポンス用）"""
+    def to_dict(self, read_count=None):
+        """
+        辞書形式でデータを返す（APIレスポンス用）
+        
+        一覧で使う場合は既読数をまとめて数えて read_count に渡す（utils.serializers を参照）
+        """
+        if read_count is None:
+            read_count = MessageReadStatus.query.filter_by(message_id=self.id).count()
         return {
             'id': self.id,
             'event_id': self.event_id,
@@ -31,7 +41,7 @@ class EventMessage(db.Model):
             'image_url': self.image.image_url if self.image else None,
             'message_type': self.message_type,
             'metadata': self.message_metadata,
-            'read_count': len(self.read_statuses) if self.read_statuses else 0
+            'read_count': read_count
         }
 
 
@@ -46,8 +56,38 @@ class MessageReadStatus(db.Model):
     user = db.relationship('User', backref='read_messages')
 
 
+class EventReadWatermark(db.Model):
+    """
+    ユーザーがイベントのトークをどこまで読んだか（既読位置）と未読数
+
+    参加時に作成し、退出時に削除する。未読数はメッセージの追加後に加算し、既読時に数え直す（utils.read_tracking）。
+    """
+    __tablename__ = 'event_read_watermark'
+    
+    user_id = db.Column(db.String(36), db.ForeignKey('user.id'), primary_key=True)
+    event_id = db.Column(db.String(36), db.ForeignKey('event.id'), primary_key=True)
+    last_read_at = db.Column(db.DateTime)  # 既読にした最新メッセージの時刻（Noneはまだ読んでいない）
+    last_read_message_id = db.Column(db.String(36))
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.now(JST))
+    
+    def to_dict(self):
+        """辞書形式でデータを返す（APIレスポンス用）"""
+        return {
+            'event_id': self.event_id,
+            'last_read_at': self.last_read_at.isoformat() if self.last_read_at else None,
+            'last_read_message_id': self.last_read_message_id,
+            'unread_count': self.unread_count
+        }
+
+
 class FriendRelationship(db.Model):
     __tablename__ = 'friend_relationship'
+    __table_args__ = (
+        # 自分から送った関係（user_id側）と相手から届いた関係（friend_id側）をそれぞれ引けるようにする
+        db.Index('ix_friend_relationship_user_friend_status', 'user_id', 'friend_id', 'status'),
+        db.Index('ix_friend_relationship_friend_status', 'friend_id', 'status'),
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     user_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
@@ -70,6 +110,10 @@ class FriendRelationship(db.Model):
 
 class DirectMessage(db.Model):
     __tablename__ = 'direct_message'
+    __table_args__ = (
+        # 2者間の履歴を (sent_at, id) のキーセットで辿るためのインデックス（送受信の両方向で使う）
+        db.Index('ix_direct_message_pair_sent_at', 'sender_id', 'receiver_id', 'sent_at', 'id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     sender_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
@@ -99,3 +143,26 @@ class DirectMessage(db.Model):
             'is_read': self.is_read,
             'read_at': self.read_at.isoformat() if self.read_at else None
         }
+
+
+class DirectConversation(db.Model):
+    """
+    DMの会話一覧（ユーザーごと・相手ごとに1行）
+
+    送信・既読のたびに更新し、会話一覧を1回のインデックス検索で取得できるようにする。
+    """
+    __tablename__ = 'direct_conversation'
+    __table_args__ = (
+        db.Index('ix_direct_conversation_user_latest', 'user_id', 'latest_message_at'),
+    )
+    
+    user_id = db.Column(db.String(36), db.ForeignKey('user.id'), primary_key=True)
+    partner_id = db.Column(db.String(36), db.ForeignKey('user.id'), primary_key=True)
+    latest_message_id = db.Column(db.String(36), db.ForeignKey('direct_message.id'))
+    latest_message_at = db.Column(db.DateTime)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.now(JST))
+    
+    # リレーションシップ
+    partner = db.relationship('User', foreign_keys=[partner_id])
+    latest_message = db.relationship('DirectMessage', foreign_keys=[latest_message_id])
@@ -0,0 +1,27 @@
+from app.models import db
+from datetime import datetime, timezone, timedelta
+
+JST = timezone(timedelta(hours=9))  # 日本時間タイムゾーンを定義
+
+
+class SearchDocument(db.Model):
+    """
+    検索用に分かち書きしたイベント・スレッドの単語（utils.search_index が更新する）
+
+    各ワーカーはこのテーブルを読んでメモリ上の転置インデックスを作り、updated_at（DBの時計）で差分を取り込む。
+    削除されたものは行を消さずに is_deleted を立て、他のワーカーにも削除を伝える。
+    """
+    __tablename__ = 'search_document'
+    __table_args__ = (
+        db.Index('ix_search_document_updated_at', 'updated_at'),
+    )
+
+    doc_type = db.Column(db.String(10), primary_key=True)  # event/thread
+    doc_id = db.Column(db.String(36), primary_key=True)
+    terms = db.Column(db.Text, nullable=False, default='')  # 単語を空白区切りで並べたもの
+    length = db.Column(db.Integer, nullable=False, default=0)
+    area_id = db.Column(db.String(36))
+    status = db.Column(db.String(20))
+    published_at = db.Column(db.DateTime)
+    is_deleted = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now(JST))
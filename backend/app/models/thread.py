@@ -6,6 +6,11 @@ JST = timezone(timedelta(hours=9))  # 日本時間タイムゾーン
 
 class Thread(db.Model):
     __tablename__ = 'thread'
+    __table_args__ = (
+        # スレッド一覧を (published_at, id) のキーセットで辿るためのインデックス
+        db.Index('ix_thread_published_at', 'published_at', 'id'),
+        db.Index('ix_thread_area_published_at', 'area_id', 'published_at', 'id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True)
     title = db.Column(db.String(100), nullable=False)
@@ -14,6 +19,9 @@ class Thread(db.Model):
     area_id = db.Column(db.String(36), db.ForeignKey('area_list.area_id'))
     published_at = db.Column(db.DateTime, default=datetime.now(JST))
     author_id = db.Column(db.String(36), db.ForeignKey('user.id'), nullable=False)
+    # いいね数・メッセージ数（utils.counters が行の追加・削除と同じトランザクションで更新する）
+    hearts_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    messages_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # リレーションシップ
     image = db.relationship('ImageList', backref='threads')
@@ -28,21 +36,26 @@ class Thread(db.Model):
         from app.models.user import User
         return User.query.get(self.author_id)
     
-    def to_dict(self, current_user_id=None):
-        """辞書形式でデータを返す（APIレスポンス用）"""
-        from app.models.event import TagMaster
+    def to_dict(self, current_user_id=None, tags=None, is_hearted=None):
+        """
+        辞書形式でデータを返す（APIレスポンス用）
         
-        tags = []
-        try:
-            for assoc in self.tags:
-                tag = TagMaster.query.get(assoc.tag_id)
-                if tag:
-                    tags.append({
-                        'id': tag.id,
-                        'name': tag.tag_name
-                    })
-        except Exception:
+        一覧で使う場合はタグ・いいね済みかをまとめて求めて渡す（utils.serializers を参照）
+        """
+        from app.utils import refdata
+        
+        if tags is None:
             tags = []
+            try:
+                for assoc in self.tags:
+                    tag = refdata.tags.get(assoc.tag_id)
+                    if tag:
+                        tags.append({
+                            'id': tag['id'],
+                            'name': tag['tag_name']
+                        })
+            except Exception:
+                tags = []
         
         image_url = None
         if self.image_id:
@@ -50,9 +63,13 @@ class Thread(db.Model):
             image = ImageList.query.get(self.image_id)
             if image:
                 image_url = image.image_url
-                
-        is_hearted = any(heart.user_id == current_user_id for heart in self.hearted_by) if current_user_id else False
+        
+        if is_hearted is None:
+            is_hearted = UserHeartThread.query.filter_by(
+                user_id=current_user_id, thread_id=self.id
+            ).first() is not None if current_user_id else False
 
+        author = self.author
 
         return {
             'id': self.id,
@@ -60,17 +77,14 @@ class Thread(db.Model):
             'message': self.message,
             'created_at': self.published_at.isoformat() if self.published_at else None,
             'created_by': {
-                'id': self.author.id,
-                'user_name': self.author.user_name,
-                'profile_image_url': self.author.user_image_url if hasattr(self.author, 'user_image_url') else None
-            } if self.author else None,
-            'area': {
-                'id': self.area.area_id,
-                'name': self.area.area_name
-            } if self.area else None,
+                'id': author.id,
+                'user_name': author.user_name,
+                'profile_image_url': author.user_image_url if hasattr(author, 'user_image_url') else None
+            } if author else None,
+            'area': refdata.areas.get(self.area_id),
             'image_url': image_url,
-            'hearts_count': len(self.hearted_by) if hasattr(self, 'hearted_by') else 0,
-            'messages_count': len(self.messages) if hasattr(self, 'messages') else 0,
+            'hearts_count': self.hearts_count or 0,
+            'messages_count': self.messages_count or 0,
             'tags': tags,
             'is_hearted': is_hearted
         }
@@ -103,14 +117,15 @@ class ThreadMessage(db.Model):
             if image:
                 image_url = image.image_url
                 
+        sender = self.sender
         return {
             'id': self.id,
             'thread_id': self.thread_id,
             'created_by': {
-                'id': self.sender.id,
-                'user_name': self.sender.user_name,
-                'profile_image_url': self.sender.user_image_url if hasattr(self.sender, 'user_image_url') else None
-            } if self.sender else None,
+                'id': sender.id,
+                'user_name': sender.user_name,
+                'profile_image_url': sender.user_image_url if hasattr(sender, 'user_image_url') else None
+            } if sender else None,
             'content': self.content if self.message_type == 'text' else image_url,
             'created_at': self.timestamp.isoformat() if self.timestamp else None,
             'message_type': self.message_type,
@@ -1,5 +1,5 @@
 from flask import Blueprint, jsonify, request, make_response
-from app.models.area import AreaList
+from app.utils import refdata
 
 area_bp = Blueprint('area', __name__)
 
@@ -14,7 +14,7 @@ def get_area_list():
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
         return response
     
-    areas = AreaList.query.all()
-    return jsonify({
-        "areas": [area.to_dict() for area in areas]
+    # メモリ上の参照データから返す。ETagが一致すれば304
+    return refdata.conditional_json(refdata.areas, lambda: {
+        "areas": refdata.areas.all()
     })
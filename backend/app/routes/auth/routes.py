@@ -3,6 +3,7 @@ from app.utils.jwt import generate_token, decode_token
 from app.models.user import get_user_by_email, get_user_by_id, User
 from app.models import db
 from app.utils.email_certification import send_email_verification, send_password_reset_email, verify_token
+from app.utils.db_routing import use_primary
 import uuid
 from datetime import datetime, timezone, timedelta
 
@@ -83,6 +84,7 @@ def register():
     })
 
 @auth_bp.route('/verify-email/<token>', methods=['GET'])
+@use_primary  # 登録直後に開かれるため、レプリカへの反映を待たない
 def verify_email(token):
     payload = verify_token(token)
     if not payload or payload.get('action') != 'email_verification':
@@ -159,6 +161,7 @@ def resend_verification():
     return jsonify({"message": "認証メールを再送しました"})
 
 @auth_bp.route('/verify', methods=['GET'])
+@use_primary  # 登録・ログイン直後に呼ばれるため、レプリカへの反映を待たない
 def verify_token_route():
     auth_header = request.headers.get('Authorization')
     
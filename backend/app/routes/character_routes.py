@@ -1,6 +1,5 @@
 from flask import Blueprint, jsonify
-from app.models import db
-from app.models.character import Character
+from app.utils import refdata
 
 character_bp = Blueprint("character", __name__)
 
@@ -8,9 +7,10 @@ character_bp = Blueprint("character", __name__)
 def get_characters():
     """すべてのキャラクターを取得するエンドポイント"""
     try:
-        characters = Character.query.all()
-        result = [character.to_dict() for character in characters]
-        return jsonify({"characters": result}), 200
+        # メモリ上の参照データから返す。ETagが一致すれば304
+        return refdata.conditional_json(refdata.characters, lambda: {
+            "characters": refdata.characters.all()
+        })
     except Exception as e:
         return jsonify({"error": f"キャラクター取得に失敗しました: {str(e)}"}), 500
 
@@ -18,11 +18,11 @@ def get_characters():
 def get_character(character_id):
     """指定されたIDのキャラクターを取得するエンドポイント"""
     try:
-        character = Character.query.filter_by(id=character_id).first()
+        character = refdata.characters.get(character_id)
         if not character:
             return jsonify({"error": "指定されたキャラクターが見つかりません"}), 404
         
-        return jsonify({"character": character.to_dict()}), 200
+        return jsonify({"character": character}), 200
     except Exception as e:
         return jsonify({"error": f"キャラクター取得に失敗しました: {str(e)}"}), 500
 
@@ -30,10 +30,10 @@ def get_character(character_id):
 def get_character_direct(character_id):
     """指定されたIDのキャラクターを取得するエンドポイント（直接IDを指定）"""
     try:
-        character = Character.query.filter_by(id=character_id).first()
+        character = refdata.characters.get(character_id)
         if not character:
             return jsonify({"error": "指定されたキャラクターが見つかりません"}), 404
         
-        return jsonify({"character": character.to_dict()}), 200
+        return jsonify({"character": character}), 200
     except Exception as e:
         return jsonify({"error": f"キャラクター取得に失敗しました: {str(e)}"}), 500 
\ No newline at end of file
@@ -0,0 +1,31 @@
+import os
+import hmac
+from flask import Blueprint, jsonify, request, Response
+from app.utils.db_config import get_pool_metrics, format_prometheus
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# X-Metrics-Token ヘッダーで一致するトークンを要求する（未設定の場合はエンドポイントを公開しない）
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+
+def _authorized():
+    return hmac.compare_digest(request.headers.get('X-Metrics-Token', ''), METRICS_TOKEN)
+
+
+@metrics_bp.route("/db", methods=["GET"])
+def get_db_metrics():
+    """
+    DB接続プールのメトリクス（貸し出し中の接続数、接続を借りるまでの待ち時間など）
+
+    ?format=prometheus でPrometheusのテキスト形式で返す
+    """
+    if not METRICS_TOKEN:
+        return jsonify({"error": "見つかりません"}), 404
+    if not _authorized():
+        return jsonify({"error": "認証に失敗しました"}), 401
+
+    snapshots = get_pool_metrics()
+    if request.args.get('format') == 'prometheus':
+        return Response(format_prometheus(snapshots), mimetype='text/plain; version=0.0.4')
+    return jsonify({"pools": snapshots})
@@ -2,8 +2,9 @@ from flask import Blueprint, request, jsonify, current_app, make_response
 from app.routes.protected.routes import get_authenticated_user
 from app.models.user import User
 from app.models.event import Event, UserMemberGroup, UserHeartEvent, TagMaster, EventTagAssociation, UserTagAssociation
-from app.models.message import EventMessage, MessageReadStatus, FriendRelationship
+from app.models.message import EventMessage, MessageReadStatus
 from app.models import db
+from sqlalchemy import or_
 import uuid
 from datetime import datetime, timezone, timedelta
 import json
@@ -14,6 +15,13 @@ import os
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 from app.utils.recommend import get_event_recommendations_for_user,  get_initial_recommendations_for_user
+from app.utils.realtime import publish_event
+from app.utils.serializers import serialize_event_messages, serialize_events
+from app.utils.read_tracking import start_read_tracking, stop_read_tracking
+from app.utils.timeline import fan_out_event, get_timeline_events
+from app.utils.tag_filter import resolve_tag_ids, parse_tag_mode, filter_by_tags
+from app.utils.background import enqueue
+from app.utils.http_cache import conditional
 
 # 日本時間タイムゾーン
 JST = timezone(timedelta(hours=9))
@@ -22,10 +30,14 @@ event_bp = Blueprint("event", __name__)
 
 # イベント一覧取得（認証なし）
 @event_bp.route("/events", methods=["GET"])
+@conditional('events', 'users', 'refdata')
 def get_events():
     # クエリパラメータの取得
     area_id = request.args.get('area_id')
     tag = request.args.get('tag')
+    tags = request.args.getlist('tags')
+    # and: 指定したタグをすべて持つイベント / or: いずれかのタグを持つイベント
+    tag_mode = parse_tag_mode(request.args.get('tag_mode'))
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
     status = request.args.get('status')  # pending, started, ended
@@ -41,15 +53,13 @@ def get_events():
     if status:
         query = query.filter_by(status=status)
     
-    # タグでフィルタリング
-    if tag:
-        tag_obj = TagMaster.query.filter_by(tag_name=tag).first()
-        if tag_obj:
-            tag_associations = EventTagAssociation.query.filter_by(
-                tag_id=tag_obj.id
-            ).all()
-            event_ids = [assoc.event_id for assoc in tag_associations]
-            query = query.filter(Event.id.in_(event_ids))
+    # タグでフィルタリング（tag=名前 で1つ、tags=名前&tags=名前 で複数。存在しないタグ名は無視する）
+    tag_names = ([tag] if tag else []) + tags
+    if tag_names:
+        query = filter_by_tags(
+            query, EventTagAssociation, EventTagAssociation.event_id, Event.id,
+            resolve_tag_ids(tag_names), mode=tag_mode
+        )
     
     # 総件数を取得
     total_count = query.count()
@@ -57,19 +67,8 @@ def get_events():
     # ページネーション
     events = query.order_by(Event.published_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
     
-    # 結果の整形
-    events_data = []
-    for event in events.items:
-        event_data = event.to_dict()
-        
-        # タグ情報を追加
-        event_tags = db.session.query(TagMaster)\
-            .join(EventTagAssociation, TagMaster.id == EventTagAssociation.tag_id)\
-            .filter(EventTagAssociation.event_id == event.id)\
-            .all()
-            
-        event_data['tags'] = [{'id': tag.id, 'tag_name': tag.tag_name} for tag in event_tags]
-        events_data.append(event_data)
+    # 結果の整形（作成者・タグなどはまとめて取得）
+    events_data = serialize_events(events.items)
     
     result = {
         'events': events_data,
@@ -118,6 +117,7 @@ def get_recommended_events_for_authenticated_user():
 
 # 人気イベントを表示（認証不要）
 @event_bp.route("/popular", methods=["GET"])
+@conditional('events', 'users', 'refdata')
 def get_popular_events():
     """人気のイベント（認証不要）"""
     try:
@@ -128,19 +128,8 @@ def get_popular_events():
             .order_by(Event.current_persons.desc(), Event.published_at.desc())\
             .limit(limit).all()
         
-        # イベント情報の加工
-        events_data = []
-        for event in events:
-            event_data = event.to_dict()
-            
-            # タグ情報を追加
-            event_tags = db.session.query(TagMaster)\
-                .join(EventTagAssociation, TagMaster.id == EventTagAssociation.tag_id)\
-                .filter(EventTagAssociation.event_id == event.id)\
-                .all()
-                
-            event_data['tags'] = [{'id': tag.id, 'tag_name': tag.tag_name} for tag in event_tags]
-            events_data.append(event_data)
+        # イベント情報の加工（作成者・タグなどはまとめて取得）
+        events_data = serialize_events(events)
         
         return jsonify({'events': events_data})
         
@@ -169,7 +158,7 @@ def get_event(event_id):
     
     # メッセージも取得！
     messages = EventMessage.query.filter_by(event_id=event_id).order_by(EventMessage.timestamp.asc()).all()
-    messages_data = [message.to_dict() for message in messages]
+    messages_data = serialize_event_messages(messages)
 
 
     # イベントの参加者かどうか
@@ -181,20 +170,12 @@ def get_event(event_id):
             event_id=event_id
     ).first() is not None
     
-    # イベント情報の加工
-    event_data = event.to_dict()
-    
-    # タグ情報を追加
-    event_tags = db.session.query(TagMaster)\
-        .join(EventTagAssociation, TagMaster.id == EventTagAssociation.tag_id)\
-        .filter(EventTagAssociation.event_id == event.id)\
-        .all()
-        
-    event_data['tags'] = [{'id': tag.id, 'tag_name': tag.tag_name} for tag in event_tags]
+    # イベント情報の加工（タグ名は参照データから引く）
+    event_data = serialize_events([event])[0]
 
     return jsonify({
         "event": event_data,
-        "messages": [message.to_dict() for message in messages],
+        "messages": messages_data,
         "is_joined": is_joined
     })
 
@@ -247,6 +228,8 @@ def create_event():
     )
     
     db.session.add(member)
+    db.session.flush()
+    start_read_tracking(user.id, event.id)
     
     # タグの追加
     for tag_name in tags:
@@ -274,6 +257,10 @@ def create_event():
     
     db.session.commit()
     
+    # フォロワーのタイムラインに配る
+    if fan_out_event(event):
+        db.session.commit()
+    
     return jsonify({
         "message": "イベントを作成しました",
         "event": event.to_dict()
@@ -300,8 +287,12 @@ def join_event(event_id):
     if is_member:
         return jsonify({"error": "既にこのイベントに参加しています"}), 400
     
-    # 定員確認
-    if event.current_persons >= event.limit_persons:
+    # 定員確認と参加者数の加算を1つのUPDATEで行う（同時に参加しても定員を超えないように）
+    joined = Event.query.filter(
+        Event.id == event_id,
+        or_(Event.limit_persons.is_(None), Event.current_persons < Event.limit_persons)
+    ).update({Event.current_persons: Event.current_persons + 1}, synchronize_session=False)
+    if not joined:
         return jsonify({"error": "イベントの定員に達しています"}), 400
     
     # 参加処理
@@ -311,9 +302,6 @@ def join_event(event_id):
         joined_at=datetime.now(JST)
     )
     
-    # イベントの参加者数を増やす
-    event.current_persons += 1
-    
     # システムメッセージの作成
     system_message = EventMessage(
         id=str(uuid.uuid4()),
@@ -326,11 +314,21 @@ def join_event(event_id):
     
     db.session.add(member)
     db.session.add(system_message)
+    db.session.flush()
+    # 参加メッセージより後から未読を数える
+    start_read_tracking(user.id, event_id)
     db.session.commit()
     
+    event_data = event.to_dict()
+    publish_event(event_id, 'member_joined', {
+        "user": user.to_dict(),
+        "current_persons": event.current_persons
+    })
+    publish_event(event_id, 'message', system_message.to_dict())
+    
     return jsonify({
         "message": "イベントに参加しました",
-        "event": event.to_dict()
+        "event": event_data
     })
 
 @event_bp.route("/<event_id>/leave", methods=["POST"])
@@ -360,10 +358,13 @@ def leave_event(event_id):
     
     # 退出処理
     db.session.delete(member)
+    stop_read_tracking(user.id, event_id)
     
-    # イベントの参加者数を減らす
-    if event.current_persons > 1:
-        event.current_persons -= 1
+    # イベントの参加者数を減らす（読み出さずにUPDATEで減らす）
+    Event.query.filter(
+        Event.id == event_id,
+        Event.current_persons > 1
+    ).update({Event.current_persons: Event.current_persons - 1}, synchronize_session=False)
     
     # システムメッセージの作成
     system_message = EventMessage(
@@ -378,6 +379,12 @@ def leave_event(event_id):
     db.session.add(system_message)
     db.session.commit()
     
+    publish_event(event_id, 'member_left', {
+        "user_id": user.id,
+        "current_persons": event.current_persons
+    })
+    publish_event(event_id, 'message', system_message.to_dict())
+    
     return jsonify({
         "message": "イベントから退出しました"
     })
@@ -435,6 +442,11 @@ def start_event(event_id):
     
     db.session.commit()
     
+    publish_event(event_id, 'status_changed', {"status": event.status})
+    publish_event(event_id, 'message', system_message.to_dict())
+    if location_data and 'latitude' in location_data and 'longitude' in location_data:
+        publish_event(event_id, 'message', location_message.to_dict())
+    
     return jsonify({
         "message": "イベントを開始しました",
         "event": event.to_dict()
@@ -495,6 +507,10 @@ def end_event(event_id):
     db.session.add(bot_message)
     db.session.commit()
     
+    publish_event(event_id, 'status_changed', {"status": event.status})
+    publish_event(event_id, 'message', system_message.to_dict())
+    publish_event(event_id, 'message', bot_message.to_dict())
+    
     return jsonify({
         "message": "イベントを終了しました",
         "event": event.to_dict()
@@ -520,10 +536,14 @@ def send_event_message(event_id):
         message_type=message_type,
         image_id=image_id,
     )
+    # 送信処理ではメッセージの追加だけをコミットし、未読数の更新などはコミット後にバックグラウンドで行う
     db.session.add(new_message)
     db.session.commit()
 
-    return jsonify(new_message.to_dict())
+    message_data = new_message.to_dict(read_count=0)
+    publish_event(event_id, 'message', message_data)
+
+    return jsonify(message_data)
 
 @event_bp.route("/<event_id>/members", methods=["GET"])
 def get_event_members(event_id):
@@ -585,38 +605,12 @@ def get_friends_events():
     if error_response:
         return jsonify(error_response), error_code
     
-    # フレンド（フォロー）関係を取得
-    friend_relationships = FriendRelationship.query.filter(
-        FriendRelationship.user_id == user.id,
-        FriendRelationship.status == 'accepted'
-    ).all()
-    
-    friend_ids = [fr.friend_id for fr in friend_relationships]
-    
-    if not friend_ids:
-        # フレンドがいない場合は空のリストを返す
-        return jsonify({"events": []})
-    
-    # フレンドが主催するイベントを取得
+    # フレンド（自分から送って承認されたもの）が主催するイベントをタイムラインから取得
     limit = request.args.get('limit', 10, type=int)
-    events = Event.query.filter(
-        Event.author_user_id.in_(friend_ids),
-        Event.is_deleted == False
-    ).order_by(Event.published_at.desc()).limit(limit).all()
+    events = get_timeline_events(user.id, limit)
     
-    # イベント情報の加工
-    events_data = []
-    for event in events:
-        event_data = event.to_dict()
-        
-        # タグ情報を追加
-        event_tags = db.session.query(TagMaster)\
-            .join(EventTagAssociation, TagMaster.id == EventTagAssociation.tag_id)\
-            .filter(EventTagAssociation.event_id == event.id)\
-            .all()
-            
-        event_data['tags'] = [{'id': tag.id, 'tag_name': tag.tag_name} for tag in event_tags]
-        events_data.append(event_data)
+    # イベント情報の加工（作成者・タグなどはまとめて取得）
+    events_data = serialize_events(events)
     
     return jsonify({
         "events": events_data
@@ -646,19 +640,8 @@ def get_joined_events():
         Event.is_deleted == False
     ).order_by(Event.published_at.desc()).all()
 
-    # event.to_dict()を使用してimage_urlを含む完全な情報を返す
-    events_data = []
-    for event in events:
-        event_data = event.to_dict()
-        
-        # タグ情報を追加（他のエンドポイントと同様）
-        event_tags = db.session.query(TagMaster)\
-            .join(EventTagAssociation, TagMaster.id == EventTagAssociation.tag_id)\
-            .filter(EventTagAssociation.event_id == event.id)\
-            .all()
-            
-        event_data['tags'] = [{'id': tag.id, 'tag_name': tag.tag_name} for tag in event_tags]
-        events_data.append(event_data)
+    # event.to_dict()の内容にタグ情報を加えて返す（作成者・タグなどはまとめて取得）
+    events_data = serialize_events(events)
 
     return jsonify({"events": events_data})
 
@@ -671,17 +654,12 @@ def get_event_weather_info_route(event_id):
     
     return event_weather_info_api(event_id)
 
-@event_bp.route('/<event_id>/advisor-response', methods=['POST'])
-def get_advisor_response(event_id):
+def _generate_advisor_reply(event_id, user_id, message, character_id, location_data):
     """
-    アドバイザー（ボット）の応答を生成するエンドポイント（AI判定による柔軟処理）
-    
-    音声チャットと同様の高度なAI分析機能：
-    1. AI解析による詳細な意図分析
-    2. 時間指定対応の天気情報取得
-    3. AI判定による柔軟な場所検索
-    4. ★新機能：会話ネタ判定による参加者・イベント情報活用
-    5. インテリジェントプロンプト生成
+    アドバイザー（ボット）の返信を生成して保存・配信する
+
+    Returns:
+        dict: 'bot_message'（保存したEventMessage）, 'response'（返信本文）, 'debug_info'
     """
     from app.routes.voice.routes import (
         ai_analyze_user_intent, 
@@ -692,10 +670,187 @@ def get_advisor_response(event_id):
         get_character_system_prompt,
         get_user_and_event_context  # ★新機能追加
     )
-    from app.utils.event import get_event_by_id
     import openai
     import os
 
+    # AI解析によるユーザーの意図分析（音声チャットと同じ高度分析）
+    current_app.logger.info(f"AI意図解析開始: '{message[:50]}...'")
+    ai_analysis = ai_analyze_user_intent(message)
+    current_app.logger.info(f"AI意図解析結果: {ai_analysis}")
+    
+    # 必要に応じてAPIを呼び出し
+    weather_data = None
+    nearby_places = None
+    conversation_context = None  # ★新機能追加
+    
+    # 天気情報が必要な場合のみ取得（AI判定による詳細天気）
+    if ai_analysis.get('needs_weather') and location_data:
+        current_app.logger.info("AI判定による詳細天気情報を取得中...")
+        time_spec = ai_generate_time_specification(ai_analysis.get('weather_analysis', {}))
+        weather_data = get_detailed_weather_info(event_id, location_data, time_spec)
+    
+    # 場所情報が必要な場合のみ取得（AI判定による拡張場所検索）
+    if ai_analysis.get('needs_location') and location_data:
+        current_app.logger.info("AI判定による拡張場所検索を実行中...")
+        nearby_places = ai_enhanced_nearby_places(
+            location_data['latitude'], 
+            location_data['longitude'],
+            ai_analysis.get('location_analysis', {})
+        )
+    
+    # ★★★ 新機能：会話ネタが必要な場合のユーザー・イベント情報取得 ★★★
+    if ai_analysis.get('needs_conversation_topics'):
+        current_app.logger.info("AI判定による会話ネタ用コンテキスト情報を取得中...")
+        conversation_context = get_user_and_event_context(event_id, user_id)
+        current_app.logger.info(f"コンテキスト取得結果: 参加者{len(conversation_context.get('user_profiles', []))}人, 共通興味{len(conversation_context.get('shared_interests', []))}個")
+    
+    # 過去の会話履歴取得（簡潔化）
+    chat_history = []
+    try:
+        messages = EventMessage.query.filter_by(event_id=event_id).order_by(EventMessage.timestamp.desc()).limit(3).all()
+        chat_history = [
+            {
+                "content": msg.content,
+                "is_bot": msg.message_type.startswith('bot_') or msg.message_type == 'bot',
+                "timestamp": msg.timestamp.isoformat() if msg.timestamp else None
+            }
+            for msg in messages if msg.content
+        ]
+        chat_history.reverse()
+    except Exception as e:
+        current_app.logger.error(f"会話履歴取得エラー: {str(e)}")
+    
+    # AI解析に基づくインテリジェントプロンプトを作成（音声チャットと同じシステム）
+    system_prompt = create_ai_intelligent_prompt(
+        character_id, 
+        message, 
+        ai_analysis, 
+        weather_data, 
+        nearby_places,
+        conversation_context  # ★新機能追加
+    )
+    
+    # ChatGPT APIでレスポンスを生成（音声チャットと同じ設定）
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        raise Exception("OPENAI_API_KEY環境変数が設定されていません")
+    
+    client = openai.OpenAI(api_key=openai_api_key)
+    
+    # 会話履歴を考慮したメッセージ構築
+    messages_for_api = [{"role": "system", "content": system_prompt}]
+    
+    # 簡潔な履歴を追加
+    if chat_history:
+        recent_history = chat_history[-2:] if len(chat_history) > 2 else chat_history
+        for msg in recent_history:
+            role = "assistant" if msg.get("is_bot") else "user"
+            messages_for_api.append({"role": role, "content": msg.get("content", "")})
+    
+    # 最新のユーザーメッセージを追加
+    messages_for_api.append({"role": "user", "content": message})
+    
+    current_app.logger.info("ChatGPT API呼び出し開始（テキストチャット版）")
+    chat_response = client.chat.completions.create(
+        model="gpt-4.1-mini",
+        messages=messages_for_api,
+        max_tokens=300,  # 会話が途切れないよう増量
+        temperature=0.8
+    )
+    
+    advisor_response = chat_response.choices[0].message.content
+    current_app.logger.info(f"AI応答生成成功 (GPT-4.1-mini): {advisor_response[:100]}...")
+    
+    # アドバイザーの応答をメッセージとして保存
+    bot_message = EventMessage(
+        id=str(uuid.uuid4()),
+        event_id=event_id,
+        content=advisor_response,
+        message_type=f'bot_{character_id}',
+        timestamp=datetime.now(JST),
+        metadata=json.dumps({"character_id": character_id})
+    )
+    
+    db.session.add(bot_message)
+    db.session.commit()
+    publish_event(event_id, 'message', bot_message.to_dict(read_count=0))
+
+    return {
+        'bot_message': bot_message,
+        'response': advisor_response,
+        'debug_info': {
+            'ai_analysis': ai_analysis,
+            'weather_used': weather_data is not None,
+            'location_used': nearby_places is not None,
+            'conversation_context_used': conversation_context is not None,  # ★新機能追加
+            'weather_data': weather_data,
+            'location_count': len(nearby_places) if nearby_places else 0,
+            'participant_count': len(conversation_context.get('user_profiles', [])) if conversation_context else 0,  # ★新機能追加
+            'shared_interests_count': len(conversation_context.get('shared_interests', [])) if conversation_context else 0  # ★新機能追加
+        }
+    }
+
+
+def _save_advisor_fallback(event_id, character_id, error=True):
+    """
+    返信の生成に失敗した場合のキャラクターごとの応答を保存・配信する
+
+    Returns:
+        tuple: (保存したEventMessage, 応答本文)
+    """
+    # キャラクターごとのエラー応答
+    error_responses = {
+        "nyanta": "ごめんニャ、ちょっと今処理が混んでるみたいニャ。もう一度話しかけてくれるニャ？💫",
+        "hitsuji": "申し訳ありません～。少し処理に時間がかかっているようです～。もう一度お願いできますか～？✨",
+        "koko": "ごめんね！ちょっと今システムが忙しいみたい！もう一度聞いてくれる？🌟",
+        "fukurou": "申し訳ございません。現在処理に時間を要しております。少々お待ちいただくか、再度ご質問いただけますと幸いです📚💫",
+        "toraberu": "おっと！ちょっと今システムが忙しいみたいだぜ！もう一度話しかけてくれるかな？🗺️✈️"
+    }
+    
+    fallback_response = error_responses.get(
+        character_id,
+        "申し訳ありません、AI応答の生成中にエラーが発生しました。もう一度お試しください。"
+    )
+    
+    bot_message = EventMessage(
+        id=str(uuid.uuid4()),
+        event_id=event_id,
+        content=fallback_response,
+        message_type=f'bot_{character_id}',
+        timestamp=datetime.now(JST),
+        metadata=json.dumps({"character_id": character_id, "error": error})
+    )
+    db.session.add(bot_message)
+    db.session.commit()
+    publish_event(event_id, 'message', bot_message.to_dict(read_count=0))
+    return bot_message, fallback_response
+
+
+def _advisor_reply_job(event_id, user_id, message, character_id, location_data):
+    """バックグラウンドでアドバイザーの返信を生成する（失敗時はフォールバック応答を保存）"""
+    try:
+        _generate_advisor_reply(event_id, user_id, message, character_id, location_data)
+    except Exception as e:
+        current_app.logger.error(f"AI判定アドバイザー応答生成エラー（非同期）: {str(e)}")
+        current_app.logger.error(traceback.format_exc())
+        db.session.rollback()
+        _save_advisor_fallback(event_id, character_id)
+
+
+@event_bp.route('/<event_id>/advisor-response', methods=['POST'])
+def get_advisor_response(event_id):
+    """
+    アドバイザー（ボット）の応答を生成するエンドポイント（AI判定による柔軟処理）
+    
+    音声チャットと同様の高度なAI分析機能：
+    1. AI解析による詳細な意図分析
+    2. 時間指定対応の天気情報取得
+    3. AI判定による柔軟な場所検索
+    4. ★新機能：会話ネタ判定による参加者・イベント情報活用
+    5. インテリジェントプロンプト生成
+    """
+    from app.utils.event import get_event_by_id
+
     # ユーザー認証
     user, error_response, error_code = get_authenticated_user()
     if error_response:
@@ -734,155 +889,35 @@ def get_advisor_response(event_id):
         )
         db.session.add(user_message)
         db.session.commit()
-
-        # AI解析によるユーザーの意図分析（音声チャットと同じ高度分析）
-        current_app.logger.info(f"AI意図解析開始: '{message[:50]}...'")
-        ai_analysis = ai_analyze_user_intent(message)
-        current_app.logger.info(f"AI意図解析結果: {ai_analysis}")
-        
-        # 必要に応じてAPIを呼び出し
-        weather_data = None
-        nearby_places = None
-        conversation_context = None  # ★新機能追加
-        
-        # 天気情報が必要な場合のみ取得（AI判定による詳細天気）
-        if ai_analysis.get('needs_weather') and location_data:
-            current_app.logger.info("AI判定による詳細天気情報を取得中...")
-            time_spec = ai_generate_time_specification(ai_analysis.get('weather_analysis', {}))
-            weather_data = get_detailed_weather_info(event_id, location_data, time_spec)
-        
-        # 場所情報が必要な場合のみ取得（AI判定による拡張場所検索）
-        if ai_analysis.get('needs_location') and location_data:
-            current_app.logger.info("AI判定による拡張場所検索を実行中...")
-            nearby_places = ai_enhanced_nearby_places(
-                location_data['latitude'], 
-                location_data['longitude'],
-                ai_analysis.get('location_analysis', {})
-            )
-        
-        # ★★★ 新機能：会話ネタが必要な場合のユーザー・イベント情報取得 ★★★
-        if ai_analysis.get('needs_conversation_topics'):
-            current_app.logger.info("AI判定による会話ネタ用コンテキスト情報を取得中...")
-            conversation_context = get_user_and_event_context(event_id, user.id)
-            current_app.logger.info(f"コンテキスト取得結果: 参加者{len(conversation_context.get('user_profiles', []))}人, 共通興味{len(conversation_context.get('shared_interests', []))}個")
-        
-        # 過去の会話履歴取得（簡潔化）
-        chat_history = []
-        try:
-            messages = EventMessage.query.filter_by(event_id=event_id).order_by(EventMessage.timestamp.desc()).limit(3).all()
-            chat_history = [
-                {
-                    "content": msg.content,
-                    "is_bot": msg.message_type.startswith('bot_') or msg.message_type == 'bot',
-                    "timestamp": msg.timestamp.isoformat() if msg.timestamp else None
-                }
-                for msg in messages if msg.content
-            ]
-            chat_history.reverse()
-        except Exception as e:
-            current_app.logger.error(f"会話履歴取得エラー: {str(e)}")
-        
-        # AI解析に基づくインテリジェントプロンプトを作成（音声チャットと同じシステム）
-        system_prompt = create_ai_intelligent_prompt(
-            character_id, 
-            message, 
-            ai_analysis, 
-            weather_data, 
-            nearby_places,
-            conversation_context  # ★新機能追加
-        )
-        
-        # ChatGPT APIでレスポンスを生成（音声チャットと同じ設定）
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key:
-            raise Exception("OPENAI_API_KEY環境変数が設定されていません")
-        
-        client = openai.OpenAI(api_key=openai_api_key)
-        
-        # 会話履歴を考慮したメッセージ構築
-        messages_for_api = [{"role": "system", "content": system_prompt}]
-        
-        # 簡潔な履歴を追加
-        if chat_history:
-            recent_history = chat_history[-2:] if len(chat_history) > 2 else chat_history
-            for msg in recent_history:
-                role = "assistant" if msg.get("is_bot") else "user"
-                messages_for_api.append({"role": role, "content": msg.get("content", "")})
+        publish_event(event_id, 'message', user_message.to_dict(read_count=0))
         
-        # 最新のユーザーメッセージを追加
-        messages_for_api.append({"role": "user", "content": message})
-        
-        current_app.logger.info("ChatGPT API呼び出し開始（テキストチャット版）")
-        chat_response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=messages_for_api,
-            max_tokens=300,  # 会話が途切れないよう増量
-            temperature=0.8
-        )
+        # async=true の場合はメッセージの保存だけで応答し、ボットの返信はバックグラウンドで生成する
+        # （返信はトークルームのストリームで配信される）
+        if data.get('async'):
+            enqueue(_advisor_reply_job, event_id, user.id, message, character_id, location_data)
+            return jsonify({
+                'message': 'アドバイザー応答の生成を開始しました',
+                'user_message_id': user_message.id
+            }), 202
         
-        advisor_response = chat_response.choices[0].message.content
-        current_app.logger.info(f"AI応答生成成功 (GPT-4.1-mini): {advisor_response[:100]}...")
-        
-        # アドバイザーの応答をメッセージとして保存
-        bot_message = EventMessage(
-            id=str(uuid.uuid4()),
-            event_id=event_id,
-            content=advisor_response,
-            message_type=f'bot_{character_id}',
-            timestamp=datetime.now(JST),
-            metadata=json.dumps({"character_id": character_id})
-        )
-        
-        db.session.add(bot_message)
-        db.session.commit()
+        reply = _generate_advisor_reply(event_id, user.id, message, character_id, location_data)
         
         # レスポンスを返す（音声チャットと同様のデバッグ情報付き）
         return jsonify({
-            'response': advisor_response,
+            'response': reply['response'],
             'message': 'AI判定によるアドバイザー応答を生成しました',
-            'message_id': bot_message.id,
-            'debug_info': {
-                'ai_analysis': ai_analysis,
-                'weather_used': weather_data is not None,
-                'location_used': nearby_places is not None,
-                'conversation_context_used': conversation_context is not None,  # ★新機能追加
-                'weather_data': weather_data,
-                'location_count': len(nearby_places) if nearby_places else 0,
-                'participant_count': len(conversation_context.get('user_profiles', [])) if conversation_context else 0,  # ★新機能追加
-                'shared_interests_count': len(conversation_context.get('shared_interests', [])) if conversation_context else 0  # ★新機能追加
-            }
+            'message_id': reply['bot_message'].id,
+            'debug_info': reply['debug_info']
         }), 200
         
     except Exception as e:
         current_app.logger.error(f"AI判定アドバイザー応答生成エラー: {str(e)}")
         current_app.logger.error(traceback.format_exc())
-        
-        # キャラクターごとのエラー応答
-        error_responses = {
-            "nyanta": "ごめんニャ、ちょっと今処理が混んでるみたいニャ。もう一度話しかけてくれるニャ？💫",
-            "hitsuji": "申し訳ありません～。少し処理に時間がかかっているようです～。もう一度お願いできますか～？✨",
-            "koko": "ごめんね！ちょっと今システムが忙しいみたい！もう一度聞いてくれる？🌟",
-            "fukurou": "申し訳ございません。現在処理に時間を要しております。少々お待ちいただくか、再度ご質問いただけますと幸いです📚💫",
-            "toraberu": "おっと！ちょっと今システムが忙しいみたいだぜ！もう一度話しかけてくれるかな？🗺️✈️"
-        }
-        
-        fallback_response = error_responses.get(
-            character_id,
-            "申し訳ありません、AI応答の生成中にエラーが発生しました。もう一度お試しください。"
-        )
+        db.session.rollback()
         
         # エラー時もメッセージとして保存
         try:
-            bot_message = EventMessage(
-                id=str(uuid.uuid4()),
-                event_id=event_id,
-                content=fallback_response,
-                message_type=f'bot_{character_id}',
-                timestamp=datetime.now(JST),
-                metadata=json.dumps({"character_id": character_id, "error": True})
-            )
-            db.session.add(bot_message)
-            db.session.commit()
+            bot_message, fallback_response = _save_advisor_fallback(event_id, character_id)
             
             return jsonify({
                 'response': fallback_response,
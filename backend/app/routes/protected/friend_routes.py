@@ -3,6 +3,14 @@ from app.routes.protected.routes import get_authenticated_user
 from app.models.user import User
 from app.models.message import FriendRelationship, DirectMessage
 from app.models import db
+from app.utils.pagination import keyset_union, decode_cursor, next_cursor
+from app.utils.serializers import preload
+from app.utils.friend_graph import get_adjacency, are_friends, invalidate_relationship
+from app.utils.timeline import backfill_timeline
+from app.utils.db_routing import use_primary
+from app.utils.conversations import (
+    record_direct_message, mark_conversation_read, get_conversation_overview
+)
 import uuid
 from datetime import datetime, timezone, timedelta
 import json
@@ -20,38 +28,21 @@ def get_friends():
     if error_response:
         return jsonify(error_response), error_code
     
-    # 承認済みのフレンド関係を取得
-    sent_requests = FriendRelationship.query.filter_by(
-        user_id=user.id,
-        status='accepted'
-    ).all()
-    
-    received_requests = FriendRelationship.query.filter_by(
-        friend_id=user.id,
-        status='accepted'
-    ).all()
+    # 承認済みのフレンド関係を取得（キャッシュ済みの隣接リストから）
+    adjacency = get_adjacency(user.id)
+    # 自分がリクエストを送った側、受けた側の順に並べる
+    edges = list(adjacency.following.values()) + list(adjacency.followers.values())
+    users = preload(User, [edge.other_id for edge in edges])
     
     # フレンドリスト作成
     friends = []
-    
-    # 自分がリクエストを送った側のフレンド
-    for request in sent_requests:
-        friend = User.query.get(request.friend_id)
+    for edge in edges:
+        friend = users.get(edge.other_id)
         if friend:
             friends.append({
                 "user": friend.to_dict(),
-                "relationship_id": request.id,
-                "since": request.updated_at.isoformat()
-            })
-    
-    # 自分がリクエストを受けた側のフレンド
-    for request in received_requests:
-        friend = User.query.get(request.user_id)
-        if friend:
-            friends.append({
-                "user": friend.to_dict(),
-                "relationship_id": request.id,
-                "since": request.updated_at.isoformat()
+                "relationship_id": edge.relationship_id,
+                "since": edge.updated_at.isoformat()
             })
     
     return jsonify({"friends": friends, "total": len(friends)})
@@ -64,37 +55,31 @@ def get_friend_requests():
     if error_response:
         return jsonify(error_response), error_code
     
-    # 保留中のフレンドリクエスト（自分宛）を取得
-    pending_requests = FriendRelationship.query.filter_by(
-        friend_id=user.id,
-        status='pending'
-    ).all()
-    
-    # 送信したリクエスト（自分から）を取得
-    sent_requests = FriendRelationship.query.filter_by(
-        user_id=user.id,
-        status='pending'
-    ).all()
+    # 保留中のフレンドリクエスト（自分宛・自分から）を取得
+    adjacency = get_adjacency(user.id)
+    pending_requests = list(adjacency.received_requests.values())
+    sent_requests = list(adjacency.sent_requests.values())
+    users = preload(User, [edge.other_id for edge in pending_requests + sent_requests])
     
     # 結果を整形
     received = []
-    for request in pending_requests:
-        sender = User.query.get(request.user_id)
+    for edge in pending_requests:
+        sender = users.get(edge.other_id)
         if sender:
             received.append({
-                "id": request.id,
+                "id": edge.relationship_id,
                 "sender": sender.to_dict(),
-                "created_at": request.created_at.isoformat()
+                "created_at": edge.created_at.isoformat()
             })
     
     sent = []
-    for request in sent_requests:
-        receiver = User.query.get(request.friend_id)
+    for edge in sent_requests:
+        receiver = users.get(edge.other_id)
         if receiver:
             sent.append({
-                "id": request.id,
+                "id": edge.relationship_id,
                 "receiver": receiver.to_dict(),
-                "created_at": request.created_at.isoformat()
+                "created_at": edge.created_at.isoformat()
             })
     
     return jsonify({
@@ -127,10 +112,8 @@ def send_friend_request():
         return jsonify({"error": "指定されたユーザーが見つかりません"}), 404
     
     # 既存の関係をチェック
-    existing_relationship = FriendRelationship.query.filter(
-        ((FriendRelationship.user_id == user.id) & (FriendRelationship.friend_id == friend_id)) |
-        ((FriendRelationship.user_id == friend_id) & (FriendRelationship.friend_id == user.id))
-    ).first()
+    edge = get_adjacency(user.id).relationship_with(friend_id)
+    existing_relationship = FriendRelationship.query.get(edge.relationship_id) if edge else None
     
     if existing_relationship:
         if existing_relationship.status == 'accepted':
@@ -143,6 +126,10 @@ def send_friend_request():
                 existing_relationship.status = 'accepted'
                 existing_relationship.updated_at = datetime.now(JST)
                 db.session.commit()
+                invalidate_relationship(user.id, friend_id)
+                # 相手（フォローした側）のタイムラインに自分のイベントを追加する
+                backfill_timeline(friend_id, [user.id])
+                db.session.commit()
                 
                 return jsonify({
                     "message": "フレンドリクエストを承認しました",
@@ -165,6 +152,7 @@ def send_friend_request():
     
     db.session.add(relationship)
     db.session.commit()
+    invalidate_relationship(user.id, friend_id)
     
     return jsonify({
         "message": "フレンドリクエストを送信しました",
@@ -196,6 +184,10 @@ def accept_friend_request(request_id):
     request.status = 'accepted'
     request.updated_at = datetime.now(JST)
     
+    db.session.commit()
+    invalidate_relationship(request.user_id, request.friend_id)
+    # フォローした側のタイムラインに自分のイベントを追加する
+    backfill_timeline(request.user_id, [request.friend_id])
     db.session.commit()
     
     return jsonify({
@@ -229,6 +221,7 @@ def reject_friend_request(request_id):
     request.updated_at = datetime.now(JST)
     
     db.session.commit()
+    invalidate_relationship(request.user_id, request.friend_id)
     
     return jsonify({
         "message": "フレンドリクエストを拒否しました"
@@ -236,6 +229,7 @@ def reject_friend_request(request_id):
 
 # ダイレクトメッセージの取得
 @friend_bp.route("/direct-messages/<friend_id>", methods=["GET", "OPTIONS"])
+@use_primary  # 未読を既読にするため、レプリカの古い既読状態を使わない
 def get_direct_messages(friend_id):
     if request.method == "OPTIONS":
         # プリフライトリクエストに対しては何もしないで 200 を返す
@@ -254,44 +248,43 @@ def get_direct_messages(friend_id):
     
     # フレンド関係の確認は行わない
     """
-    is_friend = FriendRelationship.query.filter(
-        ((FriendRelationship.user_id == user.id) & (FriendRelationship.friend_id == friend_id)) |
-        ((FriendRelationship.user_id == friend_id) & (FriendRelationship.friend_id == user.id)),
-        FriendRelationship.status == 'accepted'
-    ).first()
-    
-    if not is_friend:
+    if not are_friends(user.id, friend_id):
         return jsonify({"error": "フレンドのメッセージのみ閲覧できます"}), 403
     """
-    # クエリパラメータ
+    # クエリパラメータ（cursorがあればキーセット、なければ従来のoffsetでページング）
     limit = request.args.get('limit', default=50, type=int)
     offset = request.args.get('offset', default=0, type=int)
-    
-    # メッセージを取得（新しい順）
-    messages = DirectMessage.query.filter(
-        ((DirectMessage.sender_id == user.id) & (DirectMessage.receiver_id == friend_id)) |
-        ((DirectMessage.sender_id == friend_id) & (DirectMessage.receiver_id == user.id))
-    ).order_by(
-        DirectMessage.sent_at.desc()
-    ).offset(offset).limit(limit).all()
+    cursor = decode_cursor(request.args.get('cursor'))
+    
+    # メッセージを取得（新しい順）。送信・受信の方向ごとにインデックスの範囲検索を行い、まとめて並べ直す
+    messages = keyset_union(
+        DirectMessage,
+        [
+            DirectMessage.query.filter_by(sender_id=sender_id, receiver_id=receiver_id)
+            for sender_id, receiver_id in {(user.id, friend_id), (friend_id, user.id)}
+        ],
+        'sent_at', cursor, limit, offset=0 if cursor else offset
+    )
     
     # 結果を整形
     result = []
     for message in messages:
         result.append(message.to_dict())
     
-    # 自分宛の未読メッセージを既読にする
-    for message in messages:
-        if message.receiver_id == user.id and not message.is_read:
-            message.is_read = True
-            message.read_at = datetime.now(JST)
-    
-    db.session.commit()
+    # 自分宛の未読メッセージを既読にする（ページ内に未読がある場合だけ1回のUPDATEで）
+    unread = [message for message in messages if message.receiver_id == user.id and not message.is_read]
+    if unread:
+        mark_conversation_read(user.id, friend_id, max((message.sent_at for message in unread if message.sent_at), default=None))
+        db.session.commit()
     
     # 新しい順で返されたメッセージを古い順に並び替えて返す
     result.reverse()
     
-    return jsonify({"messages": result, "total": len(result)})
+    return jsonify({
+        "messages": result,
+        "total": len(result),
+        "next_cursor": next_cursor(messages, limit, 'sent_at')
+    })
 
 # ダイレクトメッセージの送信
 @friend_bp.route("/direct-message", methods=["POST", "OPTIONS"])
@@ -336,13 +329,7 @@ def send_direct_message():
     
     # フレンド関係の確認は行わない
     """
-    is_friend = FriendRelationship.query.filter(
-        ((FriendRelationship.user_id == user.id) & (FriendRelationship.friend_id == friend_id)) |
-        ((FriendRelationship.user_id == friend_id) & (FriendRelationship.friend_id == user.id)),
-        FriendRelationship.status == 'accepted'
-    ).first()
-    
-    if not is_friend:
+    if not are_friends(user.id, friend_id):
         return jsonify({"error": "フレンドのメッセージのみ閲覧できます"}), 403
     """
     
@@ -360,6 +347,7 @@ def send_direct_message():
     )
     
     db.session.add(message)
+    record_direct_message(message)
     db.session.commit()
     
     return jsonify({
@@ -374,26 +362,6 @@ def get_dm_overview():
     if error_response:
         return jsonify(error_response), error_code
 
-    # 自分が関与するDMを新しい順に取得
-    all_messages = DirectMessage.query.filter(
-        (DirectMessage.sender_id == user.id) | (DirectMessage.receiver_id == user.id)
-    ).order_by(DirectMessage.sent_at.desc()).all()
-
-    seen_partners = set()
-    overview = []
-
-    for msg in all_messages:
-        # 相手のID・ユーザー情報を取得
-        partner = msg.receiver if msg.sender_id == user.id else msg.sender
-        if partner.id in seen_partners:
-            continue
-
-        seen_partners.add(partner.id)
-        overview.append({
-            "partner_id": partner.id,
-            "partner": partner.to_dict(),  # 名前や画像も含まれる
-            "latest_message": msg.to_dict()
-        })
-
-    return jsonify({"overview": overview})
+    # 会話一覧から相手ごとの最新メッセージを取得（既存のDMはマイグレーションで会話一覧に移行済み）
+    return jsonify({"overview": get_conversation_overview(user.id)})
 
@@ -1,19 +1,29 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from app.routes.protected.routes import get_authenticated_user
 from app.models.user import User
 from app.models.event import Event, UserMemberGroup
-from app.models.message import EventMessage, MessageReadStatus
+from app.models.message import EventMessage
 from app.models import db
+from app.utils.jwt import decode_token
+from app.utils.db_routing import use_primary
+from app.utils.pagination import apply_keyset, decode_cursor, next_cursor
+from app.utils.read_tracking import mark_event_messages_read, get_unread_badges
+from app.utils.serializers import serialize_event_messages
+from app.utils.realtime import broker, event_room, publish_event, format_sse, parse_cursor, REALTIME_BACKLOG_SIZE
 import uuid
 from datetime import datetime, timezone, timedelta
 import json
 
 JST = timezone(timedelta(hours=9))
 
+# SSE接続を維持するためのコメント送信間隔（秒）
+STREAM_HEARTBEAT_INTERVAL = 15
+
 message_bp = Blueprint("message", __name__)
 
 # イベントメッセージ関連のAPI
 @message_bp.route("/event/<event_id>/messages", methods=["GET"])
+@use_primary  # 既読位置を読んで進めるため、レプリカの古い既読位置を使わない
 def get_event_messages(event_id):
     # ユーザー認証
     user, error_response, error_code = get_authenticated_user()
@@ -35,49 +45,46 @@ def get_event_messages(event_id):
         if not is_member:
             return jsonify({"error": "このイベントのメッセージを閲覧する権限がありません"}), 403
     
-    # クエリパラメータ
+    # クエリパラメータ（cursorがあればキーセット、なければ従来のoffsetでページング）
     limit = request.args.get('limit', default=50, type=int)
     offset = request.args.get('offset', default=0, type=int)
+    cursor = decode_cursor(request.args.get('cursor'))
     
     # メッセージを取得（新しい順）
-    messages = EventMessage.query.filter_by(
-        event_id=event_id
-    ).order_by(
-        EventMessage.timestamp.desc()
-    ).offset(offset).limit(limit).all()
-    
-    # 結果を整形
-    result = []
-    for message in messages:
-        result.append(message.to_dict())
-    
-    # 未読メッセージを既読にする
-    for message in messages:
-        # 自分のメッセージは既読にしない
-        if message.sender_user_id == user.id:
-            continue
-        
-        # 既に既読か確認
-        read_status = MessageReadStatus.query.filter_by(
-            message_id=message.id,
-            user_id=user.id
-        ).first()
-        
-        if not read_status:
-            # 既読ステータスを作成
-            read_status = MessageReadStatus(
-                message_id=message.id,
-                user_id=user.id,
-                read_at=datetime.now(JST)
-            )
-            db.session.add(read_status)
+    query = apply_keyset(
+        EventMessage.query.filter_by(event_id=event_id),
+        EventMessage.timestamp, EventMessage.id, cursor
+    )
+    if not cursor and offset:
+        query = query.offset(offset)
+    messages = query.limit(limit).all()
+    
+    # 結果を整形（送信者・画像・既読数はまとめて取得）
+    result = serialize_event_messages(messages)
+    
+    # 未読メッセージを既読にする（既読位置より新しいものだけまとめて処理）
+    mark_event_messages_read(user.id, event_id, messages)
     
     db.session.commit()
     
     # 新しい順で返されたメッセージを古い順に並び替えて返す
     result.reverse()
     
-    return jsonify({"messages": result, "total": len(result)})
+    return jsonify({
+        "messages": result,
+        "total": len(result),
+        "next_cursor": next_cursor(messages, limit, 'timestamp')
+    })
+
+@message_bp.route("/badges", methods=["GET"])
+def get_badges():
+    # ユーザー認証
+    user, error_response, error_code = get_authenticated_user()
+    if error_response:
+        return jsonify(error_response), error_code
+    
+    # 書き込み時に更新している未読数を読むだけなので頻繁に呼び出してよい
+    return jsonify(get_unread_badges(user.id))
 
 @message_bp.route("/event/<event_id>/message", methods=["POST"])
 def send_event_message(event_id):
@@ -127,11 +134,90 @@ def send_event_message(event_id):
         metadata=json.dumps(metadata) if metadata else None
     )
     
+    # 送信処理ではメッセージの追加だけをコミットし、未読数の更新などはコミット後にバックグラウンドで行う
     db.session.add(message)
     db.session.commit()
     
+    message_data = message.to_dict(read_count=0)
+    publish_event(event_id, 'message', message_data)
+    
     return jsonify({
         "message": "メッセージを送信しました",
-        "event_message": message.to_dict()
-    }) 
+        "event_message": message_data
+    })
+
+@message_bp.route("/event/<event_id>/stream", methods=["GET"])
+def stream_event_messages(event_id):
+    """
+    イベントのトークルームの更新をServer-Sent Eventsで配信する
+
+    新しいメッセージ・Botの応答・メンバーの参加/退出をプッシュする。
+    EventSourceはヘッダーを付けられないため、トークンはクエリパラメータでも受け付ける。
+    再接続時はLast-Event-IDヘッダー（またはcursorパラメータ）以降のイベントを再送する。
+    """
+    token = request.args.get('token')
+    if token and not request.headers.get("Authorization"):
+        user_id = decode_token(token)
+        user = User.query.get(user_id) if user_id else None
+        if not user:
+            return jsonify({"error": "無効または期限切れのトークンです"}), 401
+    else:
+        user, error_response, error_code = get_authenticated_user()
+        if error_response:
+            return jsonify(error_response), error_code
+    
+    event = Event.query.get(event_id)
+    if not event:
+        return jsonify({"error": "イベントが見つかりません"}), 404
+    
+    # 参加しているか確認（イベント作成者または参加者のみ購読可能）
+    if event.author_user_id != user.id:
+        is_member = UserMemberGroup.query.filter_by(
+            user_id=user.id,
+            event_id=event_id
+        ).first()
+        
+        if not is_member:
+            return jsonify({"error": "このイベントのメッセージを閲覧する権限がありません"}), 403
+    
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    subscription, missed, complete = broker.subscribe(event_room(event_id), cursor)
+    
+    # バックログで再送しきれない場合はDBからカーソル以降のメッセージを補う
+    replay = []
+    parsed = parse_cursor(cursor) if cursor else None
+    if parsed and not complete:
+        since = datetime.fromtimestamp(parsed[0] / 1000, JST).replace(tzinfo=None)
+        replay_messages = EventMessage.query.filter(
+            EventMessage.event_id == event_id,
+            EventMessage.timestamp > since
+        ).order_by(EventMessage.timestamp.asc()).limit(REALTIME_BACKLOG_SIZE).all()
+        replay_ids = {message.id for message in replay_messages}
+        for message, data in zip(replay_messages, serialize_event_messages(replay_messages)):
+            millis = int(message.timestamp.replace(tzinfo=JST).timestamp() * 1000) if message.timestamp else parsed[0]
+            replay.append({'cursor': f"{millis}-0", 'type': 'message', 'data': data})
+        # DBから補ったメッセージとバックログの重複を除く
+        missed = [e for e in missed if not (e['type'] == 'message' and e['data'].get('id') in replay_ids)]
+    
+    # ストリーム中にDB接続を保持しないようにセッションを閉じる
+    db.session.close()
+    
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            for item in replay + missed:
+                yield format_sse(item)
+            while not subscription.closed:
+                item = subscription.get(timeout=STREAM_HEARTBEAT_INTERVAL)
+                if item is None:
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(item)
+        finally:
+            broker.unsubscribe(subscription)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginxでバッファリングさせない
+    return response
 
@@ -4,6 +4,8 @@ from app.models.user import User
 from app.models.event import Event, UserMemberGroup, TagMaster, UserTagAssociation
 from app.models.message import FriendRelationship
 from app.models import db
+from app.utils import refdata
+from app.utils.http_cache import conditional
 import uuid
 import logging
 from datetime import datetime, timezone
@@ -31,6 +33,7 @@ def get_authenticated_user():
     return user, None, None
 
 @protected_bp.route("/mypage", methods=["GET", "OPTIONS"])
+@conditional('user', 'refdata', personalized=True, scope='viewer')
 def mypage():
     if request.method == "OPTIONS":
         # Flask-CORSがヘッダーを追加してくれるので、空の200 OKで返して良い
@@ -49,9 +52,9 @@ def mypage():
     
     favorite_tags = []
     for assoc in user_tags:
-        tag = TagMaster.query.get(assoc.tag_id)
+        tag = refdata.tags.get(assoc.tag_id)
         if tag:
-            favorite_tags.append(tag.tag_name)
+            favorite_tags.append(tag['tag_name'])
     
     # ユーザーが参加しているイベント数を取得
     joined_events_count = UserMemberGroup.query.filter_by(user_id=user.id).count()
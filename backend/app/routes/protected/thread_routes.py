@@ -4,6 +4,11 @@ from app.models.user import User
 from app.models.thread import Thread, ThreadMessage, UserHeartThread
 from app.models.event import TagMaster, ThreadTagAssociation
 from app.models import db
+from app.utils.pagination import apply_keyset, decode_cursor, next_cursor
+from app.utils.serializers import serialize_threads, serialize_thread_messages
+from app.utils.tag_filter import resolve_tag_ids, parse_tag_mode, filter_by_tags
+from app.utils.http_cache import conditional
+from app.utils.image_gc import delete_unreferenced_images
 import uuid
 from datetime import datetime, timezone, timedelta
 import json
@@ -13,6 +18,7 @@ JST = timezone(timedelta(hours=9))
 thread_bp = Blueprint("thread", __name__)
 
 @thread_bp.route("/threads", methods=["GET"])
+@conditional('threads', 'users', 'refdata', personalized=True)
 def get_threads():
     # ユーザー認証（トークンがあれば使用、なければNoneで続行）
     user = None
@@ -25,33 +31,39 @@ def get_threads():
     per_page = request.args.get('per_page', default=10, type=int)
     area_id = request.args.get('area_id')
     tags = request.args.getlist('tags')
+    # and: 指定したタグをすべて持つスレッド / or: いずれかのタグを持つスレッド
+    tag_mode = parse_tag_mode(request.args.get('tag_mode'))
 
     query = Thread.query
 
     if area_id:
         query = query.filter_by(area_id=area_id)
 
+    # タグで絞り込む（存在しないタグ名は無視する）
     if tags:
-        for tag in tags:
-            tag_master = TagMaster.query.filter_by(tag_name=tag).first()
-            if tag_master:
-                thread_ids = db.session.query(ThreadTagAssociation.thread_id).filter_by(
-                    tag_id=tag_master.id
-                ).all()
-                thread_ids = [id[0] for id in thread_ids]
-                query = query.filter(Thread.id.in_(thread_ids))
+        query = filter_by_tags(
+            query, ThreadTagAssociation, ThreadTagAssociation.thread_id, Thread.id,
+            resolve_tag_ids(tags), mode=tag_mode
+        )
+
+    # cursorがあればキーセット、なければ従来のpageでページング
+    cursor = decode_cursor(request.args.get('cursor'))
 
-    total = query.count()
+    # 総件数はpageでページングする場合だけ数える（cursorで続きを読む場合は全件の走査を避ける）
+    total = None if cursor else query.count()
 
-    offset = (page - 1) * per_page
-    threads = query.order_by(Thread.published_at.desc()).offset(offset).limit(per_page).all()
+    query = apply_keyset(query, Thread.published_at, Thread.id, cursor)
+    if not cursor:
+        query = query.offset((page - 1) * per_page)
+    threads = query.limit(per_page).all()
 
-    result = []
-    for thread in threads:
-        thread_dict = thread.to_dict(current_user_id=user.id if user else None)
-        result.append(thread_dict)
+    result = serialize_threads(threads, current_user_id=user.id if user else None)
 
-    return jsonify({"threads": result, "total": total})
+    return jsonify({
+        "threads": result,
+        "total": total,
+        "next_cursor": next_cursor(threads, per_page, 'published_at')
+    })
 
 
 @thread_bp.route("/<thread_id>", methods=["GET"])
@@ -75,38 +87,11 @@ def get_thread(thread_id):
         ThreadMessage.timestamp.asc()
     ).all()
     
-    # メッセージを整形
-    messages_data = [message.to_dict() for message in messages]
+    # メッセージを整形（送信者・画像はまとめて取得）
+    messages_data = serialize_thread_messages(messages)
     
-    # スレッドデータを取得
-    thread_data = thread.to_dict(current_user_id=user.id if user else None)
-    
-    # タグを取得
-    thread_tags = ThreadTagAssociation.query.filter_by(
-        thread_id=thread_id
-    ).join(TagMaster, TagMaster.id == ThreadTagAssociation.tag_id).all()
-    
-    tags = []
-    for tag_assoc in thread_tags:
-        tag = TagMaster.query.get(tag_assoc.tag_id)
-        if tag:
-            tags.append({
-                'id': tag.id,
-                'name': tag.tag_name
-            })
-    
-    # ログインしている場合だけいいね判定
-    if user:
-        is_hearted = UserHeartThread.query.filter_by(
-            user_id=user.id,
-            thread_id=thread_id
-        ).first() is not None
-    else:
-        is_hearted = False
-    
-    # thread_dataにタグといいね情報を追加
-    thread_data['tags'] = tags
-    thread_data['is_hearted'] = is_hearted
+    # スレッドデータを取得（タグ・いいね情報を含む）
+    thread_data = serialize_threads([thread], current_user_id=user.id if user else None)[0]
     
     # 結果を返す
     return jsonify({
@@ -217,6 +202,14 @@ def delete_thread(thread_id):
     if thread.author_id != user.id:
         return jsonify({"error": "このスレッドを削除する権限がありません"}), 403
 
+    # スレッドとメッセージに添付された画像（削除後に参照がなくなったものを消す）
+    image_ids = [thread.image_id] + [
+        row[0] for row in db.session.query(ThreadMessage.image_id).filter(
+            ThreadMessage.thread_id == thread_id,
+            ThreadMessage.image_id.isnot(None)
+        ).all()
+    ]
+
     # 関連するメッセージを先に削除
     ThreadMessage.query.filter_by(thread_id=thread_id).delete()
 
@@ -228,6 +221,7 @@ def delete_thread(thread_id):
 
     # スレッド本体を削除
     db.session.delete(thread)
+    delete_unreferenced_images(image_ids)
     try:
         # データ削除処理
         db.session.commit()
@@ -317,7 +311,7 @@ def heart_thread(thread_id):
     
     return jsonify({
         "message": "スレッドにいいねしました",
-        "thread": thread.to_dict(current_user_id=user.id if user else None)
+        "thread": serialize_threads([thread], current_user_id=user.id)[0]
     })
 
 @thread_bp.route("/<thread_id>/unheart", methods=["POST"])
@@ -347,5 +341,5 @@ def unheart_thread(thread_id):
     
     return jsonify({
         "message": "いいねを取り消しました",
-        "thread": thread.to_dict(current_user_id=user.id if user else None)
+        "thread": serialize_threads([thread], current_user_id=user.id)[0]
     }) 
\ No newline at end of file
@@ -0,0 +1,80 @@
+from flask import Blueprint, request, jsonify
+from app.routes.protected.routes import get_authenticated_user
+from app.models.event import Event
+from app.models.thread import Thread
+from app.utils.search_index import search_index
+from app.utils.serializers import serialize_events, serialize_threads
+
+search_bp = Blueprint("search", __name__)
+
+SEARCH_TYPES = ('event', 'thread', 'all')
+MAX_LIMIT = 50
+
+
+def _load_ranked(model, ranked):
+    """検索結果のID順（スコアの高い順）にモデルを並べて返す"""
+    ids = [doc_id for doc_id, _ in ranked]
+    if not ids:
+        return [], {}
+    found = {row.id: row for row in model.query.filter(model.id.in_(ids)).all()}
+    scores = dict(ranked)
+    # インデックスへの反映前に削除されたものは除く
+    return [found[doc_id] for doc_id in ids if doc_id in found], scores
+
+
+@search_bp.route("", methods=["GET"])
+def search():
+    """
+    イベントとスレッドのキーワード検索（タイトル・本文・タグ）
+
+    クエリパラメータ:
+        q: 検索語（必須）
+        type: event / thread / all（デフォルト: all）
+        area_id: エリアで絞り込む
+        status: イベントのステータスで絞り込む
+        limit, offset: 種類ごとの取得件数と読み飛ばす件数
+    """
+    query_text = (request.args.get('q') or '').strip()
+    if not query_text:
+        return jsonify({"error": "検索語(q)を指定してください"}), 400
+
+    search_type = request.args.get('type', 'all')
+    if search_type not in SEARCH_TYPES:
+        return jsonify({"error": f"typeは {', '.join(SEARCH_TYPES)} のいずれかを指定してください"}), 400
+
+    limit = min(max(request.args.get('limit', default=20, type=int), 1), MAX_LIMIT)
+    offset = max(request.args.get('offset', default=0, type=int), 0)
+    area_id = request.args.get('area_id')
+    status = request.args.get('status')
+
+    user = None
+    try:
+        user, _, _ = get_authenticated_user()
+    except Exception:
+        user = None
+
+    response = {"query": query_text}
+
+    if search_type in ('event', 'all'):
+        ranked, total = search_index.search(
+            'event', query_text, limit=limit, offset=offset, area_id=area_id, status=status
+        )
+        events, scores = _load_ranked(Event, ranked)
+        results = serialize_events(events)
+        for event_data in results:
+            event_data['score'] = scores[event_data['id']]
+        response['events'] = results
+        response['events_total'] = total
+
+    if search_type in ('thread', 'all'):
+        ranked, total = search_index.search(
+            'thread', query_text, limit=limit, offset=offset, area_id=area_id
+        )
+        threads, scores = _load_ranked(Thread, ranked)
+        results = serialize_threads(threads, current_user_id=user.id if user else None)
+        for thread_data in results:
+            thread_data['score'] = scores[thread_data['id']]
+        response['threads'] = results
+        response['threads_total'] = total
+
+    return jsonify(response)
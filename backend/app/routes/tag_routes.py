@@ -1,6 +1,5 @@
 from flask import Blueprint, jsonify, request, make_response
-from app.models.event import TagMaster
-from app.models import db
+from app.utils import refdata
 
 tag_bp = Blueprint('tag', __name__)
 
@@ -15,12 +14,11 @@ def getTags():
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
         return response
     
-    tags = TagMaster.query.filter_by(is_active=True).all()
-    tag_list = [
+    # メモリ上の参照データから有効なタグだけ返す。ETagが一致すれば304
+    return refdata.conditional_json(refdata.tags, lambda: {'tags': [
         {
-            'id': tag.id,
-            'tag_name': tag.tag_name
+            'id': tag['id'],
+            'tag_name': tag['tag_name']
         }
-        for tag in tags
-    ]
-    return jsonify({'tags': tag_list})
+        for tag in refdata.tags.all() if tag['is_active']
+    ]})
@@ -4,10 +4,16 @@ import os
 import uuid
 from app.models import db
 from app.models.file import ImageList
+from app.models.user import User
+from app.models.event import Event
+from app.models.thread import Thread, ThreadMessage
+from app.models.message import EventMessage, DirectMessage
 from app.routes.protected.routes import get_authenticated_user
 from datetime import datetime, timezone, timedelta
-from app.utils.storage import upload_file
+from app.utils.storage import upload_file, delete_file, build_file_url, generate_presigned_upload, get_file_metadata
 from app.utils.age_certification import age_certify
+from app.utils.upload_stream import get_upload_stream, get_upload_size
+from app.utils.image_store import store_image
 import tempfile
 from PIL import Image
 import io
@@ -16,6 +22,46 @@ JST = timezone(timedelta(hours=9))
 
 upload_bp = Blueprint("upload", __name__)
 
+# 直接アップロード（署名付きPOST）で許可する画像形式
+PRESIGN_CONTENT_TYPES = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif'
+}
+MAX_IMAGE_UPLOAD_SIZE = int(os.getenv('MAX_IMAGE_UPLOAD_SIZE', 10 * 1024 * 1024))  # 10MB
+PRESIGN_EXPIRES_IN = int(os.getenv('PRESIGN_EXPIRES_IN', 600))  # 10分
+
+# ImageList.entity_type -> (モデル, 所有者のユーザーIDのカラム)。画像を紐付けられるのは所有者だけ
+ENTITY_OWNERS = {
+    'event': (Event, 'author_user_id'),
+    'thread': (Thread, 'author_id'),
+    'event_message': (EventMessage, 'sender_user_id'),
+    'thread_message': (ThreadMessage, 'sender_user_id'),
+    'direct_message': (DirectMessage, 'sender_id'),
+    'user_profile': (User, 'id')
+}
+
+
+def check_entity_owner(user, entity_type, entity_id):
+    """
+    画像を紐付けるエンティティがユーザーのものか確認する
+
+    Returns:
+        tuple: (エラーレスポンス, ステータスコード)。問題がなければ (None, None)
+    """
+    if not entity_type and not entity_id:
+        return None, None
+    if entity_type not in ENTITY_OWNERS or not entity_id:
+        return {"error": "entity_type と entity_id の指定が正しくありません"}, 400
+
+    model, owner_column = ENTITY_OWNERS[entity_type]
+    owner_id = db.session.query(getattr(model, owner_column)).filter(model.id == entity_id).scalar()
+    if owner_id is None:
+        return {"error": "画像を紐付ける対象が見つかりません"}, 404
+    if owner_id != user.id:
+        return {"error": "この対象に画像を紐付ける権限がありません"}, 403
+    return None, None
+
 @upload_bp.route("/image", methods=["POST"])
 def upload_image():
     # ユーザー認証
@@ -35,19 +81,25 @@ def upload_image():
     if extension not in allowed_extensions:
         return jsonify({"error": "許可されていないファイル形式です"}), 400
 
-    filename = f"thread-messages/{uuid.uuid4()}.{extension}"
+    file_size = get_upload_size(file)
+    if file_size > MAX_IMAGE_UPLOAD_SIZE:
+        return jsonify({"error": f"ファイルサイズは{MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)}MB以下にしてください"}), 413
+
     content_type = file.content_type if hasattr(file, 'content_type') else None
 
-    file_url = upload_file(file, filename, content_type)
+    # 同じ内容の画像が保存済みならアップロードせずに再利用する
+    stored = store_image(get_upload_stream(file), "thread-messages", extension, content_type, file_size)
 
-    if not file_url:
+    if not stored:
         return jsonify({"error": "ファイルのアップロードに失敗しました"}), 500
 
+    file_url = stored.image_url
     image = ImageList(
         id=str(uuid.uuid4()),
         image_url=file_url,
         uploaded_by=user.id,
-        upload_date=datetime.now(JST)
+        upload_date=datetime.now(JST),
+        content_hash=stored.content_hash
     )
     
     db.session.add(image)
@@ -62,6 +114,125 @@ def upload_image():
     })
 
 
+@upload_bp.route("/presign", methods=["POST", "OPTIONS"])
+def presign_image_upload():
+    """
+    S3/Minioへ直接アップロードするための署名付きPOSTを発行する
+    
+    Flaskワーカーはファイル本体を受け取らず、キーと署名だけを返す。
+    アップロード後は /confirm でImageListへの登録を行う。
+    """
+    if request.method == "OPTIONS":
+        response = current_app.make_response('')
+        response.headers['Access-Control-Allow-Origin'] = request.headers.get('Origin', '*')
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+        return response
+
+    # ユーザー認証
+    user, error_response, error_code = get_authenticated_user()
+    if error_response:
+        return jsonify(error_response), error_code
+
+    data = request.get_json() or {}
+    content_type = data.get('content_type')
+    extension = PRESIGN_CONTENT_TYPES.get(content_type)
+    if not extension:
+        return jsonify({"error": "許可されていないファイル形式です"}), 400
+
+    size = data.get('size')
+    if size is not None and (not isinstance(size, int) or size <= 0 or size > MAX_IMAGE_UPLOAD_SIZE):
+        return jsonify({"error": f"ファイルサイズは{MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)}MB以下にしてください"}), 400
+
+    # ユーザーごとのプレフィックスを付けて、他人のキーを確定できないようにする
+    key = f"uploads/{user.id}/{uuid.uuid4()}.{extension}"
+    presigned = generate_presigned_upload(key, content_type, MAX_IMAGE_UPLOAD_SIZE, PRESIGN_EXPIRES_IN)
+    if not presigned:
+        return jsonify({"error": "アップロードURLの発行に失敗しました"}), 500
+
+    return jsonify({
+        "key": key,
+        "url": presigned['url'],
+        "fields": presigned['fields'],
+        "max_size": MAX_IMAGE_UPLOAD_SIZE,
+        "expires_in": PRESIGN_EXPIRES_IN
+    })
+
+
+@upload_bp.route("/confirm", methods=["POST", "OPTIONS"])
+def confirm_image_upload():
+    """
+    直接アップロードされたオブジェクトを検証し、ImageListに登録する
+    """
+    if request.method == "OPTIONS":
+        response = current_app.make_response('')
+        response.headers['Access-Control-Allow-Origin'] = request.headers.get('Origin', '*')
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+        return response
+
+    # ユーザー認証
+    user, error_response, error_code = get_authenticated_user()
+    if error_response:
+        return jsonify(error_response), error_code
+
+    data = request.get_json() or {}
+    key = data.get('key')
+    if not key or not key.startswith(f"uploads/{user.id}/") or '..' in key:
+        return jsonify({"error": "無効なキーです"}), 400
+
+    entity_type = data.get('entity_type')
+    entity_id = data.get('entity_id')
+    error_response, error_code = check_entity_owner(user, entity_type, entity_id)
+    if error_response:
+        return jsonify(error_response), error_code
+
+    file_url = build_file_url(key)
+
+    # 同じキーの二重登録を防ぐ
+    existing = ImageList.query.filter_by(image_url=file_url).first()
+    if existing:
+        return jsonify({
+            "message": "画像をアップロードしました",
+            "image_id": existing.id,
+            "image": {
+                "id": existing.id,
+                "url": existing.image_url
+            }
+        })
+
+    metadata = get_file_metadata(key)
+    if not metadata:
+        return jsonify({"error": "アップロードされたファイルが見つかりません"}), 404
+
+    # 署名の条件とは別に、保存されたオブジェクト自体のサイズと形式を確認する
+    if metadata['size'] <= 0 or metadata['size'] > MAX_IMAGE_UPLOAD_SIZE or metadata['content_type'] not in PRESIGN_CONTENT_TYPES:
+        delete_file(key)
+        return jsonify({"error": "アップロードされたファイルが条件を満たしていません"}), 400
+
+    image = ImageList(
+        id=str(uuid.uuid4()),
+        image_url=file_url,
+        uploaded_by=user.id,
+        entity_type=entity_type,
+        entity_id=entity_id,
+        upload_date=datetime.now(JST)
+    )
+    db.session.add(image)
+    db.session.commit()
+
+    return jsonify({
+        "message": "画像をアップロードしました",
+        "image_id": image.id,
+        "image": {
+            "id": image.id,
+            "url": file_url
+        }
+    })
+
+
 @upload_bp.route("/event-image", methods=["POST", "OPTIONS"])
 def upload_event_image():
     if request.method == "OPTIONS":
@@ -89,17 +260,21 @@ def upload_event_image():
     if extension not in allowed_extensions:
         return jsonify({"error": "許可されていないファイル形式です"}), 400
 
-    filename = str(uuid.uuid4()) + '.' + extension
+    file_size = get_upload_size(file)
+    if file_size > MAX_IMAGE_UPLOAD_SIZE:
+        return jsonify({"error": f"ファイルサイズは{MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)}MB以下にしてください"}), 413
+
     content_type = file.content_type if hasattr(file, 'content_type') else None
-    file_url = upload_file(file, filename, content_type)
-    if not file_url:
+    stored = store_image(get_upload_stream(file), "events", extension, content_type, file_size)
+    if not stored:
         return jsonify({"error": "ファイルのアップロードに失敗しました"}), 500
 
     image = ImageList(
         id=str(uuid.uuid4()),
-        image_url=file_url,
+        image_url=stored.image_url,
         uploaded_by=user.id,
-        upload_date=datetime.now(JST)
+        upload_date=datetime.now(JST),
+        content_hash=stored.content_hash
     )
     db.session.add(image)
     db.session.commit()
@@ -134,20 +309,17 @@ def upload_age_verification():
     if extension not in allowed_extensions:
         return jsonify({"error": "許可されていないファイル形式です。画像ファイル(PNG, JPG, JPEG, GIF)またはPDFをアップロードしてください"}), 400
 
-    # ファイル内容を最初に保存（ストレージアップロードとOCR処理の両方で使用）
+    # ストレージアップロードとOCR処理で同じスプールバッファを使い回す（メモリ上にコピーしない）
     print(f"[UPLOAD] 年齢認証処理開始: ファイル名={file.filename}, ユーザーID={user.id}")
-    file.seek(0)  # ファイルポインタを先頭に戻す
-    image_data = file.read()
-    print(f"[UPLOAD] 画像データ読み込み完了: {len(image_data)} bytes")
-    
-    # ストレージアップロード用にファイルオブジェクトを再作成
-    file_for_upload = io.BytesIO(image_data)
-    file_for_upload.seek(0)
+    file_size = get_upload_size(file)
+    if file_size > MAX_IMAGE_UPLOAD_SIZE:
+        return jsonify({"error": f"ファイルサイズは{MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)}MB以下にしてください"}), 413
     
     # 年齢認証用の専用フォルダにアップロード
     filename = f"age-verification/{user.id}_{uuid.uuid4()}.{extension}"
     content_type = file.content_type if hasattr(file, 'content_type') else None
-    file_url = upload_file(file_for_upload, filename, content_type)
+    # 本人確認書類はブラウザやプロキシにキャッシュさせない
+    file_url = upload_file(get_upload_stream(file), filename, content_type, 'private, no-store')
     
     if not file_url:
         return jsonify({"error": "ファイルのアップロードに失敗しました"}), 500
@@ -160,7 +332,7 @@ def upload_age_verification():
     try:
         # PILで画像を開く
         try:
-            image = Image.open(io.BytesIO(image_data))
+            image = Image.open(get_upload_stream(file))
             print(f"[UPLOAD] PIL画像読み込み成功: モード={image.mode}, サイズ={image.size}")
             # RGBに変換（OCRに適した形式）
             if image.mode != 'RGB':
@@ -4,6 +4,8 @@ from app.models import db
 from app.routes.protected.routes import get_authenticated_user
 from app.models.event import Event, UserMemberGroup, UserTagAssociation
 from app.models.message import FriendRelationship
+from app.utils.friend_graph import get_adjacency, invalidate_relationship
+from app.utils.http_cache import conditional
 import uuid
 from datetime import datetime, timezone, timedelta
 
@@ -12,6 +14,7 @@ JST = timezone(timedelta(hours=9))  # 日本標準時
 user_bp = Blueprint("user", __name__)
 
 @user_bp.route("/<user_id>/profile", methods=["GET"])
+@conditional('user', 'refdata', personalized=True, scope='user_id')
 def get_user_profile(user_id):
     """
     ユーザーのプロフィール情報を取得するAPI
@@ -63,22 +66,15 @@ def get_user_profile(user_id):
         }
 
         if is_authenticated and current_user.id != user_id:
-            following_relationship = FriendRelationship.query.filter_by(
-                user_id=current_user.id,
-                friend_id=user_id
-            ).first()
-            
-            followed_by_relationship = FriendRelationship.query.filter_by(
-                user_id=user_id,
-                friend_id=current_user.id
-            ).first()
+            adjacency = get_adjacency(current_user.id)
+            following_relationship = adjacency.outgoing.get(user_id)
             
             if following_relationship:
                 follow_status["is_following"] = True
-                follow_status["relationship_id"] = following_relationship.id
+                follow_status["relationship_id"] = following_relationship.relationship_id
                 follow_status["relationship_status"] = following_relationship.status
             
-            if followed_by_relationship:
+            if user_id in adjacency.incoming:
                 follow_status["is_followed_by"] = True
 
         response_data = {
@@ -144,6 +140,7 @@ def follow_user(user_id):
     
     db.session.add(relationship)
     db.session.commit()
+    invalidate_relationship(user.id, user_id)
     
     return jsonify({
         "message": "フォローリクエストを送信しました",
@@ -175,5 +172,6 @@ def unfollow_user(user_id):
     
     db.session.delete(relationship)
     db.session.commit()
+    invalidate_relationship(user.id, user_id)
     
     return jsonify({"message": "フォローを解除しました"})
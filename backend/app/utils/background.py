@@ -0,0 +1,104 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event as orm_event
+from sqlalchemy.orm import Session
+from app.models import db
+
+logger = logging.getLogger(__name__)
+
+# バックグラウンド処理のスレッド数
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 4))
+# 'thread': スレッドプールで非同期に実行 / 'sync': 呼び出し元でそのまま実行（デバッグ用）
+BACKGROUND_MODE = os.getenv('BACKGROUND_MODE', 'thread')
+
+
+class BackgroundWorker:
+    """
+    リクエストの応答後に行う副作用（ボットの返信、未読数の更新など）を実行するワーカー
+
+    ジョブはアプリケーションコンテキスト内で実行し、終了後にセッションを破棄する。
+    """
+
+    def __init__(self, max_workers=BACKGROUND_WORKERS, mode=BACKGROUND_MODE):
+        self.app = None
+        self.max_workers = max_workers
+        self.mode = mode
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='background')
+            return self.executor
+
+    def _run(self, fn, args, kwargs):
+        with self.app.app_context():
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                db.session.rollback()
+                logger.exception(f"バックグラウンド処理でエラーが発生しました ({getattr(fn, '__name__', fn)}): {e}")
+            finally:
+                db.session.remove()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        ジョブを登録する
+
+        引数にはモデルのインスタンスではなくIDなどの値を渡すこと（別のセッションで実行されるため）。
+        """
+        if self.app is None:
+            raise RuntimeError("BackgroundWorker.init_app() が呼ばれていません")
+        if self.mode == 'sync':
+            self._run(fn, args, kwargs)
+            return None
+        return self._get_executor().submit(self._run, fn, args, kwargs)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=wait)
+                self.executor = None
+
+
+background = BackgroundWorker()
+
+
+def enqueue(fn, *args, **kwargs):
+    """バックグラウンドでジョブを実行する"""
+    return background.submit(fn, *args, **kwargs)
+
+
+def enqueue_after_commit(session, fn, *args, **kwargs):
+    """
+    セッションのトランザクションがコミットされたらジョブを登録する（ロールバックされたら破棄する）
+
+    フラッシュ中のイベントリスナーなど、コミットの前に副作用を予約したい場合に使う。
+    同じジョブ（関数と引数が同じもの）は1回だけ登録する。
+    """
+    jobs = session.info.setdefault('after_commit_jobs', [])
+    if (fn, args, kwargs) not in jobs:
+        jobs.append((fn, args, kwargs))
+
+
+@orm_event.listens_for(Session, 'after_commit')
+def _submit_after_commit_jobs(session):
+    jobs = session.info.pop('after_commit_jobs', None)
+    for fn, args, kwargs in jobs or ():
+        try:
+            background.submit(fn, *args, **kwargs)
+        except Exception as e:
+            logger.error(f"バックグラウンド処理の登録に失敗しました: {e}")
+
+
+@orm_event.listens_for(Session, 'after_soft_rollback')
+def _discard_after_commit_jobs(session, previous_transaction):
+    # セーブポイントだけのロールバックでは外側のトランザクションのジョブを残す
+    if not session.in_transaction():
+        session.info.pop('after_commit_jobs', None)
@@ -0,0 +1,100 @@
+import os
+import gzip
+from flask import request
+
+# brotli はインストールされている場合だけ使う（requirements.txt を参照）
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'true') == 'true'
+# これより小さいレスポンスは圧縮しない（バイト）
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+# 動的なレスポンス向けに速度を優先した品質（0〜11）
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/javascript',
+    'image/svg+xml',
+}
+
+
+def available_encodings():
+    """サーバーが使える圧縮方式（優先する順）"""
+    return (['br'] if brotli is not None else []) + ['gzip']
+
+
+def compress(data, encoding):
+    """
+    バイト列を指定した方式で圧縮する
+
+    Args:
+        data: 圧縮するバイト列
+        encoding: 'br' または 'gzip'
+
+    Returns:
+        bytes: 圧縮したバイト列
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    # mtimeを固定して、同じ内容なら同じバイト列になるようにする
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def _should_compress(response):
+    if request.method == 'HEAD':
+        return False
+    if response.status_code < 200 or response.status_code >= 300 or response.status_code in (204, 206):
+        return False
+    # ストリーミング（SSEなど）とファイルの送信はそのまま返す
+    if response.is_streamed or response.direct_passthrough:
+        return False
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return False
+    if 'Content-Encoding' in response.headers or response.cache_control.no_transform:
+        return False
+    return True
+
+
+def compress_response(response):
+    """
+    Accept-Encoding に合わせてレスポンスを brotli / gzip で圧縮する（after_request）
+
+    COMPRESS_MIN_SIZE 未満のもの、圧縮しても小さくならないものはそのまま返す。
+    """
+    if not _should_compress(response):
+        return response
+
+    # 圧縮するかどうかでレスポンスが変わるため、キャッシュには Accept-Encoding ごとに保存させる
+    response.vary.add('Accept-Encoding')
+
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    compressed = compress(data, encoding)
+    if len(compressed) >= len(data):
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # 圧縮後のバイト列は元と異なるため、ETagは弱いETagにする（If-None-Match は弱い比較で照合する）
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    if COMPRESS_ENABLED:
+        app.after_request(compress_response)
@@ -0,0 +1,205 @@
+import logging
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import select, insert, delete, func, update, or_
+from sqlalchemy.exc import IntegrityError
+from app.models import db
+from app.models.user import User
+from app.models.file import ImageList
+from app.models.message import DirectMessage, DirectConversation
+from app.utils.serializers import preload
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+
+def _get_or_create(user_id, partner_id):
+    """会話の行を取得し、なければ作成する"""
+    conversation = db.session.get(DirectConversation, (user_id, partner_id))
+    if conversation:
+        return conversation
+
+    conversation = DirectConversation(user_id=user_id, partner_id=partner_id, unread_count=0)
+    try:
+        # 同じ会話が同時に作られた場合は先に作られた行を使う
+        with db.session.begin_nested():
+            db.session.add(conversation)
+    except IntegrityError:
+        conversation = db.session.get(DirectConversation, (user_id, partner_id), populate_existing=True)
+    return conversation
+
+
+def record_direct_message(message):
+    """
+    送信したDMを送信者・受信者それぞれの会話に反映する（呼び出し側でコミットすること）
+
+    Args:
+        message: 追加したDirectMessage
+    """
+    now = datetime.now(JST)
+    sent_at = message.sent_at.replace(tzinfo=None) if message.sent_at else now.replace(tzinfo=None)
+
+    for user_id, partner_id in ((message.sender_id, message.receiver_id), (message.receiver_id, message.sender_id)):
+        conversation = _get_or_create(user_id, partner_id)
+        if conversation.latest_message_at is None or sent_at >= conversation.latest_message_at:
+            conversation.latest_message_id = message.id
+            conversation.latest_message_at = sent_at
+        conversation.updated_at = now
+
+    # 未読数は同時送信で失われないようにSQL側で加算する
+    DirectConversation.query.filter_by(
+        user_id=message.receiver_id,
+        partner_id=message.sender_id
+    ).update(
+        {DirectConversation.unread_count: DirectConversation.unread_count + 1},
+        synchronize_session=False
+    )
+
+
+def refresh_unread_count(user_id, partner_id):
+    """
+    相手から届いた未読DMの数を数え直して会話に反映する（呼び出し側でコミットすること）
+
+    Returns:
+        int: 未読数
+    """
+    unread_count = DirectMessage.query.filter_by(
+        sender_id=partner_id,
+        receiver_id=user_id,
+        is_read=False
+    ).count()
+    DirectConversation.query.filter_by(user_id=user_id, partner_id=partner_id).update(
+        {DirectConversation.unread_count: unread_count},
+        synchronize_session=False
+    )
+    return unread_count
+
+
+def mark_conversation_read(user_id, partner_id, until):
+    """
+    相手から届いたDMのうち、指定時刻までの未読をまとめて既読にする（呼び出し側でコミットすること）
+
+    行を読み込まずに1回のUPDATEで更新し、会話一覧の未読数も数え直す。
+
+    Args:
+        user_id: 既読にするユーザーのID
+        partner_id: 相手のユーザーID
+        until: この時刻以前に送信されたメッセージを既読にする（送信日時がNULLのものは最も古いものとして含める。
+            Noneの場合は送信日時がNULLのものだけ）
+
+    Returns:
+        int: 既読にしたメッセージ数
+    """
+    result = db.session.execute(
+        update(DirectMessage).where(
+            DirectMessage.receiver_id == user_id,
+            DirectMessage.sender_id == partner_id,
+            DirectMessage.is_read == False,
+            or_(DirectMessage.sent_at.is_(None), DirectMessage.sent_at <= until) if until else DirectMessage.sent_at.is_(None)
+        ).values(is_read=True, read_at=datetime.now(JST)),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount:
+        refresh_unread_count(user_id, partner_id)
+    return result.rowcount
+
+
+def get_conversation_overview(user_id):
+    """
+    ユーザーの会話一覧を新しい順に取得する
+
+    会話一覧のインデックス検索1回と、相手・最新メッセージ・画像のまとめ取得だけで済む。
+
+    Returns:
+        list: {'partner_id', 'partner', 'latest_message', 'unread_count'} のリスト
+    """
+    conversations = DirectConversation.query.filter(
+        DirectConversation.user_id == user_id,
+        DirectConversation.latest_message_id.isnot(None)
+    ).order_by(DirectConversation.latest_message_at.desc()).all()
+
+    users = preload(User, [c.partner_id for c in conversations] + [user_id])
+    messages = preload(DirectMessage, [c.latest_message_id for c in conversations])
+    _ = preload(ImageList, [message.image_id for message in messages.values()])
+
+    overview = []
+    for conversation in conversations:
+        partner = users.get(conversation.partner_id)
+        message = messages.get(conversation.latest_message_id)
+        if not partner or not message:
+            continue
+        overview.append({
+            "partner_id": partner.id,
+            "partner": partner.to_dict(),
+            "latest_message": message.to_dict(),
+            "unread_count": conversation.unread_count
+        })
+    return overview
+
+
+def _message_order(sent_at, message_id):
+    """メッセージの並び順のキー（送信日時がNULLのものは apply_keyset と同じく最も古いものとして扱う）"""
+    return (sent_at is not None, sent_at or datetime.min, message_id)
+
+
+def rebuild_conversations(user_id=None, batch_size=1000, connection=None):
+    """
+    DirectMessageから会話一覧を作り直す（既存データの移行・不整合の修復用）
+
+    Args:
+        user_id: 指定した場合はそのユーザーが関与する会話だけ作り直す
+        batch_size: 一度に読み込むメッセージ数
+        connection: 実行に使う接続（マイグレーション用。Noneの場合は db.session で実行してコミットする）
+
+    Returns:
+        int: 作成・更新した会話の数
+    """
+    executor = connection if connection is not None else db.session
+    messages = DirectMessage.__table__
+    conversations = DirectConversation.__table__
+
+    query = select(messages.c.id, messages.c.sender_id, messages.c.receiver_id, messages.c.sent_at)
+    if user_id:
+        query = query.where((messages.c.sender_id == user_id) | (messages.c.receiver_id == user_id))
+
+    # (ユーザー, 相手) ごとの最新メッセージを求める
+    latest = {}
+    for message_id, sender_id, receiver_id, sent_at in executor.execute(query.execution_options(yield_per=batch_size)):
+        for key in ((sender_id, receiver_id), (receiver_id, sender_id)):
+            current = latest.get(key)
+            if current is None or _message_order(sent_at, message_id) > _message_order(current[1], current[0]):
+                latest[key] = (message_id, sent_at)
+
+    unread_query = select(messages.c.receiver_id, messages.c.sender_id, func.count()).where(messages.c.is_read == False)
+    if user_id:
+        unread_query = unread_query.where((messages.c.sender_id == user_id) | (messages.c.receiver_id == user_id))
+    unread = {
+        (row[0], row[1]): row[2]
+        for row in executor.execute(unread_query.group_by(messages.c.receiver_id, messages.c.sender_id)).all()
+    }
+
+    if user_id:
+        executor.execute(delete(conversations).where(
+            (conversations.c.user_id == user_id) | (conversations.c.partner_id == user_id)
+        ))
+    else:
+        executor.execute(delete(conversations))
+
+    now = datetime.now(JST).replace(tzinfo=None)
+    rows = [
+        {
+            'user_id': owner_id,
+            'partner_id': partner_id,
+            'latest_message_id': message_id,
+            'latest_message_at': sent_at,
+            'unread_count': unread.get((owner_id, partner_id), 0),
+            'updated_at': now
+        }
+        for (owner_id, partner_id), (message_id, sent_at) in latest.items()
+    ]
+    for i in range(0, len(rows), batch_size):
+        executor.execute(insert(conversations), rows[i:i + batch_size])
+    if connection is None:
+        db.session.commit()
+    logger.info(f"DM会話一覧を再構築しました: {len(latest)}件")
+    return len(latest)
@@ -0,0 +1,155 @@
+import logging
+from collections import namedtuple, defaultdict
+from sqlalchemy import event as orm_event, update, select, func
+from sqlalchemy.orm import Session, object_session
+from app.models import db
+from app.models.event import Event, UserHeartEvent, UserMemberGroup
+from app.models.thread import Thread, ThreadMessage, UserHeartThread
+from app.models.message import EventMessage
+from app.utils.background import enqueue
+
+logger = logging.getLogger(__name__)
+
+# 親の行に持たせる件数のカラムと、数える元の子テーブル
+# parent: 親のモデル / column: 件数のカラム名 / child: 子のモデル / foreign_key: 親を指す子のカラム名
+# deferred: Trueの場合は子の行を追加・削除したトランザクションでは更新せず、コミット後にバックグラウンドで増減する
+Counter = namedtuple('Counter', ['parent', 'column', 'child', 'foreign_key', 'deferred'], defaults=[False])
+
+COUNTERS = [
+    Counter(Thread, 'hearts_count', UserHeartThread, 'thread_id'),
+    Counter(Thread, 'messages_count', ThreadMessage, 'thread_id'),
+    Counter(Event, 'hearts_count', UserHeartEvent, 'event_id'),
+    # イベントのトークの送信は多いため、送信のトランザクションでイベントの行をロックしない
+    Counter(Event, 'messages_count', EventMessage, 'event_id', deferred=True),
+]
+
+# 参加者数（作成者を含む）。定員の確認と合わせて参加・退出の処理で更新するため、ここでは数え直しだけ行う
+MEMBER_COUNTER = Counter(Event, 'current_persons', UserMemberGroup, 'event_id')
+
+
+def _increment(connection, counter, parent_id, delta):
+    table = counter.parent.__table__
+    column = table.c[counter.column]
+    statement = update(table).where(table.c[counter.parent.__mapper__.primary_key[0].key] == parent_id)
+    if delta < 0:
+        # ずれていても負の値にはしない（ずれは reconcile_counters で直す）
+        statement = statement.where(column >= -delta)
+    connection.execute(statement.values({counter.column: column + delta}))
+
+
+def apply_deferred_increments(deltas):
+    """
+    コミット後に件数をまとめて増減する（バックグラウンドで実行する）
+
+    ジョブが失われた場合のずれは reconcile_counters で直す。
+
+    Args:
+        deltas: (Counter, 親のID) -> 増減する数
+    """
+    for (counter, parent_id), delta in deltas.items():
+        if delta:
+            _increment(db.session, counter, parent_id, delta)
+    db.session.commit()
+
+
+def _register(counter):
+    def _change(connection, target, delta):
+        parent_id = getattr(target, counter.foreign_key)
+        if not counter.deferred:
+            # 子の行を追加・削除するflushの中で、同じトランザクションのUPDATEとして件数を増減する
+            _increment(connection, counter, parent_id, delta)
+            return
+        session = object_session(target)
+        if session is not None:
+            deltas = session.info.setdefault('deferred_counter_deltas', defaultdict(int))
+            deltas[(counter, parent_id)] += delta
+
+    @orm_event.listens_for(counter.child, 'after_insert')
+    def _after_insert(mapper, connection, target):
+        _change(connection, target, 1)
+
+    @orm_event.listens_for(counter.child, 'after_delete')
+    def _after_delete(mapper, connection, target):
+        _change(connection, target, -1)
+
+
+for _counter in COUNTERS:
+    _register(_counter)
+
+
+@orm_event.listens_for(Session, 'after_commit')
+def _enqueue_deferred_increments(session):
+    deltas = session.info.pop('deferred_counter_deltas', None)
+    if deltas:
+        enqueue(apply_deferred_increments, dict(deltas))
+
+
+@orm_event.listens_for(Session, 'after_soft_rollback')
+def _discard_deferred_increments(session, previous_transaction):
+    # ロールバックされた追加・削除の分は増減しない
+    if not session.in_transaction():
+        session.info.pop('deferred_counter_deltas', None)
+
+
+def _count_subquery(counter):
+    parent = counter.parent.__table__
+    child = counter.child.__table__
+    parent_key = parent.c[counter.parent.__mapper__.primary_key[0].key]
+    return select(func.count()).select_from(child).where(
+        child.c[counter.foreign_key] == parent_key
+    ).scalar_subquery()
+
+
+def reconcile_counter(counter, connection=None, batch_size=1000):
+    """
+    件数のカラムを子テーブルから数え直し、ずれている行だけ更新する
+
+    Args:
+        counter: Counter
+        connection: 実行に使う接続（Noneの場合は db.session。呼び出し側でコミットすること）
+        batch_size: 一度に確認する親の行数
+
+    Returns:
+        int: 修正した行数
+    """
+    executor = connection if connection is not None else db.session
+    parent = counter.parent.__table__
+    parent_key = parent.c[counter.parent.__mapper__.primary_key[0].key]
+    column = parent.c[counter.column]
+    actual = _count_subquery(counter)
+
+    fixed = 0
+    last_id = None
+    while True:
+        query = select(parent_key).order_by(parent_key).limit(batch_size)
+        if last_id is not None:
+            query = query.where(parent_key > last_id)
+        ids = [row[0] for row in executor.execute(query)]
+        if not ids:
+            break
+        result = executor.execute(
+            update(parent).where(
+                parent_key.in_(ids),
+                func.coalesce(column, -1) != actual
+            ).values({counter.column: actual})
+        )
+        fixed += result.rowcount or 0
+        last_id = ids[-1]
+
+    if fixed:
+        logger.info(f"件数のずれを修正しました: {parent.name}.{counter.column} {fixed}件")
+    return fixed
+
+
+def reconcile_counters(connection=None, batch_size=1000):
+    """
+    すべての件数のカラム（いいね数・メッセージ数・参加者数）を数え直す
+
+    Returns:
+        dict: "テーブル.カラム" -> 修正した行数
+    """
+    results = {}
+    for counter in COUNTERS + [MEMBER_COUNTER]:
+        key = f"{counter.parent.__tablename__}.{counter.column}"
+        results[key] = reconcile_counter(counter, connection=connection, batch_size=batch_size)
+    return results
@@ -0,0 +1,230 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from sqlalchemy import event as sa_event, exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# 1プロセスあたりのリクエスト処理スレッド数（プールの大きさの目安）
+WEB_THREADS = int(os.getenv('WEB_THREADS', 8))
+# プールに常に保持する接続数（既定はリクエスト処理スレッド + バックグラウンドワーカー）
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', WEB_THREADS + int(os.getenv('BACKGROUND_WORKERS', 4))))
+# 混雑時にプールの大きさを超えて一時的に作る接続数
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', max(DB_POOL_SIZE // 2, 2)))
+# 空きがないときに接続を待つ最大時間（秒）。超えるとエラーにする
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))
+# この秒数より古い接続は作り直す（MySQLのwait_timeoutやプロキシのアイドル切断より短くする）
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+# 貸し出す前に接続が生きているか確認する（"MySQL server has gone away" を防ぐ）
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true') == 'true'
+
+# 接続の待ち時間のヒストグラムの区切り（ミリ秒）
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolMetrics:
+    """接続プールの利用状況（貸し出し中の数、待ち時間の分布など）を集計する"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.pool = None
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_sum_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)  # 最後は上限なし
+
+    def observe_wait(self, elapsed_ms):
+        with self.lock:
+            self.wait_count += 1
+            self.wait_sum_ms += elapsed_ms
+            self.wait_max_ms = max(self.wait_max_ms, elapsed_ms)
+            self.wait_buckets[bisect.bisect_left(WAIT_BUCKETS_MS, elapsed_ms)] += 1
+
+    def on_connect(self, *args):
+        with self.lock:
+            self.connects += 1
+
+    def on_checkout(self, *args):
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def on_checkin(self, *args):
+        with self.lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def on_invalidate(self, *args):
+        with self.lock:
+            self.invalidations += 1
+
+    def on_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        """
+        現在の値を辞書で返す
+
+        Returns:
+            dict: in_use, peak_in_use, wait_ms（count/sum/max/buckets）など
+        """
+        with self.lock:
+            data = {
+                'name': self.name,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_ms': {
+                    'count': self.wait_count,
+                    'sum': round(self.wait_sum_ms, 3),
+                    'max': round(self.wait_max_ms, 3),
+                    # 各区切り以下の件数（累積）
+                    'buckets': self._cumulative_buckets()
+                }
+            }
+        pool = self.pool
+        if isinstance(pool, QueuePool):
+            # プール自身の値の方が正確なので、貸し出し中の数はこちらを使う
+            data['in_use'] = pool.checkedout()
+            data['pool_size'] = pool.size()
+            data['overflow'] = pool.overflow()
+            data['idle'] = pool.checkedin()
+        return data
+
+    def _cumulative_buckets(self):
+        buckets = {}
+        total = 0
+        for bound, count in zip(WAIT_BUCKETS_MS + ('+Inf',), self.wait_buckets):
+            total += count
+            buckets[str(bound)] = total
+        return buckets
+
+
+class InstrumentedQueuePool(QueuePool):
+    """接続を借りるまでの待ち時間を計測するQueuePool"""
+
+    metrics = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.on_timeout()
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe_wait((time.perf_counter() - started) * 1000)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        if self.metrics is not None:
+            self.metrics.pool = pool
+        return pool
+
+
+# 名前（primaryなど）ごとのプールの集計
+pool_metrics = {}
+
+
+def build_engine_options(database_url):
+    """
+    環境変数からエンジンの設定（SQLALCHEMY_ENGINE_OPTIONS）を作る
+
+    SQLiteは開発・検証用なので、プールの大きさはライブラリの既定のままにする。
+
+    Args:
+        database_url: 接続先のURL
+
+    Returns:
+        dict: create_engine に渡す設定
+    """
+    if not database_url or database_url.startswith('sqlite'):
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+
+
+def instrument_engine(engine, name='primary'):
+    """
+    エンジンの接続プールに集計用のイベントを登録する
+
+    Args:
+        engine: 対象のエンジン
+        name: メトリクスに付ける名前
+
+    Returns:
+        PoolMetrics
+    """
+    metrics = pool_metrics.get(name)
+    if metrics is not None and metrics.pool is engine.pool:
+        return metrics
+
+    metrics = PoolMetrics(name)
+    metrics.pool = engine.pool
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.metrics = metrics
+    sa_event.listen(engine, 'connect', metrics.on_connect)
+    sa_event.listen(engine, 'checkout', metrics.on_checkout)
+    sa_event.listen(engine, 'checkin', metrics.on_checkin)
+    sa_event.listen(engine, 'invalidate', metrics.on_invalidate)
+    pool_metrics[name] = metrics
+    logger.info(f"接続プールを計測します: {name} ({type(engine.pool).__name__})")
+    return metrics
+
+
+def get_pool_metrics():
+    """すべてのプールの集計を返す"""
+    return [metrics.snapshot() for metrics in pool_metrics.values()]
+
+
+def format_prometheus(snapshots):
+    """
+    集計をPrometheusのテキスト形式にする
+
+    Args:
+        snapshots: get_pool_metrics() の戻り値
+
+    Returns:
+        str
+    """
+    lines = [
+        '# TYPE db_pool_in_use gauge',
+        '# TYPE db_pool_checkouts_total counter',
+        '# TYPE db_pool_timeouts_total counter',
+        '# TYPE db_pool_invalidations_total counter',
+        '# TYPE db_pool_checkout_wait_ms histogram',
+    ]
+    for data in snapshots:
+        label = f'pool="{data["name"]}"'
+        lines.append(f'db_pool_in_use{{{label}}} {data["in_use"]}')
+        lines.append(f'db_pool_checkouts_total{{{label}}} {data["checkouts"]}')
+        lines.append(f'db_pool_timeouts_total{{{label}}} {data["timeouts"]}')
+        lines.append(f'db_pool_invalidations_total{{{label}}} {data["invalidations"]}')
+        for bound, count in data['wait_ms']['buckets'].items():
+            lines.append(f'db_pool_checkout_wait_ms_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'db_pool_checkout_wait_ms_sum{{{label}}} {data["wait_ms"]["sum"]}')
+        lines.append(f'db_pool_checkout_wait_ms_count{{{label}}} {data["wait_ms"]["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,112 @@
+import os
+import random
+from functools import wraps
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+# 読み取り専用のレプリカの接続先（カンマ区切り）。未設定の場合はすべてプライマリを使う
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+
+# SQLALCHEMY_BINDS に登録するレプリカのバインドキーの接頭辞
+REPLICA_BIND_PREFIX = 'replica_'
+
+# レプリカに送ってよいリクエストのメソッド
+READ_ONLY_METHODS = ('GET', 'HEAD')
+
+
+def replica_binds(urls=None, engine_options=None):
+    """
+    レプリカの接続先から SQLALCHEMY_BINDS の設定を作る
+
+    Args:
+        urls: レプリカの接続先のリスト（Noneの場合は DATABASE_REPLICA_URLS）
+        engine_options: 各レプリカのエンジンに渡す設定を返す関数（URLを受け取る）
+
+    Returns:
+        dict: バインドキー -> 設定
+    """
+    urls = DATABASE_REPLICA_URLS if urls is None else urls
+    binds = {}
+    for i, url in enumerate(urls):
+        options = engine_options(url) if engine_options else {}
+        binds[f"{REPLICA_BIND_PREFIX}{i}"] = dict(options, url=url)
+    return binds
+
+
+def _request_route():
+    """
+    現在のリクエストで使う接続先（'primary' / 'replica'）
+
+    エンドポイントで use_primary / use_replica が指定されていればそれに従い、
+    なければGET/HEADのリクエストだけレプリカに送る。リクエストの外（バックグラウンド処理や
+    スクリプト）では常にプライマリを使う。
+    """
+    if not has_request_context():
+        return 'primary'
+    route = g.get('db_route')
+    if route:
+        return route
+    return 'replica' if request.method in READ_ONLY_METHODS else 'primary'
+
+
+class RoutingSession(Session):
+    """
+    読み取りをレプリカに、書き込みをプライマリに振り分けるセッション
+
+    - 書き込み（flushやUPDATE/DELETEなど）は常にプライマリに送る
+    - 一度プライマリに書き込んだセッションは、以降の読み取りもプライマリに送る（同じリクエスト内で書いた内容を読めるように）
+    - SELECT ... FOR UPDATE やSQL文字列（text）で実行したものはプライマリに送る
+    - 1つのセッションでは同じレプリカを使い続ける
+    """
+
+    def _replica_keys(self):
+        return [key for key in self._db.engines if isinstance(key, str) and key.startswith(REPLICA_BIND_PREFIX)]
+
+    def _is_read(self, clause):
+        return (
+            clause is not None
+            and getattr(clause, 'is_select', False)
+            and getattr(clause, '_for_update_arg', None) is None
+        )
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+
+        replica_keys = self._replica_keys()
+        if not replica_keys or self.info.get('used_primary'):
+            return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+        if not self._flushing and self._is_read(clause) and _request_route() == 'replica':
+            key = self.info.get('replica_key')
+            if key not in replica_keys:
+                key = self.info['replica_key'] = random.choice(replica_keys)
+            return self._db.engines[key]
+
+        if self._flushing or not self._is_read(clause):
+            self.info['used_primary'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_primary(fn):
+    """
+    エンドポイントの読み取りもすべてプライマリに送る（直前の書き込みを必ず読みたい場合）
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.db_route = 'primary'
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def use_replica(fn):
+    """
+    GET以外のエンドポイントでも、読み取りをレプリカに送る（検索など読み取り専用のPOST向け）
+
+    書き込みが発生した場合は、それ以降プライマリに切り替わる。
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.db_route = 'replica'
+        return fn(*args, **kwargs)
+    return wrapper
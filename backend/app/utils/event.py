@@ -2,9 +2,9 @@ from flask import jsonify, request, current_app
 from app.models import db
 from app.models.user import User
 from app.models.event import Event, UserTagAssociation, EventTagAssociation, TagMaster, UserMemberGroup
-from app.models.area import AreaList
 from app.models.file import ImageList
 from app.utils.jwt import verify_token
+from app.utils import refdata
 import os
 import random
 import requests
@@ -133,12 +133,9 @@ def get_recommended_events():
                 }
             
             # エリア情報を追加
-            area = AreaList.query.filter_by(area_id=event.area_id).first()
+            area = refdata.areas.get(event.area_id)
             if area:
-                event_data['area'] = {
-                    'id': area.area_id,
-                    'name': area.area_name
-                }
+                event_data['area'] = area
             
             result.append(event_data)
         
@@ -208,12 +205,9 @@ def get_events_list(area_id=None, tag=None, page=1, per_page=10, status=None):
             }
         
         # エリア情報を追加
-        area = AreaList.query.filter_by(area_id=event.area_id).first()
+        area = refdata.areas.get(event.area_id)
         if area:
-            event_data['area'] = {
-                'id': area.area_id,
-                'name': area.area_name
-            }
+            event_data['area'] = area
         
         result.append(event_data)
     
@@ -271,12 +265,9 @@ def get_event_detail(event_id, user_id=None):
         }
     
     # エリア情報を追加
-    area = AreaList.query.filter_by(area_id=event.area_id).first()
+    area = refdata.areas.get(event.area_id)
     if area:
-        event_data['area'] = {
-            'id': area.area_id,
-            'name': area.area_name
-        }
+        event_data['area'] = area
     
     # イベントのイメージを追加
     image = ImageList.query.get(event.image_id) if event.image_id else None
@@ -365,9 +356,8 @@ def get_event_start_message(event_id=None, event_title=None, event_type=None):
                 event_title = event.title
                 event_description = event.description
                 if event.area_id:
-                    area = AreaList.query.filter_by(area_id=event.area_id).first()
-                    if area:
-                        area_name = area.area_name
+                    area_name = refdata.area_name(event.area_id)
+                    if area_name:
                         current_app.logger.info(f"イベントエリア情報: {area_name}")
             else:
                 current_app.logger.warning(f"イベントが見つかりません: {event_id}")
@@ -581,9 +571,8 @@ def get_event_end_message(event_id=None, event_title=None, event_type=None):
                 event_title = event.title
                 event_description = event.description
                 if event.area_id:
-                    area = AreaList.query.filter_by(area_id=event.area_id).first()
-                    if area:
-                        area_name = area.area_name
+                    area_name = refdata.area_name(event.area_id)
+                    if area_name:
                         current_app.logger.info(f"イベントエリア情報: {area_name}")
             else:
                 current_app.logger.warning(f"イベントが見つかりません: {event_id}")
@@ -792,9 +781,8 @@ def get_event_weather_info(event_id, location=None):
                 current_app.logger.info(f"イベント情報取得成功: {event_id} - タイトル: {event.title}")
                 event_title = event.title
                 if event.area_id:
-                    area = AreaList.query.filter_by(area_id=event.area_id).first()
-                    if area:
-                        area_name = area.area_name
+                    area_name = refdata.area_name(event.area_id)
+                    if area_name:
                         current_app.logger.info(f"イベントエリア情報: {area_name}")
             else:
                 current_app.logger.warning(f"イベントが見つかりません: {event_id}")
@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from app.models.message import FriendRelationship
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの有効期間（秒）。他のワーカーでの変更はこの時間内に反映される
+FRIEND_GRAPH_TTL = int(os.getenv('FRIEND_GRAPH_TTL', 300))
+# キャッシュするユーザー数の上限（古いものから捨てる）
+FRIEND_GRAPH_MAX_USERS = int(os.getenv('FRIEND_GRAPH_MAX_USERS', 10000))
+
+# フレンド関係の1本の辺（other_idは相手のユーザーID）
+FriendEdge = namedtuple('FriendEdge', ['relationship_id', 'other_id', 'status', 'created_at', 'updated_at'])
+
+
+class FriendAdjacency:
+    """
+    1人のユーザーから見たフレンド関係
+
+    outgoing: 自分が送った関係（相手ID -> FriendEdge）
+    incoming: 相手から届いた関係（相手ID -> FriendEdge）
+    """
+
+    def __init__(self, outgoing, incoming):
+        self.outgoing = outgoing
+        self.incoming = incoming
+
+    def _with_status(self, edges, status):
+        return {other_id: edge for other_id, edge in edges.items() if edge.status == status}
+
+    @property
+    def following(self):
+        """承認済みの、自分から送った関係"""
+        return self._with_status(self.outgoing, 'accepted')
+
+    @property
+    def followers(self):
+        """承認済みの、相手から届いた関係"""
+        return self._with_status(self.incoming, 'accepted')
+
+    @property
+    def sent_requests(self):
+        """保留中の、自分から送ったリクエスト"""
+        return self._with_status(self.outgoing, 'pending')
+
+    @property
+    def received_requests(self):
+        """保留中の、相手から届いたリクエスト"""
+        return self._with_status(self.incoming, 'pending')
+
+    def is_friend(self, other_id):
+        """どちらかの向きで承認済みの関係があるか"""
+        return any(
+            edge is not None and edge.status == 'accepted'
+            for edge in (self.outgoing.get(other_id), self.incoming.get(other_id))
+        )
+
+    def relationship_with(self, other_id):
+        """相手との関係（自分から送ったものを優先、なければNone）"""
+        return self.outgoing.get(other_id) or self.incoming.get(other_id)
+
+
+class FriendGraph:
+    """ユーザーごとのフレンド関係をTTL付きでキャッシュする"""
+
+    def __init__(self, ttl=FRIEND_GRAPH_TTL, max_users=FRIEND_GRAPH_MAX_USERS):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # user_id -> (読み込んだ時刻, FriendAdjacency)
+        self.ttl = ttl
+        self.max_users = max_users
+        self.generation = 0  # 破棄のたびに増やし、読み込み中に変わった結果を保存しないようにする
+
+    def _load(self, user_id):
+        """DBからユーザーが関与するフレンド関係を読み込む"""
+        outgoing = {}
+        incoming = {}
+        relationships = FriendRelationship.query.filter(
+            (FriendRelationship.user_id == user_id) | (FriendRelationship.friend_id == user_id)
+        ).all()
+        for relationship in relationships:
+            if relationship.user_id == user_id:
+                outgoing[relationship.friend_id] = FriendEdge(
+                    relationship.id, relationship.friend_id, relationship.status,
+                    relationship.created_at, relationship.updated_at
+                )
+            else:
+                incoming[relationship.user_id] = FriendEdge(
+                    relationship.id, relationship.user_id, relationship.status,
+                    relationship.created_at, relationship.updated_at
+                )
+        return FriendAdjacency(outgoing, incoming)
+
+    def get(self, user_id):
+        """
+        ユーザーのフレンド関係を取得する（キャッシュになければDBから読み込む）
+
+        Returns:
+            FriendAdjacency
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and now - entry[0] < self.ttl:
+                self.entries.move_to_end(user_id)
+                return entry[1]
+            generation = self.generation
+
+        adjacency = self._load(user_id)
+        with self.lock:
+            if generation != self.generation:
+                return adjacency
+            self.entries[user_id] = (now, adjacency)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+        return adjacency
+
+    def invalidate(self, *user_ids):
+        """
+        関係が変わったユーザーのキャッシュを破棄する（承認・拒否・フォロー解除などのコミット後に呼ぶ）
+        """
+        with self.lock:
+            self.generation += 1
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+friend_graph = FriendGraph()
+
+
+def get_adjacency(user_id):
+    """ユーザーのフレンド関係を取得する"""
+    return friend_graph.get(user_id)
+
+
+def are_friends(user_id, other_id):
+    """2人が承認済みのフレンドか"""
+    return friend_graph.get(user_id).is_friend(other_id)
+
+
+def invalidate_relationship(user_id, other_id):
+    """2人の間の関係が変わったことをキャッシュに反映する"""
+    friend_graph.invalidate(user_id, other_id)
@@ -0,0 +1,346 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from flask import request, current_app, make_response
+from sqlalchemy import select, update, inspect, event as orm_event, exc
+from sqlalchemy.orm import Session, object_session
+from app.models import db
+from app.models.cache import ResourceVersion
+from app.models.user import User
+from app.models.area import AreaList
+from app.models.character import Character
+from app.models.event import (
+    Event, UserMemberGroup, UserHeartEvent,
+    TagMaster, UserTagAssociation, EventTagAssociation, ThreadTagAssociation
+)
+from app.models.thread import Thread, UserHeartThread
+from app.models.message import FriendRelationship
+from app.utils.jwt import decode_token
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+# レンダリング済みのJSONをワーカーのメモリに保持する時間（秒）と件数
+HTTP_CACHE_TTL = int(os.getenv('HTTP_CACHE_TTL', 30))
+HTTP_CACHE_MAX_ENTRIES = int(os.getenv('HTTP_CACHE_MAX_ENTRIES', 1000))
+# バージョンを上げない変更（一覧に埋め込まれるメッセージ数など）を反映するため、この間隔（秒）でETagを変える
+HTTP_CACHE_REVALIDATE_INTERVAL = int(os.getenv('HTTP_CACHE_REVALIDATE_INTERVAL', 60))
+
+# 一覧のリソース名 -> 変更されたらそのリソースのバージョンを上げるモデル
+# 一覧に埋め込まれる参加者数・いいね数を変える子テーブルも含める。メッセージは送信のたびに
+# バージョンの行を更新しないよう含めず、メッセージ数は HTTP_CACHE_REVALIDATE_INTERVAL ごとに反映する
+RESOURCES = {
+    'events': (Event, EventTagAssociation, UserMemberGroup, UserHeartEvent),
+    'threads': (Thread, ThreadTagAssociation, UserHeartThread),
+    'users': (User,),
+    'refdata': (AreaList, TagMaster, Character),
+}
+
+# ユーザーごとのリソース名 -> {モデル: ユーザーIDのカラム}。バージョンは「リソース名:ユーザーID」の行に持つ
+SCOPED_RESOURCES = {
+    'user': {
+        User: ('id',),
+        UserTagAssociation: ('user_id',),
+        UserMemberGroup: ('user_id',),
+        FriendRelationship: ('user_id', 'friend_id'),
+        Event: ('author_user_id',),
+    },
+}
+
+# 変更されてもレスポンスの内容が変わらないカラム（ログイン日時の記録などではバージョンを上げない）
+IGNORED_COLUMNS = {
+    User: {'last_login_at', 'updated_at', 'password_hash'},
+}
+
+
+def _now():
+    return datetime.now(JST).replace(tzinfo=None)
+
+
+def current_versions(names):
+    """
+    リソースの現在のバージョンを1回のクエリで取得する
+
+    GETのリクエストではデータと同じレプリカから読む（データより先にバージョンだけ進むことはない）。
+
+    Returns:
+        tuple: ({リソース名: バージョン}, 最終更新日時（JST, naive）またはNone)
+    """
+    rows = db.session.execute(
+        select(ResourceVersion.name, ResourceVersion.version, ResourceVersion.updated_at)
+        .where(ResourceVersion.name.in_(names))
+    ).all()
+    versions = {name: 0 for name in names}
+    last_modified = None
+    for name, version, updated_at in rows:
+        versions[name] = version
+        if last_modified is None or updated_at > last_modified:
+            last_modified = updated_at
+    return versions, last_modified
+
+
+def bump_versions(names, connection=None):
+    """
+    リソースのバージョンを1つ上げる（行がなければ作成する）
+
+    Args:
+        names: リソース名のリスト
+        connection: 使用する接続（Noneの場合はプライマリで新しいトランザクションを開始する）
+    """
+    names = sorted(set(names))
+    if not names:
+        return
+    if connection is None:
+        with db.engine.begin() as conn:
+            return bump_versions(names, connection=conn)
+
+    now = _now()
+    table = ResourceVersion.__table__
+    # 名前順に更新して、同時に複数のリソースを上げるトランザクション同士のデッドロックを避ける
+    for name in names:
+        result = connection.execute(
+            update(table).where(table.c.name == name).values(version=table.c.version + 1, updated_at=now)
+        )
+        if result.rowcount:
+            continue
+        try:
+            with connection.begin_nested():
+                connection.execute(table.insert().values(name=name, version=1, updated_at=now))
+        except exc.IntegrityError:
+            # 同時に作成された場合はその行を上げる
+            connection.execute(
+                update(table).where(table.c.name == name).values(version=table.c.version + 1, updated_at=now)
+            )
+
+
+class ResponseCache:
+    """レンダリング済みのJSONを (キー, ETag) ごとに保持するLRUキャッシュ"""
+
+    def __init__(self, max_entries=HTTP_CACHE_MAX_ENTRIES):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, etag):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != etag or entry[1] < now:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, etag, body, ttl):
+        with self.lock:
+            self.entries[key] = (etag, time.monotonic() + ttl, body)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+response_cache = ResponseCache()
+
+
+def _viewer_id():
+    # 認証ヘッダーのトークンからユーザーIDだけを取り出す（DBには問い合わせない）
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    return decode_token(auth_header.split(' ', 1)[1])
+
+
+def _cache_key(personalized):
+    args = '&'.join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    key = f"{request.path}?{args}"
+    if personalized:
+        key += f"#{_viewer_id() or ''}"
+    return key
+
+
+def _make_etag(key, versions, interval):
+    source = key + '|' + ','.join(f"{name}:{versions[name]}" for name in sorted(versions)) + f"|{interval}"
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:20]
+
+
+def _not_modified(request_etag, last_modified):
+    if request.if_none_match:
+        # 圧縮したレスポンスは弱いETagになるため、弱い比較で照合する
+        return request.if_none_match.contains_weak(request_etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return request.if_modified_since >= last_modified
+    return False
+
+
+def _set_validators(response, etag, last_modified, personalized):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # ブラウザはキャッシュしてよいが、使う前に必ず確認させる
+    response.headers['Cache-Control'] = 'private, no-cache' if personalized else 'no-cache'
+    if personalized:
+        response.vary.add('Authorization')
+    return response
+
+
+def _resource_names(resources, scope_id):
+    names = [name for name in resources if name in RESOURCES]
+    if scope_id:
+        names += [f"{name}:{scope_id}" for name in resources if name in SCOPED_RESOURCES]
+    return names
+
+
+def conditional(*resources, personalized=False, cache=True, ttl=None, scope=None):
+    """
+    GETのエンドポイントにETag・Last-Modifiedを付け、変更がなければ304を返すデコレーター
+
+    ETagはパス・クエリパラメータ・リソースのバージョン（personalized の場合はユーザーIDも）から計算する。
+    If-None-Match が一致すれば、ビュー関数を呼ばずに304を返す（クエリはバージョンの取得1回だけ）。
+    cache=True の場合は200のJSONをワーカーのメモリに保持し、同じETagなら再利用する。
+
+    Args:
+        resources: レスポンスの内容が依存するリソース名（RESOURCES または SCOPED_RESOURCES のキー）
+        personalized: ログインユーザーによって内容が変わる場合はTrue
+        cache: レンダリング済みのJSONを保持するかどうか
+        ttl: 保持する時間（秒）。Noneの場合は HTTP_CACHE_TTL
+        scope: SCOPED_RESOURCES のユーザーID。URLの引数名、またはログインユーザーなら 'viewer'
+    """
+    unknown = set(resources) - set(RESOURCES) - set(SCOPED_RESOURCES)
+    if unknown:
+        raise ValueError(f"未定義のリソースです: {', '.join(sorted(unknown))}")
+    if scope is None and set(resources) & set(SCOPED_RESOURCES):
+        raise ValueError("ユーザーごとのリソースには scope を指定してください")
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+
+            scope_id = _viewer_id() if scope == 'viewer' else kwargs.get(scope) if scope else None
+            # データより先にバージョンを読む（読んでいる間に更新されても、古いETagで新しい内容を返すだけになる）
+            versions, last_modified = current_versions(_resource_names(resources, scope_id))
+            interval = int(time.time() // HTTP_CACHE_REVALIDATE_INTERVAL)
+            interval_start = datetime.fromtimestamp(interval * HTTP_CACHE_REVALIDATE_INTERVAL, JST).replace(tzinfo=None)
+            if last_modified is None or interval_start > last_modified:
+                last_modified = interval_start
+            last_modified = last_modified.replace(tzinfo=JST, microsecond=0)
+            key = _cache_key(personalized)
+            etag = _make_etag(key, versions, interval)
+
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+                return _set_validators(response, etag, last_modified, personalized)
+
+            if cache:
+                body = response_cache.get(key, etag)
+                if body is not None:
+                    response = current_app.response_class(body, mimetype='application/json')
+                    return _set_validators(response, etag, last_modified, personalized)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or not response.is_json:
+                return response
+            if cache:
+                response_cache.set(key, etag, response.get_data(), ttl or HTTP_CACHE_TTL)
+            return _set_validators(response, etag, last_modified, personalized)
+        return wrapper
+    return decorator
+
+
+# 変更されたリソースを記録し、コミット後にまとめてバージョンを上げる（ロールバックされたら何もしない）
+# 書き込みのトランザクションでバージョンの行をロックし続けないよう、別の短いトランザクションで更新する
+_RESOURCE_NAMES = {}
+for _name, _models in RESOURCES.items():
+    for _model in _models:
+        _RESOURCE_NAMES.setdefault(_model, []).append(_name)
+
+_SCOPE_COLUMNS = {}
+for _name, _columns_by_model in SCOPED_RESOURCES.items():
+    for _model, _columns in _columns_by_model.items():
+        _SCOPE_COLUMNS.setdefault(_model, []).append((_name, _columns))
+
+
+def _record_changed(session, names):
+    if names:
+        session.info.setdefault('changed_resources', set()).update(names)
+
+
+def _has_relevant_changes(target):
+    ignored = IGNORED_COLUMNS.get(type(target))
+    if not ignored:
+        return True
+    return any(attr.history.has_changes() for attr in inspect(target).attrs if attr.key not in ignored)
+
+
+def _mark_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    names = set(_RESOURCE_NAMES.get(type(target), ()))
+    for name, columns in _SCOPE_COLUMNS.get(type(target), ()):
+        names.update(f"{name}:{getattr(target, column)}" for column in columns if getattr(target, column))
+    _record_changed(session, names)
+
+
+def _mark_updated(mapper, connection, target):
+    if _has_relevant_changes(target):
+        _mark_changed(mapper, connection, target)
+
+
+for _model in set(_RESOURCE_NAMES) | set(_SCOPE_COLUMNS):
+    orm_event.listen(_model, 'after_insert', _mark_changed)
+    orm_event.listen(_model, 'after_update', _mark_updated)
+    orm_event.listen(_model, 'after_delete', _mark_changed)
+
+
+@orm_event.listens_for(Session, 'do_orm_execute')
+def _mark_bulk_changed(orm_execute_state):
+    """Query.delete() / update() はマッパーのイベントを呼ばないため、実行前に対象のリソースを記録する"""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    model = mapper.class_ if mapper is not None else None
+    if model not in _RESOURCE_NAMES and model not in _SCOPE_COLUMNS:
+        return
+
+    names = set(_RESOURCE_NAMES.get(model, ()))
+    criteria = orm_execute_state.statement.whereclause
+    for name, columns in _SCOPE_COLUMNS.get(model, ()):
+        # 対象の行のユーザーIDを同じ条件で先に引く
+        for column in columns:
+            query = select(getattr(model, column)).distinct()
+            if criteria is not None:
+                query = query.where(criteria)
+            names.update(f"{name}:{value}" for (value,) in orm_execute_state.session.execute(query) if value)
+    _record_changed(orm_execute_state.session, names)
+
+
+@orm_event.listens_for(Session, 'after_commit')
+def _bump_changed(session):
+    names = session.info.pop('changed_resources', None)
+    if not names:
+        return
+    try:
+        bump_versions(names)
+    except Exception as e:
+        logger.error(f"リソースのバージョンを更新できませんでした ({', '.join(sorted(names))}): {e}")
+
+
+@orm_event.listens_for(Session, 'after_soft_rollback')
+def _discard_changed(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop('changed_resources', None)
@@ -0,0 +1,259 @@
+import os
+import logging
+import time
+from datetime import datetime, timezone, timedelta
+from app.models import db
+from app.models.file import ImageList, StoredObject
+from app.models.user import User
+from app.models.character import Character
+from app.models.event import Event
+from app.models.thread import Thread, ThreadMessage
+from app.models.message import EventMessage, DirectMessage
+from app.utils.storage import extract_object_key, iter_object_pages, delete_files
+from app.utils.image_store import delete_images
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+# image_idで画像を参照しているカラム
+IMAGE_REFERENCE_COLUMNS = [
+    Event.image_id,
+    Thread.image_id,
+    ThreadMessage.image_id,
+    EventMessage.image_id,
+    DirectMessage.image_id
+]
+
+# ImageList.entity_type と対応するモデル
+ENTITY_MODELS = {
+    'thread': Thread,
+    'event': Event,
+    'thread_message': ThreadMessage,
+    'event_message': EventMessage,
+    'direct_message': DirectMessage,
+    'user_profile': User
+}
+
+# 参照がなくても削除しないキーのプレフィックス（本人確認書類など）
+PROTECTED_PREFIXES = ('age-verification/',)
+
+# アップロード直後でまだエンティティに紐付いていない画像を消さないための猶予
+DEFAULT_GRACE_PERIOD = timedelta(hours=24)
+
+# MINIO_BUCKET の外にあると分かっているURLのプレフィックス（他のバケットや外部サービスの画像。カンマ区切り）
+IMAGE_GC_EXTERNAL_URL_PREFIXES = tuple(
+    prefix.strip() for prefix in os.getenv('IMAGE_GC_EXTERNAL_URL_PREFIXES', '').split(',') if prefix.strip()
+)
+
+
+def _is_protected(key):
+    return bool(key) and key.startswith(PROTECTED_PREFIXES)
+
+
+def _referenced_image_ids(image_ids):
+    """image_idカラムから参照されている画像IDを返す"""
+    referenced = set()
+    for column in IMAGE_REFERENCE_COLUMNS:
+        rows = db.session.query(column).filter(column.in_(image_ids)).distinct().all()
+        referenced.update(row[0] for row in rows)
+    return referenced
+
+
+def _existing_entities(images):
+    """entity_type/entity_idが指すエンティティのうち存在するものを返す"""
+    ids_by_type = {}
+    for image in images:
+        if image.entity_type in ENTITY_MODELS and image.entity_id:
+            ids_by_type.setdefault(image.entity_type, set()).add(image.entity_id)
+
+    existing = set()
+    for entity_type, entity_ids in ids_by_type.items():
+        model = ENTITY_MODELS[entity_type]
+        rows = db.session.query(model.id).filter(model.id.in_(entity_ids)).all()
+        existing.update((entity_type, row[0]) for row in rows)
+    return existing
+
+
+def _find_orphans(images, cutoff):
+    """バッチ内の画像のうち、どこからも参照されていないものを返す"""
+    image_ids = [image.id for image in images]
+    referenced_ids = _referenced_image_ids(image_ids)
+    existing = _existing_entities(images)
+    profile_urls = {
+        row[0] for row in db.session.query(User.user_image_url).filter(
+            User.user_image_url.in_([image.image_url for image in images])
+        ).all()
+    }
+
+    orphans = []
+    for image in images:
+        if image.id in referenced_ids or image.image_url in profile_urls:
+            continue
+        if (image.entity_type, image.entity_id) in existing:
+            continue
+        if image.upload_date and image.upload_date > cutoff:
+            continue
+        if _is_protected(extract_object_key(image.image_url)):
+            continue
+        orphans.append(image)
+    return orphans
+
+
+def delete_unreferenced_images(image_ids):
+    """
+    エンティティの削除で使われなくなった画像をまとめて削除する（呼び出し側でコミットすること）
+
+    エンティティの行を削除した後に呼ぶ。他の行やプロフィール画像から参照されている画像は残す。
+
+    Args:
+        image_ids: 削除したエンティティが参照していた画像IDのリスト
+
+    Returns:
+        int: 削除したImageListの件数
+    """
+    image_ids = list({image_id for image_id in image_ids if image_id})
+    if not image_ids:
+        return 0
+    db.session.flush()
+    referenced_ids = _referenced_image_ids(image_ids)
+    images = [
+        image for image in ImageList.query.filter(ImageList.id.in_(image_ids)).all()
+        if image.id not in referenced_ids
+    ]
+    profile_urls = {
+        row[0] for row in db.session.query(User.user_image_url).filter(
+            User.user_image_url.in_([image.image_url for image in images])
+        ).all()
+    }
+    images = [image for image in images if image.image_url not in profile_urls]
+    delete_images(images)
+    return len(images)
+
+
+def _collect_referenced_keys(batch_size):
+    """
+    DB上のいずれかの行から参照されているオブジェクトキーを集める
+
+    Returns:
+        tuple: (参照されているキーの集合, キーを取り出せなかったURLの件数, その例（最大5件）)
+    """
+    referenced = set()
+    unparsed = 0
+    examples = []
+    url_columns = [ImageList.image_url, User.user_image_url, Character.avatar_url]
+    for column in url_columns:
+        for (url,) in db.session.query(column).filter(column.isnot(None)).yield_per(batch_size):
+            key = extract_object_key(url)
+            if key:
+                referenced.add(key)
+            elif url and not url.startswith(IMAGE_GC_EXTERNAL_URL_PREFIXES):
+                unparsed += 1
+                if len(examples) < 5:
+                    examples.append(url)
+    for (object_key,) in db.session.query(StoredObject.object_key).yield_per(batch_size):
+        referenced.add(object_key)
+    return referenced, unparsed, examples
+
+
+def collect_orphan_images(dry_run=True, batch_size=500, grace_period=DEFAULT_GRACE_PERIOD, scan_objects=True):
+    """
+    孤立した画像（ImageListの行とストレージ上のオブジェクト）を削除する
+
+    1. ImageListをIDのキーセットでページングしながら走査し、どのエンティティからも
+       参照されていない行をまとめて削除する
+    2. バケット内のオブジェクトをページ単位で列挙し、DBから参照されていないものを
+       マルチオブジェクト削除でまとめて削除する
+
+    走査するのは MINIO_BUCKET だけで、他のバケット（seed.py の character-images など）の
+    オブジェクトは削除しない。2.ではURLからキーを取り出して参照を判定するため、キーを
+    取り出せないURLが1件でもあれば参照中のオブジェクトを消さないよう削除を行わない
+    （バケット外と分かっているURLは IMAGE_GC_EXTERNAL_URL_PREFIXES で除外できる）。
+
+    Args:
+        dry_run: Trueの場合は削除せず件数だけ数える
+        batch_size: 1回に走査するImageListの件数
+        grace_period: この期間内にアップロードされたものは削除しない
+        scan_objects: ストレージ上のオブジェクトも走査するかどうか
+
+    Returns:
+        dict: 走査件数・削除件数・処理時間・スループット
+    """
+    started = time.monotonic()
+    cutoff = datetime.now(JST) - grace_period
+    stats = {
+        'dry_run': dry_run,
+        'rows_scanned': 0,
+        'orphan_rows': 0,
+        'rows_deleted': 0,
+        'objects_scanned': 0,
+        'orphan_objects': 0,
+        'objects_deleted': 0,
+        'bytes_freed': 0,
+        'delete_failures': 0,
+        'unparsed_urls': 0,
+        'objects_skipped': False
+    }
+
+    # 1. ImageListの走査
+    last_id = None
+    while True:
+        query = ImageList.query.order_by(ImageList.id)
+        if last_id is not None:
+            query = query.filter(ImageList.id > last_id)
+        images = query.limit(batch_size).all()
+        if not images:
+            break
+        last_id = images[-1].id
+        stats['rows_scanned'] += len(images)
+
+        orphans = _find_orphans(images, cutoff.replace(tzinfo=None))
+        stats['orphan_rows'] += len(orphans)
+        if orphans and not dry_run:
+            # 統計を取るため、参照のなくなった実体はコミット後にここで削除する
+            released_keys = delete_images(orphans, delete_objects=False)
+            db.session.commit()
+            stats['rows_deleted'] += len(orphans)
+            if released_keys:
+                deleted, failed = delete_files(released_keys)
+                stats['objects_deleted'] += deleted
+                stats['delete_failures'] += len(failed)
+        # 走査済みのオブジェクトをセッションに溜め込まない
+        db.session.expunge_all()
+
+    rows_elapsed = time.monotonic() - started
+
+    # 2. ストレージ上のオブジェクトの走査
+    if scan_objects:
+        referenced_keys, unparsed, examples = _collect_referenced_keys(batch_size)
+        stats['unparsed_urls'] = unparsed
+        if unparsed and not dry_run:
+            logger.warning(f"キーを取り出せない画像URLが{unparsed}件あるため、オブジェクトの削除を省略します（例: {examples}）")
+            stats['objects_skipped'] = True
+    if scan_objects and not stats['objects_skipped']:
+        for page in iter_object_pages(page_size=min(batch_size, 1000)):
+            stats['objects_scanned'] += len(page)
+            orphan_objects = [
+                obj for obj in page
+                if obj['key'] not in referenced_keys
+                and not _is_protected(obj['key'])
+                and (obj['last_modified'] is None or obj['last_modified'] < cutoff)
+            ]
+            stats['orphan_objects'] += len(orphan_objects)
+            if orphan_objects and not dry_run:
+                deleted, failed = delete_files([obj['key'] for obj in orphan_objects])
+                failed = set(failed)
+                stats['objects_deleted'] += deleted
+                stats['delete_failures'] += len(failed)
+                stats['bytes_freed'] += sum(obj['size'] for obj in orphan_objects if obj['key'] not in failed)
+            elif dry_run:
+                stats['bytes_freed'] += sum(obj['size'] for obj in orphan_objects)
+
+    elapsed = time.monotonic() - started
+    objects_elapsed = elapsed - rows_elapsed
+    stats['elapsed_sec'] = round(elapsed, 3)
+    stats['rows_per_sec'] = round(stats['rows_scanned'] / rows_elapsed, 1) if rows_elapsed > 0 else None
+    stats['objects_per_sec'] = round(stats['objects_scanned'] / objects_elapsed, 1) if scan_objects and objects_elapsed > 0 else None
+
+    logger.info(f"孤立画像のクリーンアップ完了: {stats}")
+    return stats
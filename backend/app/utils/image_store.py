@@ -0,0 +1,151 @@
+import hashlib
+import logging
+from collections import Counter
+from sqlalchemy.exc import IntegrityError
+from app.models import db
+from app.models.file import ImageList, StoredObject
+from app.utils.storage import upload_file, delete_files, IMMUTABLE_CACHE_CONTROL
+from app.utils.background import enqueue_after_commit
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024  # 1MBずつ読み込んでハッシュを計算
+
+
+def compute_content_hash(stream):
+    """
+    ファイルオブジェクトの内容のSHA-256を計算する（読み終わったら先頭に戻す）
+
+    Args:
+        stream: シーク可能なファイルオブジェクト
+
+    Returns:
+        str: 16進数のハッシュ値
+    """
+    stream.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _increment_ref_count(content_hash, delta):
+    """参照カウントをSQL側で増減する（更新した行数を返す。行がなければ0）"""
+    return StoredObject.query.filter_by(content_hash=content_hash).update(
+        {StoredObject.ref_count: StoredObject.ref_count + delta},
+        synchronize_session=False
+    )
+
+
+def store_image(stream, prefix, extension, content_type=None, size=None):
+    """
+    内容ハッシュで重複排除して画像を保存する
+
+    同じ内容の画像が既に保存されていればアップロードせず参照カウントを増やすだけにする。
+    呼び出し側は返されたハッシュをImageList.content_hashに設定してコミットすること。
+
+    Args:
+        stream: シーク可能なファイルオブジェクト
+        prefix: 新規保存時のキーのプレフィックス（例: 'thread-messages'）
+        extension: ファイルの拡張子
+        content_type: ファイルのMIMEタイプ
+        size: ファイルサイズ（バイト）
+
+    Returns:
+        成功時: StoredObject
+        失敗時: None
+    """
+    content_hash = compute_content_hash(stream)
+
+    # 保存済みなら参照カウントを増やすだけにする。確認と加算の間にGCで行が削除された場合は
+    # 更新行数が0になるので、新規と同じくアップロードして作り直す
+    if _increment_ref_count(content_hash, 1):
+        return db.session.get(StoredObject, content_hash, populate_existing=True)
+
+    object_key = f"{prefix}/{content_hash}.{extension}"
+    # キーは内容から決まり上書きされないため、長期キャッシュを許可する
+    image_url = upload_file(stream, object_key, content_type, IMMUTABLE_CACHE_CONTROL)
+    if not image_url:
+        return None
+
+    stored = StoredObject(
+        content_hash=content_hash,
+        object_key=object_key,
+        image_url=image_url,
+        content_type=content_type,
+        size=size,
+        ref_count=1
+    )
+    try:
+        # 同じ内容が同時にアップロードされた場合は先に登録された方を使う
+        with db.session.begin_nested():
+            db.session.add(stored)
+    except IntegrityError:
+        _increment_ref_count(content_hash, 1)
+        stored = db.session.get(StoredObject, content_hash, populate_existing=True)
+
+    return stored
+
+
+def delete_stored_objects(object_keys):
+    """参照のなくなったストレージ上の実体を削除する（コミット後にバックグラウンドで実行する）"""
+    deleted, failed = delete_files(object_keys)
+    if failed:
+        logger.warning(f"参照のなくなったオブジェクトの削除に失敗しました: {failed}")
+    return deleted, failed
+
+
+def delete_images(images, delete_objects=True):
+    """
+    ImageListの行をまとめて削除し、参照している実体の参照カウントを減らす
+
+    ImageListを削除する処理はすべてこの関数を通す。参照がなくなったStoredObjectの行も削除し、
+    ストレージ上の実体はコミット後に削除する（ロールバックされた場合は削除しない）。
+    呼び出し側でコミットすること。
+
+    Args:
+        images: 削除するImageListのリスト
+        delete_objects: Falseの場合はストレージ上の実体を削除しない（呼び出し側がコミット後に削除する）
+
+    Returns:
+        list: 参照がなくなったオブジェクトのキー
+    """
+    if not images:
+        return []
+
+    ImageList.query.filter(ImageList.id.in_([image.id for image in images])).delete(synchronize_session='evaluate')
+
+    hash_counts = Counter(image.content_hash for image in images if image.content_hash)
+    for content_hash, count in hash_counts.items():
+        _increment_ref_count(content_hash, -count)
+    if not hash_counts:
+        return []
+
+    released = db.session.query(StoredObject.content_hash, StoredObject.object_key).filter(
+        StoredObject.content_hash.in_(list(hash_counts.keys())),
+        StoredObject.ref_count <= 0
+    ).all()
+    if not released:
+        return []
+    StoredObject.query.filter(
+        StoredObject.content_hash.in_([content_hash for content_hash, _ in released])
+    ).delete(synchronize_session=False)
+
+    object_keys = tuple(object_key for _, object_key in released)
+    if delete_objects:
+        enqueue_after_commit(db.session(), delete_stored_objects, object_keys)
+    return list(object_keys)
+
+
+def delete_image(image):
+    """
+    ImageListの行を1件削除する（delete_images を参照）
+
+    Args:
+        image: 削除するImageList
+
+    Returns:
+        list: 参照がなくなったオブジェクトのキー
+    """
+    return delete_images([image])
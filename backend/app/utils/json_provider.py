@@ -0,0 +1,98 @@
+import os
+import json
+import uuid
+import decimal
+import logging
+import dataclasses
+from datetime import date, datetime, time
+from flask.json.provider import DefaultJSONProvider
+
+logger = logging.getLogger(__name__)
+
+# orjson はインストールされている場合だけ使う（requirements.txt を参照）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# auto: orjson があれば使う / std: 標準の json モジュールを使う
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+
+
+def _default(o):
+    """標準の json モジュールで変換できない値をJSONの値にする（orjson でも同じ結果になるように合わせる）"""
+    if isinstance(o, (datetime, date, time)):
+        return o.isoformat()
+    if isinstance(o, decimal.Decimal):
+        # floatにすると桁が落ちるため文字列で返す
+        return str(o)
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    if hasattr(o, 'item'):
+        # numpyのスカラー（推薦スコアなど）
+        return o.item()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    jsonify などで使うJSONの変換（app.json）
+
+    orjson があれば使い、なければ標準の json モジュールで同じ形式に変換する。
+    日時はISO 8601、Decimalは文字列で出力し、日本語はエスケープせずUTF-8のまま返す。
+    orjson で変換できない値（64bitを超える整数など）が含まれる場合は標準の json モジュールで変換し直す。
+    """
+
+    ensure_ascii = False
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.use_orjson = orjson is not None and JSON_BACKEND != 'std'
+
+    def _pretty(self):
+        # DefaultJSONProvider と同じく、compact が未設定ならデバッグ時だけ整形する
+        return (self.compact is None and self._app.debug) or self.compact is False
+
+    def _orjson_options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self._pretty():
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj):
+        """UTF-8でエンコードしたJSONを返す"""
+        if self.use_orjson:
+            try:
+                return orjson.dumps(obj, default=_default, option=self._orjson_options())
+            except TypeError as e:
+                logger.debug(f"orjsonで変換できないため標準のjsonで変換します: {e}")
+        indent = 2 if self._pretty() else None
+        separators = None if indent else (',', ':')
+        return json.dumps(
+            obj, default=_default, ensure_ascii=self.ensure_ascii, sort_keys=self.sort_keys,
+            indent=indent, separators=separators
+        ).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # 文字列を経由せず、バイト列のままレスポンスにする
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,251 @@
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import inspect, text, select, func
+from sqlalchemy.schema import CreateColumn
+from app.models import db
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+# 適用済みのマイグレーションを記録するテーブル（create_allでも作成される）
+schema_version = db.Table(
+    'schema_version',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('description', db.String(200), nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False)
+)
+
+# 複数のワーカーが同時に起動したときに、マイグレーションを1つずつ適用するためのロック名（MySQL）
+MIGRATION_LOCK_NAME = 'schema_migrations'
+MIGRATION_LOCK_TIMEOUT = 60
+
+
+def _find_index(name):
+    """モデルの __table_args__ に宣言されたインデックスを名前で探す"""
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(f"インデックスが見つかりません: {name}")
+
+
+def add_column(conn, table_name, column_name):
+    """
+    モデルに宣言されたカラムが既存のテーブルになければ追加する
+
+    Returns:
+        bool: 追加した場合はTrue
+    """
+    inspector = inspect(conn)
+    if not inspector.has_table(table_name):
+        return False
+    if column_name in {column['name'] for column in inspector.get_columns(table_name)}:
+        return False
+
+    # 型・NOT NULL・DEFAULTを含むカラム定義（既存の行にはDEFAULTの値が入る）
+    column = db.metadata.tables[table_name].c[column_name]
+    definition = CreateColumn(column).compile(dialect=conn.dialect)
+    preparer = conn.dialect.identifier_preparer
+    conn.execute(text(f"ALTER TABLE {preparer.quote(table_name)} ADD COLUMN {definition}"))
+    logger.info(f"カラムを追加しました: {table_name}.{column_name}")
+    return True
+
+
+def create_index(conn, name):
+    """
+    モデルに宣言されたインデックスがなければ作成する
+
+    Returns:
+        bool: 作成した場合はTrue
+    """
+    index = _find_index(name)
+    inspector = inspect(conn)
+    if not inspector.has_table(index.table.name):
+        return False
+    if name in {existing['name'] for existing in inspector.get_indexes(index.table.name)}:
+        return False
+    index.create(bind=conn)
+    logger.info(f"インデックスを作成しました: {name}")
+    return True
+
+
+def _create_tables(conn):
+    # モデルにあって、まだ存在しないテーブルを作成する（既存のテーブルは変更しない）
+    db.metadata.create_all(bind=conn)
+
+
+def _add_image_content_hash(conn):
+    add_column(conn, 'image_list', 'content_hash')
+    create_index(conn, 'ix_image_list_content_hash')
+
+
+def _add_keyset_indexes(conn):
+    for name in (
+        'ix_event_message_event_timestamp',
+        'ix_direct_message_pair_sent_at',
+        'ix_thread_published_at',
+        'ix_thread_area_published_at',
+    ):
+        create_index(conn, name)
+
+
+def _add_hot_query_indexes(conn):
+    for name in (
+        'ix_event_deleted_published_at',
+        'ix_event_area_deleted_published_at',
+        'ix_event_status_deleted_published_at',
+        'ix_event_author_deleted_published_at',
+        'ix_friend_relationship_user_friend_status',
+        'ix_friend_relationship_friend_status',
+        'ix_user_tag_association_user_tag',
+        'ix_event_tag_association_event_tag',
+        'ix_event_tag_association_tag_event',
+    ):
+        create_index(conn, name)
+
+
+def _add_counter_columns(conn):
+    from app.utils.counters import reconcile_counters
+    for table_name in ('thread', 'event'):
+        add_column(conn, table_name, 'hearts_count')
+        add_column(conn, table_name, 'messages_count')
+    # 既存の行の件数を子テーブルから数えて入れる
+    reconcile_counters(connection=conn)
+
+
+def _add_thread_tag_indexes(conn):
+    create_index(conn, 'ix_thread_tag_association_tag_thread')
+    create_index(conn, 'ix_thread_tag_association_thread_tag')
+
+
+def _create_search_document(conn):
+    # 既存のイベント・スレッドの分かち書きは、初回の検索時か scripts/rebuild_search_index.py で作る
+    from app.models.search import SearchDocument
+    SearchDocument.__table__.create(bind=conn, checkfirst=True)
+
+
+def _create_resource_version(conn):
+    # 行はリソースが最初に変更されたときに作成する（それまではバージョン0として扱う）
+    from app.models.cache import ResourceVersion
+    ResourceVersion.__table__.create(bind=conn, checkfirst=True)
+
+
+def _backfill_direct_conversations(conn):
+    # 既存のDMから全ユーザーの会話一覧を作る（作り直しなので再実行しても同じ結果になる）
+    from app.utils.conversations import rebuild_conversations
+    rebuild_conversations(connection=conn)
+
+
+def _backfill_timelines(conn):
+    # 機能追加前のフレンド関係のタイムラインを作る（既にある行は無視するので再実行できる）
+    from app.utils.timeline import backfill_all_timelines
+    backfill_all_timelines(connection=conn)
+
+
+def _backfill_read_watermarks(conn):
+    # 既読位置の導入前から参加しているイベントの既読位置を作り、未読数を数え直す
+    from app.utils.read_tracking import recompute_unread_counts
+    recompute_unread_counts(connection=conn)
+
+
+# (バージョン, 説明, 適用する関数)。追加するときは末尾に次の番号で足す。
+# 各関数は既に適用済みの部分を確認してから変更するので、途中で失敗しても再実行できる。
+MIGRATIONS = [
+    (1, 'モデルに対応するテーブルを作成', _create_tables),
+    (2, 'image_list.content_hash を追加', _add_image_content_hash),
+    (3, 'メッセージとスレッドのキーセット用インデックス', _add_keyset_indexes),
+    (4, 'イベント・フレンド関係・タグの検索用インデックス', _add_hot_query_indexes),
+    (5, 'スレッドとイベントのいいね数・メッセージ数のカラム', _add_counter_columns),
+    (6, 'スレッドのタグ検索用インデックス', _add_thread_tag_indexes),
+    (7, '全文検索用の search_document テーブル', _create_search_document),
+    (8, 'ETag用の resource_version テーブル', _create_resource_version),
+    (9, '既存のDMから会話一覧（direct_conversation）を作成', _backfill_direct_conversations),
+    (10, '既存のフレンド関係からタイムライン（user_timeline）を作成', _backfill_timelines),
+    (11, '既存の参加情報からイベントの既読位置（event_read_watermark）を作成', _backfill_read_watermarks),
+]
+
+
+@contextmanager
+def _migration_lock(conn):
+    """MySQLでは名前付きロックで他のプロセスと排他する（それ以外のDBでは何もしない）"""
+    if conn.dialect.name != 'mysql':
+        yield
+        return
+    acquired = conn.execute(
+        text("SELECT GET_LOCK(:name, :timeout)"),
+        {'name': MIGRATION_LOCK_NAME, 'timeout': MIGRATION_LOCK_TIMEOUT}
+    ).scalar()
+    conn.commit()
+    if not acquired:
+        raise RuntimeError("マイグレーションのロックを取得できませんでした")
+    try:
+        yield
+    finally:
+        conn.execute(text("SELECT RELEASE_LOCK(:name)"), {'name': MIGRATION_LOCK_NAME})
+        conn.commit()
+
+
+def _applied_versions(conn):
+    schema_version.create(bind=conn, checkfirst=True)
+    versions = {row[0] for row in conn.execute(select(schema_version.c.version))}
+    conn.commit()
+    return versions
+
+
+def current_version():
+    """
+    適用済みの最新バージョン
+
+    Returns:
+        int: バージョン（まだ何も適用していなければ0）
+    """
+    with db.engine.connect() as conn:
+        if not inspect(conn).has_table('schema_version'):
+            return 0
+        return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def pending_migrations():
+    """
+    未適用のマイグレーションの一覧
+
+    Returns:
+        list: (バージョン, 説明) のリスト
+    """
+    with db.engine.connect() as conn:
+        applied = set()
+        if inspect(conn).has_table('schema_version'):
+            applied = {row[0] for row in conn.execute(select(schema_version.c.version))}
+    return [(version, description) for version, description, _ in MIGRATIONS if version not in applied]
+
+
+def upgrade(target=None):
+    """
+    未適用のマイグレーションを順に適用する（テーブルやデータは削除しない）
+
+    Args:
+        target: このバージョンまで適用する（Noneの場合は最新まで）
+
+    Returns:
+        list: 適用したバージョンのリスト
+    """
+    applied_now = []
+    with db.engine.connect() as conn:
+        with _migration_lock(conn):
+            applied = _applied_versions(conn)
+            for version, description, migrate in MIGRATIONS:
+                if version in applied or (target is not None and version > target):
+                    continue
+                # MySQLのDDLは暗黙にコミットされるため、各関数は再実行できるように書く
+                with conn.begin():
+                    migrate(conn)
+                    conn.execute(schema_version.insert().values(
+                        version=version,
+                        description=description,
+                        applied_at=datetime.now(JST).replace(tzinfo=None)
+                    ))
+                logger.info(f"マイグレーションを適用しました: {version} {description}")
+                applied_now.append(version)
+    return applied_now
@@ -0,0 +1,135 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import or_, union_all
+from sqlalchemy.orm import aliased
+from app.models import db
+
+
+def encode_cursor(timestamp, row_id):
+    """
+    (タイムスタンプ, ID) を不透明なカーソル文字列に変換する
+
+    Args:
+        timestamp: 並び順のキーとなる日時
+        row_id: 同じ日時の行を区別するためのID
+
+    Returns:
+        str: URLセーフなカーソル
+    """
+    payload = json.dumps([timestamp.isoformat() if timestamp else None, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    カーソル文字列を (タイムスタンプ, ID) に戻す
+
+    Returns:
+        tuple: (datetime, str)。タイムスタンプがNULLの行のカーソルは (None, str)。不正なカーソルの場合はNone
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(row_id, str):
+            return None
+        return (datetime.fromisoformat(timestamp) if timestamp is not None else None), row_id
+    except (ValueError, TypeError):
+        return None
+
+
+def apply_keyset(query, timestamp_column, id_column, cursor=None, descending=True):
+    """
+    (タイムスタンプ, ID) のキーセットでページングするクエリを組み立てる
+
+    OFFSETのように読み飛ばす行をスキャンしないため、深いページでも
+    (…, timestamp, id) の複合インデックスで範囲検索だけで済む。
+
+    Args:
+        query: ベースとなるクエリ
+        timestamp_column: 並び順のカラム
+        id_column: タイブレーク用のIDカラム
+        cursor: decode_cursorで得た (timestamp, id)。Noneなら先頭ページ
+        descending: 新しい順に並べる場合はTrue
+
+    Returns:
+        並び順と範囲条件を付けたクエリ
+    """
+    if cursor:
+        timestamp, row_id = cursor
+        # NULLのタイムスタンプはMySQL・SQLiteとも最小の値として並ぶ（新しい順では最後、古い順では最初）
+        if timestamp is None:
+            if descending:
+                query = query.filter(timestamp_column.is_(None), id_column < row_id)
+            else:
+                query = query.filter(or_(timestamp_column.isnot(None), id_column > row_id))
+        elif descending:
+            # 先頭の条件でインデックスの範囲検索にし、同じ時刻の行だけIDで絞り込む
+            query = query.filter(
+                or_(timestamp_column.is_(None), timestamp_column <= timestamp),
+                or_(timestamp_column.is_(None), timestamp_column < timestamp, id_column < row_id)
+            )
+        else:
+            query = query.filter(
+                timestamp_column >= timestamp,
+                or_(timestamp_column > timestamp, id_column > row_id)
+            )
+
+    if descending:
+        return query.order_by(timestamp_column.desc(), id_column.desc())
+    return query.order_by(timestamp_column.asc(), id_column.asc())
+
+
+def next_cursor(rows, limit, timestamp_attr, id_attr='id'):
+    """
+    取得した行から次のページのカーソルを作る（最後のページならNone）
+    """
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(getattr(last, timestamp_attr), getattr(last, id_attr))
+
+
+def keyset_union(model, queries, timestamp_attr, cursor, limit, offset=0, id_attr='id'):
+    """
+    複数の条件のクエリを (タイムスタンプ, ID) の新しい順でまとめて1ページ分取得する
+
+    ORで条件をつなぐと1つのインデックスの範囲検索にならないため、条件ごとにキーセットで
+    並べて件数を絞った範囲検索を UNION ALL でつなぎ、その結果だけを並べ直す。
+
+    Args:
+        model: 取得するモデル
+        queries: 条件ごとのベースとなるクエリ（互いに重複しないこと）
+        timestamp_attr: 並び順のカラムの属性名
+        cursor: decode_cursorで得た (timestamp, id)。Noneなら先頭ページ
+        limit: 取得件数
+        offset: 読み飛ばす件数（カーソルがない場合の従来のページング）
+        id_attr: タイブレーク用のIDの属性名
+
+    Returns:
+        list: モデルのインスタンスのリスト（新しい順）
+    """
+    return keyset_union_query(model, queries, timestamp_attr, cursor, limit, offset, id_attr).all()
+
+
+def keyset_union_query(model, queries, timestamp_attr, cursor, limit, offset=0, id_attr='id'):
+    """
+    keyset_union で実行するクエリを組み立てる（実行計画の確認などで実行せずに使う）
+
+    Returns:
+        Query: 1ページ分を新しい順に返すクエリ
+    """
+    branches = [
+        apply_keyset(query, getattr(model, timestamp_attr), getattr(model, id_attr), cursor)
+        .limit(offset + limit).subquery().select()
+        for query in queries
+    ]
+    merged = aliased(model, union_all(*branches).subquery())
+    query = db.session.query(merged).order_by(
+        getattr(merged, timestamp_attr).desc(), getattr(merged, id_attr).desc()
+    )
+    if offset:
+        query = query.offset(offset)
+    return query.limit(limit)
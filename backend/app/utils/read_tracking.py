@@ -0,0 +1,382 @@
+import logging
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import insert, select, update, delete, func, and_, or_, true
+from sqlalchemy import event as orm_event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from app.models import db
+from app.models.event import UserMemberGroup
+from app.models.message import EventMessage, MessageReadStatus, EventReadWatermark, DirectConversation
+from app.utils.background import enqueue_after_commit
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+
+def get_watermark(user_id, event_id):
+    """
+    イベントのトークの既読位置を取得する
+
+    Returns:
+        EventReadWatermark: まだ何も読んでいない場合はNone
+    """
+    return db.session.get(EventReadWatermark, (user_id, event_id))
+
+
+def _is_after(message, last_read_at, last_read_message_id):
+    """メッセージが既読位置より新しいか（同時刻はIDで比較）"""
+    if last_read_at is None:
+        return True
+    if message.timestamp != last_read_at:
+        return message.timestamp > last_read_at
+    return last_read_message_id is None or message.id > last_read_message_id
+
+
+def _after_position(last_read_at, last_read_message_id):
+    """_is_after と同じ条件（既読位置より新しいメッセージ）のSQL式"""
+    if last_read_at is None:
+        return true()
+    return or_(
+        EventMessage.timestamp > last_read_at,
+        and_(
+            EventMessage.timestamp == last_read_at,
+            true() if last_read_message_id is None else EventMessage.id > last_read_message_id
+        )
+    )
+
+
+def _insert_read_statuses(user_id, message_ids, read_at):
+    """
+    既読ステータスをまとめて追加する（既に存在する組み合わせは無視）
+
+    Returns:
+        list: 新しく既読にしたメッセージID
+    """
+    if not message_ids:
+        return []
+
+    # 既に既読の組み合わせを1回のクエリで取得する
+    existing = {
+        row[0] for row in db.session.query(MessageReadStatus.message_id).filter(
+            MessageReadStatus.user_id == user_id,
+            MessageReadStatus.message_id.in_(message_ids)
+        ).all()
+    }
+    missing = [message_id for message_id in message_ids if message_id not in existing]
+    if not missing:
+        return []
+
+    # 同時に既読にされた場合に備えて、重複は無視する複数行INSERTにする
+    statement = insert(MessageReadStatus.__table__).prefix_with(
+        'IGNORE', dialect='mysql'
+    ).prefix_with(
+        'OR IGNORE', dialect='sqlite'
+    )
+    db.session.execute(statement, [
+        {'message_id': message_id, 'user_id': user_id, 'read_at': read_at}
+        for message_id in missing
+    ])
+    return missing
+
+
+def _advance_watermark(user_id, event_id, watermark, newest):
+    """既読位置を新しいメッセージまで進める（後退はさせない）"""
+    now = datetime.now(JST)
+    if watermark:
+        if not _is_after(newest, watermark.last_read_at, watermark.last_read_message_id):
+            return watermark
+        watermark.last_read_at = newest.timestamp
+        watermark.last_read_message_id = newest.id
+        watermark.updated_at = now
+        return watermark
+
+    watermark = EventReadWatermark(
+        user_id=user_id,
+        event_id=event_id,
+        last_read_at=newest.timestamp,
+        last_read_message_id=newest.id,
+        updated_at=now
+    )
+    try:
+        # 同じユーザーが同時に開いた場合は先に作られた既読位置を進める
+        with db.session.begin_nested():
+            db.session.add(watermark)
+    except IntegrityError:
+        watermark = db.session.get(EventReadWatermark, (user_id, event_id), populate_existing=True)
+        if watermark and _is_after(newest, watermark.last_read_at, watermark.last_read_message_id):
+            watermark.last_read_at = newest.timestamp
+            watermark.last_read_message_id = newest.id
+            watermark.updated_at = now
+    return watermark
+
+
+def mark_event_messages_read(user_id, event_id, messages):
+    """
+    表示したイベントメッセージを既読にする
+
+    表示したメッセージのうち既読位置より新しいものがあれば、既読位置からその最新のメッセージまでの
+    範囲（表示していない間のメッセージも含む）を既読にして既読位置を進める。既に読んだ範囲を
+    表示しただけなら既読位置の取得1回で終わる。新しいメッセージがある場合も、範囲内のメッセージIDの
+    取得1回・既存の既読ステータスの確認1回・複数行INSERT 1回で済む。
+    呼び出し側でコミットすること。
+
+    Args:
+        user_id: 既読にするユーザーのID
+        event_id: イベントID
+        messages: 表示したEventMessageのリスト
+
+    Returns:
+        list: 新しく既読にしたメッセージID
+    """
+    watermark = get_watermark(user_id, event_id)
+    last_read_at = watermark.last_read_at if watermark else None
+    last_read_message_id = watermark.last_read_message_id if watermark else None
+
+    unread = [
+        message for message in messages
+        if message.timestamp and _is_after(message, last_read_at, last_read_message_id)
+    ]
+    if not unread:
+        return []
+
+    # 既読位置は表示した中で最新のメッセージまで進めるため、間のメッセージもすべて既読にする
+    # （自分のメッセージは既読ステータスを付けないが、既読位置は進める）
+    newest = max(unread, key=lambda message: (message.timestamp, message.id))
+    message_ids = [row[0] for row in db.session.query(EventMessage.id).filter(
+        EventMessage.event_id == event_id,
+        _after_position(last_read_at, last_read_message_id),
+        ~_after_position(newest.timestamp, newest.id),
+        or_(EventMessage.sender_user_id.is_(None), EventMessage.sender_user_id != user_id)
+    ).all()]
+    newly_read = _insert_read_statuses(user_id, message_ids, datetime.now(JST))
+
+    _advance_watermark(user_id, event_id, watermark, newest)
+    db.session.flush()
+    _refresh_unread_counts(
+        (EventReadWatermark.user_id == user_id) & (EventReadWatermark.event_id == event_id)
+    )
+    return newly_read
+
+
+def _unread_count_subquery():
+    """既読位置より後の、自分以外のメッセージ数（event_read_watermarkの行ごとに相関する）"""
+    return select(func.count(EventMessage.id)).where(
+        EventMessage.event_id == EventReadWatermark.event_id,
+        or_(
+            EventMessage.sender_user_id.is_(None),
+            EventMessage.sender_user_id != EventReadWatermark.user_id
+        ),
+        or_(
+            EventReadWatermark.last_read_at.is_(None),
+            EventMessage.timestamp > EventReadWatermark.last_read_at,
+            and_(
+                EventMessage.timestamp == EventReadWatermark.last_read_at,
+                EventMessage.id > EventReadWatermark.last_read_message_id
+            )
+        )
+    ).correlate(EventReadWatermark.__table__).scalar_subquery()
+
+
+def _refresh_unread_counts(condition, executor=None):
+    """条件に合う既読位置の未読数をメッセージから数え直す"""
+    executor = executor if executor is not None else db.session
+    executor.execute(
+        update(EventReadWatermark).where(condition).values(unread_count=_unread_count_subquery()),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def increment_event_unread_counts(event_id, message_id, sender_user_id, timestamp):
+    """
+    追加されたメッセージの分だけ、送信者以外の参加者の未読数を加算する（バックグラウンドで実行する）
+
+    既読位置がこのメッセージより前の参加者だけを対象にし、加算は1回のUPDATEで行う。
+    ジョブが実行される前に既読にした参加者は、既読時の数え直しに含まれているため加算しない。
+    """
+    condition = (EventReadWatermark.event_id == event_id) & or_(
+        EventReadWatermark.last_read_at.is_(None),
+        EventReadWatermark.last_read_at < timestamp,
+        and_(
+            EventReadWatermark.last_read_at == timestamp,
+            or_(
+                EventReadWatermark.last_read_message_id.is_(None),
+                EventReadWatermark.last_read_message_id < message_id
+            )
+        )
+    )
+    if sender_user_id:
+        condition = condition & (EventReadWatermark.user_id != sender_user_id)
+    db.session.execute(
+        update(EventReadWatermark).where(condition).values(unread_count=EventReadWatermark.unread_count + 1),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+
+
+@orm_event.listens_for(EventMessage, 'after_insert')
+def _schedule_unread_increment(mapper, connection, target):
+    """
+    メッセージが追加されたら、コミット後に参加者の未読数を加算する
+
+    送信処理のトランザクションはメッセージの追加だけにし、未読数の更新は
+    バックグラウンドで行う。メッセージ数を数え直すのは recompute_unread_counts（修復用）だけにする。
+    """
+    if target.timestamp is None:
+        return
+    enqueue_after_commit(
+        object_session(target), increment_event_unread_counts,
+        target.event_id, target.id, target.sender_user_id, target.timestamp
+    )
+
+
+def start_read_tracking(user_id, event_id):
+    """
+    イベント参加時に既読位置を作成する（参加前のメッセージは未読に数えない）
+
+    呼び出し側でコミットすること。
+    """
+    if get_watermark(user_id, event_id):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(EventReadWatermark(
+                user_id=user_id,
+                event_id=event_id,
+                last_read_at=datetime.now(JST).replace(tzinfo=None),
+                unread_count=0,
+                updated_at=datetime.now(JST)
+            ))
+    except IntegrityError:
+        pass
+
+
+def stop_read_tracking(user_id, event_id):
+    """イベント退出時に既読位置と未読数を削除する（呼び出し側でコミットすること）"""
+    EventReadWatermark.query.filter_by(user_id=user_id, event_id=event_id).delete(synchronize_session=False)
+
+
+def get_unread_badges(user_id):
+    """
+    未読バッジ用の未読数をまとめて取得する
+
+    送信・既読・参加・退出のたびに更新している未読数を読むだけなので、
+    メッセージの件数によらず主キーの範囲検索2回で済む。
+
+    Returns:
+        dict: 合計・DMの相手ごと・イベントごとの未読数
+    """
+    direct_messages = dict(db.session.query(
+        DirectConversation.partner_id, DirectConversation.unread_count
+    ).filter(
+        DirectConversation.user_id == user_id,
+        DirectConversation.unread_count > 0
+    ).all())
+    events = dict(db.session.query(
+        EventReadWatermark.event_id, EventReadWatermark.unread_count
+    ).filter(
+        EventReadWatermark.user_id == user_id,
+        EventReadWatermark.unread_count > 0
+    ).all())
+
+    direct_total = sum(direct_messages.values())
+    event_total = sum(events.values())
+    return {
+        'total': direct_total + event_total,
+        'direct_messages': {'total': direct_total, 'conversations': direct_messages},
+        'events': {'total': event_total, 'events': events}
+    }
+
+
+def _read_positions(user_id=None):
+    """
+    既読ステータスから求めた、ユーザー・イベントごとの既読位置（既読にした最新のメッセージ）
+
+    Returns:
+        Select: (user_id, event_id, last_read_at, last_read_message_id) を返すクエリ
+    """
+    latest = select(
+        MessageReadStatus.user_id,
+        EventMessage.event_id,
+        func.max(EventMessage.timestamp).label('last_read_at')
+    ).join(EventMessage, EventMessage.id == MessageReadStatus.message_id)
+    if user_id:
+        latest = latest.where(MessageReadStatus.user_id == user_id)
+    latest = latest.group_by(MessageReadStatus.user_id, EventMessage.event_id).subquery()
+
+    # 同じ時刻のメッセージが複数ある場合はIDの大きい方を既読位置にする
+    return select(
+        latest.c.user_id,
+        latest.c.event_id,
+        latest.c.last_read_at,
+        func.max(EventMessage.id).label('last_read_message_id')
+    ).join(
+        EventMessage,
+        (EventMessage.event_id == latest.c.event_id) & (EventMessage.timestamp == latest.c.last_read_at)
+    ).group_by(latest.c.user_id, latest.c.event_id, latest.c.last_read_at)
+
+
+def recompute_unread_counts(user_id=None, connection=None):
+    """
+    イベントの既読位置と未読数を参加情報・メッセージから作り直す（修復用、何度実行しても同じ結果になる）
+
+    - 参加していないイベントの既読位置を削除する
+    - 既読位置のない参加イベントは、既読ステータスのある最新のメッセージを既読位置として作成する
+      （既読ステータスがなければ、まだ何も読んでいないものとして作成する）
+    - すべての既読位置の未読数を数え直す
+
+    Args:
+        user_id: 指定した場合はそのユーザーだけ作り直す
+        connection: 使用するコネクション（マイグレーションから呼ぶ場合。省略時はdb.sessionでコミットする）
+
+    Returns:
+        int: 未読数を数え直した既読位置の数
+    """
+    executor = connection if connection is not None else db.session
+
+    membership = select(UserMemberGroup.user_id).where(
+        UserMemberGroup.user_id == EventReadWatermark.user_id,
+        UserMemberGroup.event_id == EventReadWatermark.event_id
+    ).exists()
+    stale = ~membership
+    if user_id:
+        stale = stale & (EventReadWatermark.user_id == user_id)
+    executor.execute(delete(EventReadWatermark).where(stale), execution_options={'synchronize_session': False})
+
+    missing_query = select(UserMemberGroup.user_id, UserMemberGroup.event_id).outerjoin(
+        EventReadWatermark,
+        (EventReadWatermark.user_id == UserMemberGroup.user_id) & (EventReadWatermark.event_id == UserMemberGroup.event_id)
+    ).where(EventReadWatermark.user_id.is_(None))
+    if user_id:
+        missing_query = missing_query.where(UserMemberGroup.user_id == user_id)
+    missing = executor.execute(missing_query).all()
+    if missing:
+        positions = {
+            (row.user_id, row.event_id): row
+            for row in executor.execute(_read_positions(user_id)).all()
+        }
+        now = datetime.now(JST)
+        rows = []
+        for member_user_id, event_id in missing:
+            position = positions.get((member_user_id, event_id))
+            rows.append({
+                'user_id': member_user_id,
+                'event_id': event_id,
+                'last_read_at': position.last_read_at if position else None,
+                'last_read_message_id': position.last_read_message_id if position else None,
+                'unread_count': 0,
+                'updated_at': now
+            })
+        executor.execute(insert(EventReadWatermark), rows)
+
+    condition = EventReadWatermark.user_id == user_id if user_id else true()
+    _refresh_unread_counts(condition, executor=executor)
+
+    count_query = select(func.count()).select_from(EventReadWatermark)
+    if user_id:
+        count_query = count_query.where(EventReadWatermark.user_id == user_id)
+    count = executor.execute(count_query).scalar()
+    if connection is None:
+        db.session.commit()
+    logger.info(f"イベントの未読数を再計算しました: {count}件")
+    return count
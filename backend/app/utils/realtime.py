@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# ルームごとに保持する直近のイベント数（再接続時の再送に使う）
+REALTIME_BACKLOG_SIZE = int(os.getenv('REALTIME_BACKLOG_SIZE', 200))
+# 購読者がいないルームのバックログを保持する時間（秒）。この間に再接続すれば取りこぼしを再送できる
+REALTIME_BACKLOG_TTL = int(os.getenv('REALTIME_BACKLOG_TTL', 300))
+# 購読者1人あたりの未送信イベントの上限（超えたら遅い購読者として切断する）
+REALTIME_SUBSCRIBER_QUEUE_SIZE = int(os.getenv('REALTIME_SUBSCRIBER_QUEUE_SIZE', 500))
+REDIS_CHANNEL_PREFIX = 'tripple:realtime:'
+
+
+def event_room(event_id):
+    """イベントのトークルームのルーム名"""
+    return f"event:{event_id}"
+
+
+def parse_cursor(cursor):
+    """
+    カーソル文字列を (ミリ秒, 連番) に変換する（不正な値はNone）
+    """
+    try:
+        millis, seq = cursor.split('-', 1)
+        return int(millis), int(seq)
+    except (AttributeError, ValueError):
+        return None
+
+
+class Subscription:
+    """1つの接続（SSEストリーム）に対応する購読"""
+
+    def __init__(self, room):
+        self.room = room
+        self.queue = queue.Queue(maxsize=REALTIME_SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def get(self, timeout=None):
+        """次のイベントを取り出す（タイムアウト時はNone）"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class InProcessBackend:
+    """同一プロセス内だけで配信するバックエンド（ワーカーが1つの場合）"""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, room, event):
+        self.broker.dispatch(room, event)
+
+
+class RedisBackend:
+    """
+    Redis Pub/Subで全ワーカーに配信するバックエンド
+
+    各ワーカーは全ルームのチャンネルを購読し、受け取ったイベントを自分の購読者へ配る。
+    """
+
+    def __init__(self, broker, redis_url):
+        import redis
+
+        self.broker = broker
+        self.client = redis.Redis.from_url(redis_url)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.psubscribe(f"{REDIS_CHANNEL_PREFIX}*")
+        self.thread = threading.Thread(target=self._listen, name='realtime-redis', daemon=True)
+        self.thread.start()
+
+    def publish(self, room, event):
+        self.client.publish(f"{REDIS_CHANNEL_PREFIX}{room}", json.dumps(event, ensure_ascii=False))
+
+    def _listen(self):
+        for message in self.pubsub.listen():
+            try:
+                channel = message['channel']
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                room = channel[len(REDIS_CHANNEL_PREFIX):]
+                self.broker.dispatch(room, json.loads(message['data']))
+            except Exception as e:
+                logger.error(f"リアルタイムイベントの受信エラー: {e}")
+
+
+class EventBroker:
+    """
+    ルーム単位でイベントを購読者へ配信するブローカー
+
+    イベントには単調増加するカーソル（"ミリ秒-連番"）を付け、ルームごとに直近の
+    イベントを保持する。再接続したクライアントは最後に受け取ったカーソル以降を
+    受け取り直せる。購読者がいないまま backlog_ttl 秒経ったルームのバックログは削除する。
+    """
+
+    def __init__(self, backlog_size=REALTIME_BACKLOG_SIZE, backlog_ttl=REALTIME_BACKLOG_TTL):
+        self.lock = threading.Lock()
+        self.subscribers = {}  # room -> set[Subscription]
+        self.backlogs = {}  # room -> deque[event]
+        self.last_active = {}  # room -> 最後にイベントを受け取った・購読者が離れた時刻（monotonic）
+        self.backlog_size = backlog_size
+        self.backlog_ttl = backlog_ttl
+        self.evicted_at = time.monotonic()
+        self.last_cursor = (0, 0)
+        self.backend = InProcessBackend(self)
+
+    def configure(self, backend_name=None, redis_url=None):
+        """
+        配信バックエンドを設定する（'memory' または 'redis'）
+        """
+        backend_name = backend_name or os.getenv('REALTIME_BACKEND', 'memory')
+        if backend_name == 'redis':
+            redis_url = redis_url or os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+            try:
+                self.backend = RedisBackend(self, redis_url)
+                logger.info(f"リアルタイム配信にRedisを使用します: {redis_url}")
+                return
+            except Exception as e:
+                logger.error(f"Redisバックエンドの初期化に失敗したため、プロセス内配信を使用します: {e}")
+        self.backend = InProcessBackend(self)
+
+    def _next_cursor(self):
+        with self.lock:
+            millis = int(time.time() * 1000)
+            if millis <= self.last_cursor[0]:
+                self.last_cursor = (self.last_cursor[0], self.last_cursor[1] + 1)
+            else:
+                self.last_cursor = (millis, 0)
+            return f"{self.last_cursor[0]}-{self.last_cursor[1]}"
+
+    def publish(self, room, event_type, data):
+        """
+        ルームにイベントを配信する
+
+        Args:
+            room: ルーム名（例: 'event:<event_id>'）
+            event_type: イベント種別（'message', 'member_joined' など）
+            data: JSONに変換できるデータ
+
+        Returns:
+            str: 付与したカーソル
+        """
+        event = {'cursor': self._next_cursor(), 'type': event_type, 'data': data}
+        try:
+            self.backend.publish(room, event)
+        except Exception as e:
+            logger.error(f"リアルタイムイベントの配信エラー: {e}")
+        return event['cursor']
+
+    def dispatch(self, room, event):
+        """受け取ったイベントをこのプロセスの購読者に配る"""
+        now = time.monotonic()
+        with self.lock:
+            backlog = self.backlogs.setdefault(room, deque(maxlen=self.backlog_size))
+            backlog.append(event)
+            self.last_active[room] = now
+            subscribers = list(self.subscribers.get(room, ()))
+            self._evict_idle(now)
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                # 読み出しが追いつかない接続は切断し、再接続時にカーソルから再送させる
+                subscription.closed = True
+                self.unsubscribe(subscription)
+
+    def _evict_idle(self, now):
+        """購読者がいないまま backlog_ttl 秒経ったルームのバックログを削除する（ロックを取った状態で呼ぶ）"""
+        # ルームの走査は backlog_ttl の間隔で1回だけ行う
+        if now - self.evicted_at < self.backlog_ttl:
+            return
+        self.evicted_at = now
+        idle = [
+            room for room, active_at in self.last_active.items()
+            if room not in self.subscribers and now - active_at >= self.backlog_ttl
+        ]
+        for room in idle:
+            self.backlogs.pop(room, None)
+            del self.last_active[room]
+
+    def subscribe(self, room, cursor=None):
+        """
+        ルームを購読する
+
+        Args:
+            room: ルーム名
+            cursor: 最後に受け取ったイベントのカーソル（再接続時）
+
+        Returns:
+            tuple: (Subscription, 再送するイベントのリスト, バックログで再送しきれたか)
+        """
+        subscription = Subscription(room)
+        parsed = parse_cursor(cursor) if cursor else None
+        with self.lock:
+            self.subscribers.setdefault(room, set()).add(subscription)
+            backlog = list(self.backlogs.get(room, ()))
+
+        if parsed is None:
+            return subscription, [], True
+
+        missed = [event for event in backlog if parse_cursor(event['cursor']) > parsed]
+        # バックログの最古のイベントより前のカーソルなら取りこぼしがある可能性がある
+        complete = bool(backlog) and parse_cursor(backlog[0]['cursor']) <= parsed
+        return subscription, missed, complete
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.room)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.room]
+                    self.last_active[subscription.room] = time.monotonic()
+
+
+broker = EventBroker()
+
+
+def publish_event(event_id, event_type, data):
+    """イベントのトークルームにイベントを配信する"""
+    return broker.publish(event_room(event_id), event_type, data)
+
+
+def format_sse(event):
+    """イベントをServer-Sent Eventsの形式に変換する"""
+    data = json.dumps(event['data'], ensure_ascii=False)
+    return f"id: {event['cursor']}\nevent: {event['type']}\ndata: {data}\n\n"
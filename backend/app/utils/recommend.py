@@ -66,12 +66,9 @@ TFIDF_MAX_FEATURES = 5000 # TF-IDFで考慮する特徴語の最大数 (メモ
 def get_popular_events(limit=5, exclude_event_ids=None):
     if exclude_event_ids is None: exclude_event_ids = set()
     query = Event.query.filter(Event.is_deleted == False, Event.status != 'ended')
-    heart_counts_subquery = db.session.query(
-        UserHeartEvent.event_id, func.count(UserHeartEvent.user_id).label('heart_count')
-    ).group_by(UserHeartEvent.event_id).subquery()
-    query = query.outerjoin(heart_counts_subquery, Event.id == heart_counts_subquery.c.event_id)
+    # いいね数はイベントの件数カラム（utils.counters）を使う
     query = query.order_by(
-        desc(heart_counts_subquery.c.heart_count), desc(Event.current_persons), desc(Event.published_at)
+        desc(Event.hearts_count), desc(Event.current_persons), desc(Event.published_at)
     )
     if exclude_event_ids: query = query.filter(Event.id.notin_(exclude_event_ids))
     return query.limit(limit).all()
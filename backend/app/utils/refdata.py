@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from flask import request, jsonify, current_app
+from sqlalchemy import select, event as orm_event
+from sqlalchemy.orm import Session, object_session
+from app.models import db
+from app.models.area import AreaList
+from app.models.event import TagMaster
+from app.models.character import Character
+
+logger = logging.getLogger(__name__)
+
+# 他のワーカーでの変更を取り込むために読み直す間隔（秒）。このワーカーでの変更はコミット直後に読み直す
+REFDATA_TTL = int(os.getenv('REFDATA_TTL', 300))
+
+
+class RefDataset:
+    """
+    件数が少なくほとんど変わらないテーブル（エリア・タグ・キャラクター）のメモリ上のスナップショット
+
+    行はAPIレスポンスと同じ形の辞書で持つ。内容から計算したETagは、どのワーカーでも内容が同じなら同じ値になる。
+    """
+
+    def __init__(self, name, model, key, to_dict, lookup=None, ttl=REFDATA_TTL):
+        self.name = name
+        self.model = model
+        self.key = key
+        self.to_dict = to_dict
+        self.lookup = lookup  # 主キー以外で引くカラム（タグ名など）
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.items = {}
+        self.keys_by_lookup = {}
+        self.version = 0  # このワーカーで読み込んだ回数
+        self.etag = None
+        self.loaded_at = None
+
+    def load(self):
+        """テーブル全体を読み込む（レプリカの遅延を避けるため、プライマリから直接読む）"""
+        table = self.model.__table__
+        with db.engine.connect() as conn:
+            rows = conn.execute(select(table).order_by(table.c[self.key])).all()
+        items = {row._mapping[self.key]: self.to_dict(row._mapping) for row in rows}
+        keys_by_lookup = {row._mapping[self.lookup]: row._mapping[self.key] for row in rows} if self.lookup else {}
+        digest = hashlib.sha1(
+            json.dumps(list(items.values()), ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+        with self.lock:
+            self.items = items
+            self.keys_by_lookup = keys_by_lookup
+            self.etag = f'{self.name}-{digest[:16]}'
+            self.version += 1
+            self.loaded_at = time.monotonic()
+        return items
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def _snapshot(self):
+        with self.lock:
+            fresh = self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+        if not fresh:
+            self.load()
+        return self.items
+
+    def get(self, key):
+        """
+        1件を取得する
+
+        Returns:
+            dict: 行の辞書のコピー（存在しない場合はNone）
+        """
+        if key is None:
+            return None
+        item = self._snapshot().get(key)
+        return dict(item) if item is not None else None
+
+    def find(self, values):
+        """
+        lookup に指定したカラムの値から主キーを引く
+
+        Returns:
+            dict: 値 -> 主キー（存在しない値は含まない）
+        """
+        self._snapshot()
+        with self.lock:
+            return {value: self.keys_by_lookup[value] for value in values if value in self.keys_by_lookup}
+
+    def all(self):
+        """すべての行の辞書のコピーを主キー順で返す"""
+        return [dict(item) for item in self._snapshot().values()]
+
+    def current_etag(self):
+        self._snapshot()
+        with self.lock:
+            return self.etag
+
+
+def _area_dict(row):
+    return {'id': row['area_id'], 'name': row['area_name']}
+
+
+def _tag_dict(row):
+    return {'id': row['id'], 'tag_name': row['tag_name'], 'category': row['category'], 'is_active': row['is_active']}
+
+
+def _character_dict(row):
+    return {column: row[column] for column in (
+        'id', 'name', 'description', 'personality', 'speech_pattern',
+        'interests', 'traits', 'favorite_trip', 'avatar_url'
+    )}
+
+
+areas = RefDataset('areas', AreaList, 'area_id', _area_dict)
+tags = RefDataset('tags', TagMaster, 'id', _tag_dict, lookup='tag_name')
+characters = RefDataset('characters', Character, 'id', _character_dict)
+
+DATASETS = {dataset.model: dataset for dataset in (areas, tags, characters)}
+
+
+def load_all():
+    """起動時にすべての参照データを読み込む（テーブルがまだない場合は最初の参照時に読み込む）"""
+    for dataset in DATASETS.values():
+        try:
+            dataset.load()
+        except Exception as e:
+            logger.warning(f"参照データ {dataset.name} を読み込めませんでした: {e}")
+
+
+def conditional_json(dataset, build):
+    """
+    参照データのETagを付けてJSONを返す
+
+    If-None-Match が現在のETagと一致する場合は、レスポンスを作らずに304を返す。
+
+    Args:
+        dataset: RefDataset（areas / tags / characters）
+        build: レスポンスの辞書を作る関数
+
+    Returns:
+        Response: 200（ETag付き）または304
+    """
+    etag = dataset.current_etag()
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # キャッシュしてよいが、使う前に必ずETagで確認させる
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def area_name(area_id):
+    """エリアIDからエリア名を引く（存在しない場合はNone）"""
+    area = areas.get(area_id)
+    return area['name'] if area else None
+
+
+def tag_ids_by_name(names):
+    """
+    タグ名からタグIDを引く
+
+    Returns:
+        dict: タグ名 -> タグID（存在しないタグ名は含まない）
+    """
+    names = [name for name in dict.fromkeys(names) if name]
+    found = tags.find(names)
+    if len(found) < len(names):
+        # 他のワーカーで作成されたばかりのタグは、見つからなかったものだけDBから引く
+        missing = [name for name in names if name not in found]
+        rows = db.session.query(TagMaster.tag_name, TagMaster.id).filter(TagMaster.tag_name.in_(missing)).all()
+        if rows:
+            tags.invalidate()
+        found.update(rows)
+    return found
+
+
+# このワーカーで参照データを変更した場合は、コミット後に読み直す（ロールバックされたら何もしない）
+def _mark_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('refdata_changed', set()).add(DATASETS[type(target)].name)
+
+
+for _model in DATASETS:
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        orm_event.listen(_model, _event_name, _mark_changed)
+
+
+@orm_event.listens_for(Session, 'after_commit')
+def _invalidate_changed(session):
+    names = session.info.pop('refdata_changed', None) or ()
+    for dataset in DATASETS.values():
+        if dataset.name in names:
+            dataset.invalidate()
+
+
+@orm_event.listens_for(Session, 'after_soft_rollback')
+def _discard_changed(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop('refdata_changed', None)
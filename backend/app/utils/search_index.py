@@ -0,0 +1,390 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import Counter
+import numpy as np
+from datetime import timedelta
+from sqlalchemy import select, func, event as orm_event, exc
+from sqlalchemy.orm import object_session
+from app.models import db
+from app.models.event import Event, TagMaster, EventTagAssociation
+from app.models.thread import Thread
+from app.models.search import SearchDocument
+from app.utils.background import enqueue, enqueue_after_commit
+from app.utils.recommend import preprocess_text_pipeline
+
+logger = logging.getLogger(__name__)
+
+# 他のワーカーでの更新（search_document の差分）を取り込む間隔（秒）
+SEARCH_INDEX_SYNC_INTERVAL = int(os.getenv('SEARCH_INDEX_SYNC_INTERVAL', 5))
+# 差分を取り込むときに前回の取り込みより遡る時間（秒）。遅れてコミットされた更新やレプリカの遅延を拾う
+SEARCH_INDEX_SYNC_OVERLAP = int(os.getenv('SEARCH_INDEX_SYNC_OVERLAP', 60))
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+DOC_TYPES = ('event', 'thread')
+
+
+class InvertedIndex:
+    """
+    1種類の文書（イベントまたはスレッド）の転置インデックスとBM25による検索
+
+    文書には整数の番号（slot）を振り、文書の長さ・エリア・ステータス・公開日時は番号で引ける配列に持つ。
+    postings: 単語 -> {slot: 出現回数}。検索時は単語ごとにnumpy配列へ変換したもの（更新されるまで使い回す）で
+    まとめてスコアを計算し、10万件規模でも1回の検索を数十ミリ秒以内に収める。
+    """
+
+    def __init__(self, capacity=1024):
+        self.lock = threading.RLock()
+        self.postings = {}
+        self.posting_arrays = {}  # 単語 -> (slotの配列, 出現回数の配列)
+        self.slots = {}  # 文書ID -> slot
+        self.doc_ids = []  # slot -> 文書ID（空きはNone）
+        self.doc_terms = []  # slot -> 含まれる単語（削除時に postings から外すため）
+        self.free_slots = []
+        self.total_length = 0
+        self.codes = {'area': {}, 'status': {}}  # エリアID・ステータス -> 配列に入れる整数
+        self.lengths = np.zeros(capacity, dtype=np.float64)
+        self.areas = np.full(capacity, -1, dtype=np.int32)
+        self.statuses = np.full(capacity, -1, dtype=np.int32)
+        self.published = np.zeros(capacity, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _code(self, kind, value):
+        if value is None:
+            return -1
+        return self.codes[kind].setdefault(value, len(self.codes[kind]))
+
+    def _allocate(self, doc_id):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.doc_ids[slot] = doc_id
+            return slot
+        slot = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.doc_terms.append(())
+        if slot >= len(self.lengths):
+            capacity = len(self.lengths) * 2
+            self.lengths = np.resize(self.lengths, capacity)
+            self.areas = np.resize(self.areas, capacity)
+            self.statuses = np.resize(self.statuses, capacity)
+            self.published = np.resize(self.published, capacity)
+        return slot
+
+    def remove(self, doc_id):
+        with self.lock:
+            slot = self.slots.pop(doc_id, None)
+            if slot is None:
+                return
+            for term in self.doc_terms[slot]:
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(slot, None)
+                    if not posting:
+                        del self.postings[term]
+                self.posting_arrays.pop(term, None)
+            self.total_length -= self.lengths[slot]
+            self.lengths[slot] = 0
+            self.doc_ids[slot] = None
+            self.doc_terms[slot] = ()
+            self.free_slots.append(slot)
+
+    def add(self, doc_id, terms, area_id=None, status=None, published_at=None):
+        """文書を追加する（既にある場合は置き換える）"""
+        term_counts = Counter(terms)
+        with self.lock:
+            self.remove(doc_id)
+            slot = self._allocate(doc_id)
+            self.slots[doc_id] = slot
+            self.doc_terms[slot] = tuple(term_counts)
+            self.lengths[slot] = len(terms)
+            self.areas[slot] = self._code('area', area_id)
+            self.statuses[slot] = self._code('status', status)
+            self.published[slot] = published_at.timestamp() if published_at else 0
+            self.total_length += len(terms)
+            for term, count in term_counts.items():
+                self.postings.setdefault(term, {})[slot] = count
+                self.posting_arrays.pop(term, None)
+
+    def _posting_array(self, term):
+        arrays = self.posting_arrays.get(term)
+        if arrays is None:
+            posting = self.postings[term]
+            arrays = (
+                np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                np.fromiter(posting.values(), dtype=np.float64, count=len(posting)),
+            )
+            self.posting_arrays[term] = arrays
+        return arrays
+
+    def search(self, terms, limit=20, offset=0, area_id=None, status=None):
+        """
+        BM25でスコアを付けて上位の文書を返す（同じスコアは公開日時の新しい順）
+
+        Args:
+            terms: 検索語（分かち書き済み）のリスト
+            limit: 取得件数
+            offset: 読み飛ばす件数
+            area_id: エリアで絞り込む
+            status: ステータスで絞り込む（イベントのみ）
+
+        Returns:
+            tuple: ([(文書ID, スコア)], 条件に一致した文書数)
+        """
+        with self.lock:
+            doc_count = len(self.slots)
+            terms = [term for term in dict.fromkeys(terms) if term in self.postings]
+            if not doc_count or not terms:
+                return [], 0
+            if area_id is not None and area_id not in self.codes['area']:
+                return [], 0
+            if status is not None and status not in self.codes['status']:
+                return [], 0
+            average_length = self.total_length / doc_count or 1
+
+            size = len(self.doc_ids)
+            scores = np.zeros(size, dtype=np.float64)
+            matched = np.zeros(size, dtype=bool)
+            for term in terms:
+                slots, tfs = self._posting_array(term)
+                df = len(slots)
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                norms = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[slots] / average_length)
+                # 1つの単語の中でslotは重複しないので、そのまま足し込める
+                scores[slots] += idf * tfs * (BM25_K1 + 1) / (tfs + norms)
+                matched[slots] = True
+
+            if area_id is not None:
+                matched &= self.areas[:size] == self.codes['area'][area_id]
+            if status is not None:
+                matched &= self.statuses[:size] == self.codes['status'][status]
+            candidates = np.flatnonzero(matched)
+            total = len(candidates)
+
+            top = offset + limit
+            if total > top:
+                candidates = candidates[np.argpartition(-scores[candidates], top - 1)[:top]]
+            order = np.lexsort((-self.published[candidates], -scores[candidates]))
+            ranked = candidates[order][offset:]
+            return [(self.doc_ids[slot], round(float(scores[slot]), 4)) for slot in ranked], total
+
+
+class SearchIndex:
+    """
+    イベントとスレッドの転置インデックス（ワーカーごとにメモリ上に持つ）
+
+    初回の検索で search_document から読み込み、以降は SEARCH_INDEX_SYNC_INTERVAL ごとに
+    updated_at の差分だけを取り込む。updated_at と取り込み済みの位置はどちらもDBの時計で記録し、
+    前回の取り込みから SEARCH_INDEX_SYNC_OVERLAP 秒遡って読み直す（同じ行を何度適用しても結果は変わらない）。
+    """
+
+    def __init__(self, sync_interval=SEARCH_INDEX_SYNC_INTERVAL, overlap=SEARCH_INDEX_SYNC_OVERLAP):
+        self.lock = threading.Lock()
+        self.indexes = {doc_type: InvertedIndex() for doc_type in DOC_TYPES}
+        self.sync_interval = sync_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.synced_at = None  # 最後に取り込んだ時刻（monotonic）
+        self.synced_until = None  # 最後に取り込みを始めたときのDBの時刻
+        self.rebuild_requested = False
+
+    def _apply(self, row):
+        index = self.indexes.get(row.doc_type)
+        if index is None:
+            return
+        if row.is_deleted:
+            index.remove(row.doc_id)
+        else:
+            index.add(row.doc_id, row.terms.split(), row.area_id, row.status, row.published_at)
+
+    def sync(self, force=False):
+        """search_document の更新分をメモリ上のインデックスに取り込む"""
+        now = time.monotonic()
+        with self.lock:
+            if not force and self.synced_at is not None and now - self.synced_at < self.sync_interval:
+                return
+            self.synced_at = now
+            since = self.synced_until
+
+        # アプリケーションサーバーの時計ではなく、updated_at を付けるDBの時計で取り込み位置を記録する
+        started = db.session.scalar(select(func.now()))
+        query = SearchDocument.query
+        if since is not None:
+            # 取り込み後にコミットされた古い時刻の行（長いトランザクション・レプリカの遅延）も拾うため遡って読む
+            query = query.filter(SearchDocument.updated_at >= since - self.overlap)
+        else:
+            query = query.filter(SearchDocument.is_deleted == False)
+
+        count = 0
+        for row in query.yield_per(1000):
+            self._apply(row)
+            count += 1
+        with self.lock:
+            self.synced_until = started
+
+        if since is None:
+            logger.info(f"検索インデックスを読み込みました: {count}件")
+            if count == 0:
+                self._request_rebuild()
+
+    def _request_rebuild(self):
+        # search_document が空の場合（機能追加前のデータ）は、バックグラウンドで一度だけ作り直す
+        with self.lock:
+            if self.rebuild_requested:
+                return
+            self.rebuild_requested = True
+        if Event.query.first() or Thread.query.first():
+            logger.info("search_document が空のため、検索インデックスを作り直します")
+            enqueue(rebuild_search_documents)
+
+    def search(self, doc_type, query_text, limit=20, offset=0, area_id=None, status=None):
+        """
+        キーワードで検索する
+
+        Returns:
+            tuple: ([(文書ID, スコア)], 一致した件数)
+        """
+        self.sync()
+        terms = preprocess_text_pipeline(query_text)
+        return self.indexes[doc_type].search(terms, limit=limit, offset=offset, area_id=area_id, status=status)
+
+    def update(self, row):
+        """このワーカーで更新した文書をすぐに反映する（読み込み前なら何もしない）"""
+        with self.lock:
+            loaded = self.synced_until is not None or self.synced_at is not None
+        if loaded:
+            self._apply(row)
+
+
+search_index = SearchIndex()
+
+
+def _event_text(event):
+    tag_names = [
+        row[0] for row in db.session.query(TagMaster.tag_name).join(
+            EventTagAssociation, TagMaster.id == EventTagAssociation.tag_id
+        ).filter(EventTagAssociation.event_id == event.id).all()
+    ]
+    return [event.title or '', event.description or ''] + tag_names
+
+
+def _build_row(doc_type, doc_id):
+    """
+    検索対象の最新の内容から search_document の値を作る
+
+    Returns:
+        dict: SearchDocument のカラムの値（削除済み・存在しない場合は is_deleted=True）
+    """
+    values = {'doc_type': doc_type, 'doc_id': doc_id, 'terms': '', 'length': 0,
+              'area_id': None, 'status': None, 'published_at': None, 'is_deleted': True}
+    if doc_type == 'event':
+        event = db.session.get(Event, doc_id)
+        if event is None or event.is_deleted:
+            return values
+        terms = preprocess_text_pipeline(_event_text(event))
+        values.update(area_id=event.area_id, status=event.status, published_at=event.published_at)
+    else:
+        thread = db.session.get(Thread, doc_id)
+        if thread is None:
+            return values
+        terms = preprocess_text_pipeline([thread.title or '', thread.message or ''])
+        values.update(area_id=thread.area_id, published_at=thread.published_at)
+    values.update(terms=' '.join(terms), length=len(terms), is_deleted=False)
+    return values
+
+
+def index_document(doc_type, doc_id):
+    """
+    1件の文書を分かち書きし直して search_document に保存する（バックグラウンドで実行する）
+
+    Args:
+        doc_type: 'event' または 'thread'
+        doc_id: イベントIDまたはスレッドID
+    """
+    values = _build_row(doc_type, doc_id)
+    # 差分の取り込み位置と同じDBの時計で記録する
+    values['updated_at'] = func.now()
+
+    row = db.session.get(SearchDocument, (doc_type, doc_id))
+    if row is None:
+        try:
+            with db.session.begin_nested():
+                row = SearchDocument(**values)
+                db.session.add(row)
+        except exc.IntegrityError:
+            # 同じ文書を同時に登録した場合は、登録済みの行を更新する
+            row = db.session.get(SearchDocument, (doc_type, doc_id))
+    for key, value in values.items():
+        setattr(row, key, value)
+    db.session.commit()
+    search_index.update(row)
+
+
+def rebuild_search_documents(batch_size=500):
+    """
+    すべてのイベントとスレッドを分かち書きし直して search_document を作り直す
+
+    Returns:
+        int: 保存した文書数
+    """
+    count = 0
+    for doc_type, model in (('event', Event), ('thread', Thread)):
+        last_id = None
+        while True:
+            query = db.session.query(model.id)
+            if last_id is not None:
+                query = query.filter(model.id > last_id)
+            ids = [row[0] for row in query.order_by(model.id).limit(batch_size).all()]
+            if not ids:
+                break
+            existing = {
+                row.doc_id: row for row in SearchDocument.query.filter(
+                    SearchDocument.doc_type == doc_type, SearchDocument.doc_id.in_(ids)
+                ).all()
+            }
+            for doc_id in ids:
+                values = _build_row(doc_type, doc_id)
+                values['updated_at'] = func.now()
+                row = existing.get(doc_id)
+                if row is None:
+                    db.session.add(SearchDocument(**values))
+                else:
+                    for key, value in values.items():
+                        setattr(row, key, value)
+            db.session.commit()
+            count += len(ids)
+            last_id = ids[-1]
+    search_index.sync(force=True)
+    logger.info(f"検索インデックスを作り直しました: {count}件")
+    return count
+
+
+def _schedule(target, doc_type, doc_id):
+    session = object_session(target)
+    if session is not None and doc_id:
+        enqueue_after_commit(session, index_document, doc_type, doc_id)
+
+
+# イベント・スレッドの作成・編集・削除と、イベントのタグの変更をコミット後に反映する
+@orm_event.listens_for(Event, 'after_insert')
+@orm_event.listens_for(Event, 'after_update')
+@orm_event.listens_for(Event, 'after_delete')
+def _schedule_event(mapper, connection, target):
+    _schedule(target, 'event', target.id)
+
+
+@orm_event.listens_for(Thread, 'after_insert')
+@orm_event.listens_for(Thread, 'after_update')
+@orm_event.listens_for(Thread, 'after_delete')
+def _schedule_thread(mapper, connection, target):
+    _schedule(target, 'thread', target.id)
+
+
+@orm_event.listens_for(EventTagAssociation, 'after_insert')
+@orm_event.listens_for(EventTagAssociation, 'after_delete')
+def _schedule_event_tags(mapper, connection, target):
+    _schedule(target, 'event', target.event_id)
@@ -0,0 +1,211 @@
+from sqlalchemy import func
+from app.models import db
+from app.models.user import User
+from app.models.file import ImageList
+from app.models.event import EventTagAssociation, ThreadTagAssociation
+from app.models.thread import UserHeartThread
+from app.models.message import MessageReadStatus
+from app.utils import refdata
+
+
+def preload(model, ids):
+    """
+    主キーの一覧でまとめて取得し、セッションに載せる
+
+    取得済みの行は多対一のリレーション（message.sender など）を参照したときに
+    セッションから返されるため、行ごとのSELECTが発生しなくなる。
+    セッションは変更のないインスタンスを弱参照でしか保持しないため、リレーションを参照し終わるまで
+    呼び出し側で戻り値を変数に入れておくこと（使わない場合は _ に入れる）。
+
+    Args:
+        model: 取得するモデル
+        ids: 主キーの一覧（Noneは無視する）
+
+    Returns:
+        dict: 主キー -> インスタンス
+    """
+    ids = {row_id for row_id in ids if row_id}
+    if not ids:
+        return {}
+    key = model.__mapper__.primary_key[0]
+    return {getattr(row, key.key): row for row in model.query.filter(key.in_(ids)).all()}
+
+
+def count_reads(message_ids):
+    """
+    メッセージごとの既読数を1回のGROUP BYで数える
+
+    Returns:
+        dict: メッセージID -> 既読数（既読がないメッセージは含まない）
+    """
+    if not message_ids:
+        return {}
+    rows = db.session.query(
+        MessageReadStatus.message_id, func.count()
+    ).filter(
+        MessageReadStatus.message_id.in_(message_ids)
+    ).group_by(MessageReadStatus.message_id).all()
+    return dict(rows)
+
+
+def serialize_event_messages(messages):
+    """
+    イベントメッセージの一覧をAPIレスポンス用の辞書に変換する
+
+    送信者・画像・既読数をそれぞれ1回のクエリでまとめて取得するため、
+    メッセージ数や既読数が増えてもクエリ数は一定になる。
+
+    Args:
+        messages: EventMessageのリスト
+
+    Returns:
+        list: EventMessage.to_dict() と同じ形式の辞書のリスト
+    """
+    if not messages:
+        return []
+
+    _ = (
+        preload(User, [message.sender_user_id for message in messages]),
+        preload(ImageList, [message.image_id for message in messages])
+    )
+    read_counts = count_reads([message.id for message in messages])
+
+    return [message.to_dict(read_count=read_counts.get(message.id, 0)) for message in messages]
+
+
+def load_event_tags(event_ids):
+    """
+    イベントごとのタグを1回のクエリでまとめて取得する
+
+    Returns:
+        dict: イベントID -> [{'id', 'tag_name'}]
+    """
+    tags = {}
+    if not event_ids:
+        return tags
+    rows = db.session.query(EventTagAssociation.event_id, EventTagAssociation.tag_id).filter(
+        EventTagAssociation.event_id.in_(event_ids)
+    ).all()
+    # タグ名はメモリ上の参照データから引く
+    for event_id, tag_id in rows:
+        tag = refdata.tags.get(tag_id)
+        if tag:
+            tags.setdefault(event_id, []).append({'id': tag_id, 'tag_name': tag['tag_name']})
+    return tags
+
+
+def serialize_events(events, with_tags=True):
+    """
+    イベントの一覧をAPIレスポンス用の辞書に変換する
+
+    作成者・画像・タグをそれぞれ1回のクエリでまとめて取得する（エリアは utils.refdata から引く）。
+
+    Args:
+        events: Eventのリスト
+        with_tags: タグ情報（'tags'）を含めるかどうか
+
+    Returns:
+        list: Event.to_dict() の辞書のリスト
+    """
+    if not events:
+        return []
+
+    _ = (
+        preload(User, [event.author_user_id for event in events]),
+        preload(ImageList, [event.image_id for event in events])
+    )
+    tags = load_event_tags([event.id for event in events]) if with_tags else {}
+
+    result = []
+    for event in events:
+        event_data = event.to_dict()
+        if with_tags:
+            event_data['tags'] = tags.get(event.id, [])
+        result.append(event_data)
+    return result
+
+
+def load_thread_tags(thread_ids):
+    """
+    スレッドごとのタグを1回のクエリでまとめて取得する
+
+    Returns:
+        dict: スレッドID -> [{'id', 'name'}]
+    """
+    tags = {}
+    if not thread_ids:
+        return tags
+    rows = db.session.query(ThreadTagAssociation.thread_id, ThreadTagAssociation.tag_id).filter(
+        ThreadTagAssociation.thread_id.in_(thread_ids)
+    ).all()
+    for thread_id, tag_id in rows:
+        tag = refdata.tags.get(tag_id)
+        if tag:
+            tags.setdefault(thread_id, []).append({'id': tag_id, 'name': tag['tag_name']})
+    return tags
+
+
+def serialize_threads(threads, current_user_id=None):
+    """
+    スレッドの一覧をAPIレスポンス用の辞書に変換する
+
+    作成者・画像・タグ・いいね済みかをそれぞれ1回のクエリでまとめて取得する（エリアは utils.refdata から引く）。
+    いいね数・メッセージ数はスレッドの件数のカラムを使う。
+
+    Args:
+        threads: Threadのリスト
+        current_user_id: いいね済みかを判定するユーザーのID（未ログインならNone）
+
+    Returns:
+        list: Thread.to_dict() と同じ形式の辞書のリスト
+    """
+    if not threads:
+        return []
+
+    thread_ids = [thread.id for thread in threads]
+    _ = (
+        preload(User, [thread.author_id for thread in threads]),
+        preload(ImageList, [thread.image_id for thread in threads])
+    )
+    tags = load_thread_tags(thread_ids)
+
+    hearted = set()
+    if current_user_id:
+        hearted = {
+            row[0] for row in db.session.query(UserHeartThread.thread_id).filter(
+                UserHeartThread.user_id == current_user_id,
+                UserHeartThread.thread_id.in_(thread_ids)
+            ).all()
+        }
+
+    return [
+        thread.to_dict(
+            current_user_id=current_user_id,
+            tags=tags.get(thread.id, []),
+            is_hearted=thread.id in hearted
+        )
+        for thread in threads
+    ]
+
+
+def serialize_thread_messages(messages):
+    """
+    スレッドメッセージの一覧をAPIレスポンス用の辞書に変換する
+
+    送信者と画像をそれぞれ1回のクエリでまとめて取得する。
+
+    Args:
+        messages: ThreadMessageのリスト
+
+    Returns:
+        list: ThreadMessage.to_dict() の辞書のリスト
+    """
+    if not messages:
+        return []
+
+    _ = (
+        preload(User, [message.sender_user_id for message in messages]),
+        preload(ImageList, [message.image_id for message in messages if message.message_type == 'image'])
+    )
+
+    return [message.to_dict() for message in messages]
@@ -1,11 +1,24 @@
 import os
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 from flask import current_app
 import logging
 
 logger = logging.getLogger(__name__)
 
+# MinIOの外部公開エンドポイント（未設定時は従来のIPアドレス）
+DEFAULT_MINIO_PUBLIC_ENDPOINT = "http://57.182.254.92:9000"
+# 内容ハッシュやUUIDのキーは上書きされないため、ブラウザ/CDNに長期キャッシュさせる
+IMMUTABLE_CACHE_CONTROL = os.getenv('STORAGE_IMMUTABLE_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+
+# この大きさを超えるファイルはマルチパートでチャンクごとに送信する
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=int(os.getenv('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024)),
+    multipart_chunksize=int(os.getenv('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024)),
+    max_concurrency=int(os.getenv('S3_MAX_CONCURRENCY', 4))
+)
+
 def get_s3_client():
     """
     環境に応じてS3クライアントまたはMinioクライアントを返す
@@ -82,7 +95,122 @@ def ensure_bucket_exists(bucket_name):
             logger.error(f"バケット '{bucket_name}' の確認中にエラーが発生しました: {e}")
             return False
 
-def upload_file(file_data, filename, content_type=None):
+def build_file_url(filename, bucket_name=None):
+    """
+    保存済みオブジェクトの公開URLを生成する
+    
+    Args:
+        filename: オブジェクトのキー
+        bucket_name: バケット名（省略時はMINIO_BUCKET）
+    
+    Returns:
+        str: ファイルのURL
+    """
+    bucket_name = bucket_name or os.getenv('MINIO_BUCKET')
+    
+    # キャッシュするリバースプロキシやCDNを前段に置く場合はそのURLを使う（例: http://localhost/minio）
+    public_base_url = os.getenv('STORAGE_PUBLIC_BASE_URL')
+    if public_base_url:
+        return f"{public_base_url.rstrip('/')}/{bucket_name}/{filename}"
+    
+    endpoint_url = os.getenv('MINIO_ENDPOINT')
+    if endpoint_url:  # Minio
+        public_endpoint = os.getenv('MINIO_PUBLIC_ENDPOINT', DEFAULT_MINIO_PUBLIC_ENDPOINT)
+        return f"{public_endpoint.rstrip('/')}/{bucket_name}/{filename}"
+    # AWS S3
+    return f"https://{bucket_name}.s3.{os.getenv('AWS_REGION', 'ap-northeast-1')}.amazonaws.com/{filename}"
+
+def get_presign_client():
+    """
+    署名付きURL発行用のS3クライアントを返す
+    
+    ブラウザから直接アクセスされるため、コンテナ内部のホスト名（minio:9000）ではなく
+    外部公開されているエンドポイント（MINIO_PUBLIC_ENDPOINT）で署名する。
+    """
+    endpoint_url = os.getenv('MINIO_PUBLIC_ENDPOINT')
+    if not endpoint_url and os.getenv('MINIO_ENDPOINT'):
+        endpoint_url = DEFAULT_MINIO_PUBLIC_ENDPOINT
+    
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint_url,
+        aws_access_key_id=os.getenv('MINIO_ACCESS_KEY'),
+        aws_secret_access_key=os.getenv('MINIO_SECRET_KEY'),
+        region_name=os.getenv('AWS_REGION', 'ap-northeast-1')
+    )
+
+def generate_presigned_upload(filename, content_type, max_size, expires_in=600):
+    """
+    クライアントがS3/Minioへ直接アップロードするための署名付きPOSTを発行する
+    
+    Args:
+        filename: 保存先のキー
+        content_type: アップロードを許可するMIMEタイプ
+        max_size: 許可する最大バイト数
+        expires_in: 署名の有効期限（秒）
+    
+    Returns:
+        成功時: {'url': ..., 'fields': {...}}
+        失敗時: None
+    """
+    bucket_name = os.getenv('MINIO_BUCKET')
+    if not bucket_name:
+        logger.error("MINIO_BUCKET環境変数が設定されていません")
+        return None
+    
+    fields = {
+        'Content-Type': content_type,
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL,
+        'acl': 'public-read'
+    }
+    conditions = [
+        {'Content-Type': content_type},
+        {'Cache-Control': IMMUTABLE_CACHE_CONTROL},
+        {'acl': 'public-read'},
+        ['content-length-range', 1, max_size]
+    ]
+    
+    try:
+        return get_presign_client().generate_presigned_post(
+            bucket_name,
+            filename,
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=expires_in
+        )
+    except ClientError as e:
+        logger.error(f"署名付きアップロードURLの発行エラー: {e}")
+        return None
+
+def get_file_metadata(filename):
+    """
+    S3/Minio上のオブジェクトのサイズとMIMEタイプを取得する
+    
+    Args:
+        filename: オブジェクトのキー
+    
+    Returns:
+        存在する場合: {'size': int, 'content_type': str}
+        存在しない場合: None
+    """
+    bucket_name = os.getenv('MINIO_BUCKET')
+    if not bucket_name:
+        logger.error("MINIO_BUCKET環境変数が設定されていません")
+        return None
+    
+    try:
+        head = get_s3_client().head_object(Bucket=bucket_name, Key=filename)
+        return {
+            'size': head.get('ContentLength', 0),
+            'content_type': head.get('ContentType')
+        }
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code')
+        if error_code not in ('404', 'NoSuchKey'):
+            logger.error(f"S3/Minioのオブジェクト確認エラー: {e}")
+        return None
+
+def upload_file(file_data, filename, content_type=None, cache_control=None):
     """
     ファイルをS3/Minioにアップロードする
     
@@ -90,6 +218,7 @@ def upload_file(file_data, filename, content_type=None):
         file_data: アップロードするファイルデータ
         filename: 保存するファイル名
         content_type: ファイルのMIMEタイプ（オプション）
+        cache_control: Cache-Controlヘッダー（オプション）
     
     Returns:
         成功時: アップロードされたファイルのURL
@@ -110,6 +239,8 @@ def upload_file(file_data, filename, content_type=None):
         extra_args = {}
         if content_type:
             extra_args['ContentType'] = content_type
+        if cache_control:
+            extra_args['CacheControl'] = cache_control
         
         # 公開読み取り権限を追加
         extra_args['ACL'] = 'public-read'
@@ -119,18 +250,12 @@ def upload_file(file_data, filename, content_type=None):
             file_data,
             bucket_name,
             filename,
-            ExtraArgs=extra_args
+            ExtraArgs=extra_args,
+            Config=TRANSFER_CONFIG
         )
         
         # ファイルのURLを生成
-        endpoint_url = os.getenv('MINIO_ENDPOINT')
-        if endpoint_url:  # Minio
-            # 直接MinIOエンドポイントのIPアドレスを使用
-            file_url = f"http://57.182.254.92:9000/{bucket_name}/{filename}"
-        else:  # AWS S3
-            file_url = f"https://{bucket_name}.s3.{os.getenv('AWS_REGION', 'ap-northeast-1')}.amazonaws.com/{filename}"
-        
-        return file_url
+        return build_file_url(filename, bucket_name)
     
     except ClientError as e:
         logger.error(f"S3/Minioへのアップロードエラー: {e}")
@@ -161,4 +286,95 @@ def delete_file(filename):
     
     except ClientError as e:
         logger.error(f"S3/Minioからのファイル削除エラー: {e}")
-        return False 
\ No newline at end of file
+        return False 
+
+def extract_object_key(file_url, bucket_name=None):
+    """
+    build_file_urlで生成したURLからオブジェクトのキーを取り出す
+    
+    Args:
+        file_url: ファイルのURL
+        bucket_name: バケット名（省略時はMINIO_BUCKET）
+    
+    Returns:
+        キー（このバケットのURLでない場合はNone）
+    """
+    if not file_url:
+        return None
+    bucket_name = bucket_name or os.getenv('MINIO_BUCKET')
+    
+    # MinIO/プロキシ形式: <base>/<bucket>/<key>
+    marker = f"/{bucket_name}/"
+    if marker in file_url:
+        return file_url.split(marker, 1)[1]
+    
+    # AWS S3形式: https://<bucket>.s3.<region>.amazonaws.com/<key>
+    host_prefix = f"https://{bucket_name}.s3."
+    if file_url.startswith(host_prefix):
+        return file_url[len(host_prefix):].split('/', 1)[1]
+    return None
+
+def iter_object_pages(prefix=None, page_size=1000):
+    """
+    バケット（MINIO_BUCKET）内のオブジェクトをページ単位で列挙する
+    
+    Args:
+        prefix: 対象とするキーのプレフィックス（オプション）
+        page_size: 1ページあたりの件数（最大1000）
+    
+    Yields:
+        list[dict]: {'key', 'size', 'last_modified'} のリスト
+    """
+    bucket_name = os.getenv('MINIO_BUCKET')
+    if not bucket_name:
+        logger.error("MINIO_BUCKET環境変数が設定されていません")
+        return
+    
+    params = {'Bucket': bucket_name, 'PaginationConfig': {'PageSize': page_size}}
+    if prefix:
+        params['Prefix'] = prefix
+    
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(**params):
+        yield [
+            {
+                'key': obj['Key'],
+                'size': obj.get('Size', 0),
+                'last_modified': obj.get('LastModified')
+            }
+            for obj in page.get('Contents', [])
+        ]
+
+def delete_files(filenames):
+    """
+    S3/Minioから複数のファイルをまとめて削除する（1リクエスト最大1000件）
+    
+    Args:
+        filenames: 削除するファイル名のリスト
+    
+    Returns:
+        tuple: (削除に成功した件数, 失敗したキーのリスト)
+    """
+    bucket_name = os.getenv('MINIO_BUCKET')
+    if not bucket_name:
+        logger.error("MINIO_BUCKET環境変数が設定されていません")
+        return 0, list(filenames)
+    
+    s3_client = get_s3_client()
+    deleted = 0
+    failed = []
+    filenames = list(filenames)
+    for i in range(0, len(filenames), 1000):
+        chunk = filenames[i:i + 1000]
+        try:
+            result = s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True}
+            )
+            errors = result.get('Errors', [])
+            failed.extend(error['Key'] for error in errors)
+            deleted += len(chunk) - len(errors)
+        except ClientError as e:
+            logger.error(f"S3/Minioからの一括削除エラー: {e}")
+            failed.extend(chunk)
+    return deleted, failed
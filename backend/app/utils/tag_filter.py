@@ -0,0 +1,53 @@
+from sqlalchemy import func, distinct
+from app.models import db
+from app.utils import refdata
+
+TAG_MODES = ('and', 'or')
+
+
+def resolve_tag_ids(names):
+    """タグ名の一覧をタグIDの一覧に変換する（存在しないタグ名は無視する）"""
+    return list(refdata.tag_ids_by_name(names).values())
+
+
+def parse_tag_mode(value, default='and'):
+    """
+    クエリパラメータの tag_mode を解釈する
+
+    Returns:
+        str: 'and'（すべてのタグを持つ）または 'or'（いずれかのタグを持つ）
+    """
+    value = (value or default).lower()
+    return value if value in TAG_MODES else default
+
+
+def filter_by_tags(query, association, owner_column, owner_key, tag_ids, mode='and'):
+    """
+    タグで絞り込む条件をクエリに追加する
+
+    中間テーブルをタグIDで絞り、持ち主ごとにGROUP BYした結果とJOINする。
+    'and' の場合は指定したタグをすべて持つもの（HAVING COUNT(DISTINCT tag_id) = タグ数）だけを残す。
+
+    Args:
+        query: 絞り込むクエリ（Thread.query など）
+        association: タグの中間テーブルのモデル（ThreadTagAssociation など）
+        owner_column: 中間テーブルの持ち主を指すカラム（ThreadTagAssociation.thread_id など）
+        owner_key: 絞り込むモデルの主キー（Thread.id など）
+        tag_ids: タグIDのリスト
+        mode: 'and' または 'or'
+
+    Returns:
+        Query: 絞り込んだクエリ
+    """
+    tag_ids = list(dict.fromkeys(tag_ids))
+    if not tag_ids:
+        return query
+
+    matched = db.session.query(owner_column.label('owner_id')).filter(
+        association.tag_id.in_(tag_ids)
+    ).group_by(owner_column)
+    if mode == 'and' and len(tag_ids) > 1:
+        matched = matched.having(func.count(distinct(association.tag_id)) == len(tag_ids))
+    matched = matched.subquery()
+
+    return query.join(matched, matched.c.owner_id == owner_key)
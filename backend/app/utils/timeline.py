@@ -0,0 +1,226 @@
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from sqlalchemy import select, insert, delete, func
+from app.models import db
+from app.models.event import Event, UserTimeline
+from app.models.message import FriendRelationship
+from app.utils.friend_graph import get_adjacency
+
+logger = logging.getLogger(__name__)
+
+# 1人のタイムラインに保持する件数
+TIMELINE_MAX_ENTRIES = int(os.getenv('TIMELINE_MAX_ENTRIES', 200))
+# 保持件数をこれだけ超えたらまとめて削除する（毎回の削除を避けるための余裕）
+TIMELINE_TRIM_SLACK = int(os.getenv('TIMELINE_TRIM_SLACK', 50))
+# フォロワーがこの人数を超える作成者は書き込み時に配らず、読み出し時に取得する
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', 1000))
+# フォロワーの多い作成者一覧のキャッシュ有効期間（秒）
+TIMELINE_POPULAR_AUTHORS_TTL = int(os.getenv('TIMELINE_POPULAR_AUTHORS_TTL', 300))
+
+_popular_authors = {'loaded_at': None, 'ids': frozenset()}
+_popular_authors_lock = threading.Lock()
+
+
+def _insert_ignore(rows, executor=None):
+    """タイムラインの行をまとめて追加する（既にある組み合わせは無視）"""
+    if not rows:
+        return
+    executor = executor if executor is not None else db.session
+    statement = insert(UserTimeline.__table__).prefix_with(
+        'IGNORE', dialect='mysql'
+    ).prefix_with(
+        'OR IGNORE', dialect='sqlite'
+    )
+    executor.execute(statement, rows)
+
+
+def _trim_timelines(user_ids, executor=None):
+    """保持件数を大きく超えたタイムラインを保持件数まで削る"""
+    if not user_ids:
+        return
+    executor = executor if executor is not None else db.session
+    over_limit = executor.execute(
+        select(UserTimeline.user_id).where(
+            UserTimeline.user_id.in_(user_ids)
+        ).group_by(UserTimeline.user_id).having(
+            func.count() > TIMELINE_MAX_ENTRIES + TIMELINE_TRIM_SLACK
+        )
+    ).scalars().all()
+    for user_id in over_limit:
+        cutoff = executor.execute(
+            select(UserTimeline.published_at).where(UserTimeline.user_id == user_id).order_by(
+                UserTimeline.published_at.desc()
+            ).offset(TIMELINE_MAX_ENTRIES - 1).limit(1)
+        ).scalar()
+        if cutoff is not None:
+            executor.execute(
+                delete(UserTimeline).where(
+                    UserTimeline.user_id == user_id,
+                    UserTimeline.published_at < cutoff
+                )
+            )
+
+
+def get_popular_author_ids():
+    """
+    フォロワーが多く、書き込み時に配らない作成者のID（TTL付きでキャッシュ）
+    """
+    now = time.monotonic()
+    with _popular_authors_lock:
+        loaded_at = _popular_authors['loaded_at']
+        if loaded_at is not None and now - loaded_at < TIMELINE_POPULAR_AUTHORS_TTL:
+            return _popular_authors['ids']
+
+    rows = db.session.query(FriendRelationship.friend_id).filter(
+        FriendRelationship.status == 'accepted'
+    ).group_by(FriendRelationship.friend_id).having(func.count() > TIMELINE_FANOUT_LIMIT).all()
+    ids = frozenset(row[0] for row in rows)
+    with _popular_authors_lock:
+        _popular_authors['loaded_at'] = now
+        _popular_authors['ids'] = ids
+    return ids
+
+
+def fan_out_event(event):
+    """
+    作成したイベントをフォロワーのタイムラインに配る（呼び出し側でコミットすること）
+
+    フォロワーが多い作成者の場合は配らず、読み出し時に取得する。
+
+    Args:
+        event: 作成したEvent
+
+    Returns:
+        int: 配ったタイムラインの数
+    """
+    follower_ids = list(get_adjacency(event.author_user_id).followers.keys())
+    if not follower_ids:
+        return 0
+    if len(follower_ids) > TIMELINE_FANOUT_LIMIT:
+        logger.info(f"フォロワーが多いためタイムラインへの配信を省略しました: {event.author_user_id}")
+        return 0
+
+    published_at = (event.published_at or event.timestamp).replace(tzinfo=None)
+    _insert_ignore([
+        {
+            'user_id': follower_id,
+            'event_id': event.id,
+            'author_user_id': event.author_user_id,
+            'published_at': published_at
+        }
+        for follower_id in follower_ids
+    ])
+    _trim_timelines(follower_ids)
+    return len(follower_ids)
+
+
+def backfill_timeline(user_id, author_ids, limit=TIMELINE_MAX_ENTRIES, executor=None):
+    """
+    フォローした作成者の最近のイベントをタイムラインに追加する（呼び出し側でコミットすること）
+
+    Args:
+        user_id: タイムラインの持ち主
+        author_ids: 追加する作成者のIDの一覧
+        limit: 追加する最大件数
+        executor: 実行に使うセッションまたはコネクション（省略時はdb.session）
+
+    Returns:
+        int: 追加対象にしたイベントの数
+    """
+    author_ids = list(author_ids)
+    if not author_ids:
+        return 0
+    executor = executor if executor is not None else db.session
+    rows = executor.execute(
+        select(Event.id, Event.author_user_id, Event.published_at).where(
+            Event.author_user_id.in_(author_ids),
+            Event.is_deleted == False,
+            Event.published_at.isnot(None)
+        ).order_by(Event.published_at.desc()).limit(limit)
+    ).all()
+    _insert_ignore([
+        {'user_id': user_id, 'event_id': event_id, 'author_user_id': author_id, 'published_at': published_at}
+        for event_id, author_id, published_at in rows
+    ], executor=executor)
+    _trim_timelines([user_id], executor=executor)
+    return len(rows)
+
+
+def backfill_all_timelines(connection=None):
+    """
+    承認済みのフレンド関係から全ユーザーのタイムラインを作る
+
+    既にある行は無視するので、何度実行しても同じ結果になる。
+
+    Args:
+        connection: 使用するコネクション（マイグレーションから呼ぶ場合。省略時はdb.sessionでコミットする）
+
+    Returns:
+        int: タイムラインを作成したユーザー数
+    """
+    executor = connection if connection is not None else db.session
+    following = defaultdict(list)
+    for user_id, author_id in executor.execute(
+        select(FriendRelationship.user_id, FriendRelationship.friend_id).where(
+            FriendRelationship.status == 'accepted'
+        )
+    ):
+        following[user_id].append(author_id)
+
+    for user_id, author_ids in following.items():
+        backfill_timeline(user_id, author_ids, executor=executor)
+
+    if connection is None:
+        db.session.commit()
+    logger.info(f"タイムラインを作成しました: {len(following)}人")
+    return len(following)
+
+
+def get_timeline_events(user_id, limit=10):
+    """
+    フレンド（フォロー中のユーザー）のイベントを新しい順に取得する
+
+    タイムラインの範囲検索1回と、イベントのまとめ取得1回で済む。フォロワーの多い
+    作成者のイベントだけは読み出し時に作成者で絞って取得し、タイムラインとマージする。
+
+    Args:
+        user_id: 閲覧するユーザーのID
+        limit: 取得件数
+
+    Returns:
+        list: Eventのリスト（新しい順）
+    """
+    following = get_adjacency(user_id).following
+    if not following:
+        return []
+
+    entries = db.session.query(UserTimeline.event_id, UserTimeline.author_user_id).filter(
+        UserTimeline.user_id == user_id
+    ).order_by(UserTimeline.published_at.desc()).limit(limit * 2).all()
+
+    # フォロー解除した作成者のエントリは除く
+    event_ids = [event_id for event_id, author_id in entries if author_id in following]
+
+    events = []
+    if event_ids:
+        events = Event.query.filter(
+            Event.id.in_(event_ids),
+            Event.is_deleted == False
+        ).all()
+
+    popular = [author_id for author_id in following if author_id in get_popular_author_ids()]
+    if popular:
+        events += Event.query.filter(
+            Event.author_user_id.in_(popular),
+            Event.is_deleted == False
+        ).order_by(Event.published_at.desc()).limit(limit).all()
+
+    unique = {event.id: event for event in events}
+    return sorted(
+        unique.values(),
+        key=lambda event: (event.published_at is not None, event.published_at),
+        reverse=True
+    )[:limit]
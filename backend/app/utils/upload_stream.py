@@ -0,0 +1,80 @@
+import os
+import tempfile
+from flask import Request
+
+# リクエスト全体の最大サイズ（これを超えると413を返す）
+MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', 20 * 1024 * 1024))  # 20MB
+# このサイズまではメモリ上に保持し、超えた分はディスクの一時ファイルへ退避する
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', 1024 * 1024))  # 1MB
+
+
+class SpooledUploadRequest(Request):
+    """
+    アップロードされたファイルをSpooledTemporaryFileで受け取るリクエストクラス
+
+    小さいファイルはメモリ上、大きいファイルはディスク上に置かれるため、
+    同時に大きなアップロードが来てもワーカーのメモリが膨らまない。
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD, mode='rb+')
+
+
+class _UnclosableStream:
+    """
+    close() しても元のバッファを閉じないラッパー
+
+    boto3 の upload_fileobj（s3transfer）はアップロード後に渡したファイルを閉じるため、
+    そのままではアップロード後に同じバッファを画像のデコードに使えない。
+    元のバッファはリクエストの終了時に werkzeug が閉じる。
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def get_upload_stream(file):
+    """
+    アップロードファイルのバッファを先頭に戻して返す
+
+    ストレージへのアップロードと画像のデコードで同じバッファを使い回すためのもの。
+    データのコピーは作らない。アップロード先が閉じても元のバッファは閉じない。
+
+    Args:
+        file: werkzeugのFileStorage
+
+    Returns:
+        先頭にシークされたファイルオブジェクト
+    """
+    stream = file.stream
+    stream.seek(0)
+    return _UnclosableStream(stream)
+
+
+def get_upload_size(file):
+    """
+    アップロードファイルのサイズをバイト数で返す（読み込みは行わない）
+
+    Args:
+        file: werkzeugのFileStorage
+
+    Returns:
+        int: ファイルサイズ
+    """
+    stream = file.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
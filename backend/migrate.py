@@ -1,61 +1,62 @@
+import os
+import argparse
+from sqlalchemy import text
 from app import create_app
 from app.models import db
-# from app.models.user import User
-# from app.models.area import AreaList
-# from app.models.file import ImageList
-# from app.models.thread import Thread, ThreadMessage, ThreadComment, ThreadFavor, UserHeartThread
-# from app.models.event import Event, UserMemberGroup, UserHeartEvent, TagMaster, UserTagAssociation, EventTagAssociation, ThreadTagAssociation
-# from app.models.message import EventMessage, MessageReadStatus, FriendRelationship, DirectMessage
+from app.utils.migrations import MIGRATIONS, current_version, pending_migrations, upgrade
 
+# 使い方:
+#   python migrate.py              # 未適用のマイグレーションを適用する（既存のデータは消さない）
+#   python migrate.py --status     # 適用済みのバージョンと未適用のマイグレーションを表示する
+#   python migrate.py --target 3   # バージョン3まで適用する
+#   python migrate.py --reset --yes  # 開発環境用: すべてのテーブルを削除してから作り直す
+
+parser = argparse.ArgumentParser(description="データベースのマイグレーションを適用します")
+parser.add_argument("--status", action="store_true", help="適用状況を表示するだけで変更しない")
+parser.add_argument("--target", type=int, help="このバージョンまで適用する")
+parser.add_argument("--reset", action="store_true", help="すべてのテーブルを削除してから作り直す（データは失われます）")
+parser.add_argument("--yes", action="store_true", help="--reset の確認を省略する")
+args = parser.parse_args()
+
+# create_app() の中では適用せず、このスクリプトの指定に従って適用する
+os.environ['AUTO_MIGRATE'] = 'false'
 app = create_app()
 with app.app_context():
-    # アプリケーションの状態にデータがある場合、バックアップは推奨されます
-    # 既存のテーブルが存在する場合はカラムを追加するなどの方法もあります
+    if args.status:
+        print(f"現在のバージョン: {current_version()} / 最新: {MIGRATIONS[-1][0]}")
+        for version, description in pending_migrations():
+            print(f"  未適用: {version} {description}")
+        raise SystemExit(0)
 
-    # 以下は開発環境での使用を想定しています - 本番環境では注意が必要です
-    # まず既存のテーブルを削除
-    try:
-        db.session.execute('SET FOREIGN_KEY_CHECKS=0;')
-        
-        # メッセージ関連テーブル
-        db.session.execute('DROP TABLE IF EXISTS message_read_status;')
-        db.session.execute('DROP TABLE IF EXISTS direct_message;')
-        db.session.execute('DROP TABLE IF EXISTS event_message;')
-        
-        # スレッド関連テーブル
-        db.session.execute('DROP TABLE IF EXISTS thread_comment;')
-        db.session.execute('DROP TABLE IF EXISTS thread_message;')
-        db.session.execute('DROP TABLE IF EXISTS thread_favor;')
-        db.session.execute('DROP TABLE IF EXISTS user_heart_thread;')
-        
-        # イベント関連テーブル
-        db.session.execute('DROP TABLE IF EXISTS tag_association;')
-        db.session.execute('DROP TABLE IF EXISTS tag_master;')
-        db.session.execute('DROP TABLE IF EXISTS user_heart_event;')
-        db.session.execute('DROP TABLE IF EXISTS user_member_group;')
-        db.session.execute('DROP TABLE IF EXISTS event;')
-        
-        # 友達関係テーブル
-        db.session.execute('DROP TABLE IF EXISTS friend_relationship;')
-        
-        # その他メインテーブル
-        db.session.execute('DROP TABLE IF EXISTS thread;')
-        db.session.execute('DROP TABLE IF EXISTS image_list;')
-        db.session.execute('DROP TABLE IF EXISTS area_list;')
-        db.session.execute('DROP TABLE IF EXISTS user;')
-        
-        db.session.execute('SET FOREIGN_KEY_CHECKS=1;')
-        db.session.commit()
-        print("既存のテーブルを削除しました")
-    except Exception as e:
-        db.session.rollback()
-        print(f"テーブル削除中にエラーが発生しました: {e}")
+    if args.reset:
+        # 以下は開発環境での使用を想定しています - 本番環境では実行しないでください
+        if not args.yes:
+            answer = input("すべてのテーブルを削除します。よろしいですか？ [y/N]: ")
+            if answer.strip().lower() != 'y':
+                print("中止しました")
+                raise SystemExit(1)
+        try:
+            if db.engine.dialect.name == 'mysql':
+                db.session.execute(text('SET FOREIGN_KEY_CHECKS=0;'))
+            db.drop_all()
+            db.session.execute(text('DROP TABLE IF EXISTS schema_version;'))
+            if db.engine.dialect.name == 'mysql':
+                db.session.execute(text('SET FOREIGN_KEY_CHECKS=1;'))
+            db.session.commit()
+            print("既存のテーブルを削除しました")
+        except Exception as e:
+            db.session.rollback()
+            print(f"テーブル削除中にエラーが発生しました: {e}")
+            raise SystemExit(1)
 
-    # テーブルを新しく作成
     try:
-        db.create_all()
-        db.session.commit()
-        print("データベーステーブルが再作成されました")
+        applied = upgrade(target=args.target)
     except Exception as e:
-        db.session.rollback()
-        print(f"テーブル作成中にエラーが発生しました: {e}") 
\ No newline at end of file
+        print(f"マイグレーション中にエラーが発生しました: {e}")
+        raise SystemExit(1)
+
+    if applied:
+        print(f"マイグレーションを適用しました: {', '.join(str(version) for version in applied)}")
+    else:
+        print("適用するマイグレーションはありません")
+    print(f"現在のバージョン: {current_version()}")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# backend/ をインポートパスに追加する（どのディレクトリから pytest を実行しても app を読み込めるように）
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
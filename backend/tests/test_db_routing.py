@@ -0,0 +1,123 @@
+"""
+RoutingSession の振り分けのテスト
+
+プライマリとレプリカに別々のSQLiteファイルを使い、同じIDの行に異なる値を入れておくことで、
+どちらから読んだかを返ってきた値で確かめる。
+"""
+import pytest
+from flask import Flask, jsonify
+from flask_sqlalchemy import SQLAlchemy
+from app.utils.db_routing import RoutingSession, replica_binds, use_primary, use_replica
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+class Item(db.Model):
+    __tablename__ = 'item'
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(20), nullable=False)
+
+
+def _source():
+    return db.session.get(Item, 1).source
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    app.config['SQLALCHEMY_BINDS'] = replica_binds([f"sqlite:///{tmp_path / 'replica.db'}"])
+    db.init_app(app)
+
+    with app.app_context():
+        # 同じ行をそれぞれのDBに作り、読んだ先が分かるようにする
+        for key, source in ((None, 'primary'), ('replica_0', 'replica')):
+            engine = db.engines[key]
+            Item.__table__.create(bind=engine)
+            with engine.begin() as conn:
+                conn.execute(Item.__table__.insert(), {'id': 1, 'source': source})
+
+    @app.route('/read', methods=['GET', 'POST'])
+    def read():
+        return jsonify(source=_source())
+
+    @app.route('/write-then-read', methods=['GET'])
+    def write_then_read():
+        db.session.add(Item(id=2, source='primary'))
+        db.session.flush()
+        return jsonify(source=_source(), written=db.session.get(Item, 2) is not None)
+
+    @app.route('/commit-then-read', methods=['GET'])
+    def commit_then_read():
+        db.session.add(Item(id=2, source='primary'))
+        db.session.commit()
+        return jsonify(source=_source())
+
+    @app.route('/primary', methods=['GET'])
+    @use_primary
+    def primary():
+        return jsonify(source=_source())
+
+    @app.route('/replica', methods=['POST'])
+    @use_replica
+    def replica():
+        return jsonify(source=_source())
+
+    return app
+
+
+def test_get_reads_from_replica(app):
+    assert app.test_client().get('/read').json['source'] == 'replica'
+
+
+def test_post_reads_from_primary(app):
+    assert app.test_client().post('/read').json['source'] == 'primary'
+
+
+def test_reads_after_write_use_primary(app):
+    response = app.test_client().get('/write-then-read').json
+    assert response == {'source': 'primary', 'written': True}
+
+
+def test_reads_after_commit_use_primary(app):
+    assert app.test_client().get('/commit-then-read').json['source'] == 'primary'
+
+
+def test_next_request_reads_from_replica_again(app):
+    client = app.test_client()
+    client.get('/commit-then-read')
+    assert client.get('/read').json['source'] == 'replica'
+
+
+def test_use_primary_overrides_get(app):
+    assert app.test_client().get('/primary').json['source'] == 'primary'
+
+
+def test_use_replica_overrides_post(app):
+    assert app.test_client().post('/replica').json['source'] == 'replica'
+
+
+def test_outside_request_uses_primary(app):
+    with app.app_context():
+        assert _source() == 'primary'
+
+
+def test_select_for_update_uses_primary(app):
+    with app.test_request_context('/read', method='GET'):
+        item = db.session.execute(db.select(Item).where(Item.id == 1).with_for_update()).scalar_one()
+        assert item.source == 'primary'
+        # 一度プライマリを使った後の読み取りもプライマリに送る
+        assert db.session.execute(db.select(Item.source).where(Item.id == 1)).scalar() == 'primary'
+
+
+def test_without_replicas_everything_uses_primary(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'only.db'}"
+    db.init_app(app)
+    with app.app_context():
+        Item.__table__.create(bind=db.engine)
+        db.session.add(Item(id=1, source='primary'))
+        db.session.commit()
+    with app.test_request_context('/read', method='GET'):
+        assert _source() == 'primary'
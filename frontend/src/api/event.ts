@@ -161,6 +161,34 @@ export const sendEventMessage = async (eventId: string, data: {
   }
 };
 
+// イベントのトークルームのリアルタイム購読（Server-Sent Events）
+export type EventStreamType = 'message' | 'member_joined' | 'member_left' | 'status_changed';
+
+export const subscribeEventStream = (
+  eventId: string,
+  onEvent: (type: EventStreamType, data: any, cursor: string) => void,
+  cursor?: string
+): (() => void) => {
+  const baseURL = import.meta.env.VITE_API_URL || 'http://localhost:5000/api/';
+  const params = new URLSearchParams();
+  const token = localStorage.getItem('token');
+  if (token) params.append('token', token);
+  // 再接続時はブラウザがLast-Event-IDを送るが、初回は保存済みのカーソルから再開する
+  if (cursor) params.append('cursor', cursor);
+
+  const source = new EventSource(`${baseURL}message/event/${eventId}/stream?${params.toString()}`);
+  const types: EventStreamType[] = ['message', 'member_joined', 'member_left', 'status_changed'];
+  types.forEach((type) => {
+    source.addEventListener(type, (e) => {
+      const event = e as MessageEvent;
+      onEvent(type, JSON.parse(event.data), event.lastEventId);
+    });
+  });
+
+  // 購読解除用の関数を返す
+  return () => source.close();
+};
+
 // イベントメンバー取得
 export const getEventMembers = async (eventId: string) => {
   try {
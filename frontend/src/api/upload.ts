@@ -87,3 +87,54 @@ const uploadAgeVerificationImageImpl = async (
 }
 
 export { uploadAgeVerificationImageImpl as uploadAgeVerificationImage }
+
+// 署名付きPOSTによる直接アップロードAPI（Flaskを経由せずMinIO/S3へ送信）
+export type PresignedUploadResponse = {
+  key: string;
+  url: string;
+  fields: Record<string, string>;
+  max_size: number;
+  expires_in: number;
+}
+
+export type ConfirmUploadResponse = {
+  message: string;
+  image_id: string;
+  image: {
+    id: string;
+    url: string;
+  };
+}
+
+export const uploadImageDirect = async (
+  file: File,
+  entity?: { entity_type?: string; entity_id?: string }
+): Promise<ConfirmUploadResponse> => {
+  // 1. 署名付きPOSTを発行
+  const presigned = await axios.post<PresignedUploadResponse>('upload/presign', {
+    content_type: file.type,
+    size: file.size
+  })
+
+  // 2. ストレージへ直接アップロード（認証ヘッダーは送らない）
+  const formData = new FormData()
+  Object.entries(presigned.data.fields).forEach(([key, value]) => {
+    formData.append(key, value)
+  })
+  formData.append('file', file)
+
+  const uploadRes = await fetch(presigned.data.url, {
+    method: 'POST',
+    body: formData
+  })
+  if (!uploadRes.ok) {
+    throw new Error(`ストレージへのアップロードに失敗しました: ${uploadRes.status}`)
+  }
+
+  // 3. アップロード完了を通知してImageListに登録
+  const res = await axios.post<ConfirmUploadResponse>('upload/confirm', {
+    key: presigned.data.key,
+    ...entity
+  })
+  return res.data
+}
@@ -0,0 +1,114 @@
+import sys, os
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.models import db
+from app.models.user import User
+from app.models.event import Event
+from app.models.message import EventMessage
+from app.utils.pagination import apply_keyset, next_cursor, decode_cursor
+
+# 使い方:
+#   docker compose exec backend python scripts/bench_pagination.py --messages 100000 --page-size 50
+#
+# ベンチマーク用のイベントにメッセージを投入し、OFFSETとカーソルでそれぞれ
+# 深さごとのページ取得時間を比較する（投入したデータは最後に削除する）
+
+JST = timezone(timedelta(hours=9))
+
+parser = argparse.ArgumentParser(description="OFFSETとキーセット（カーソル）ページングの取得時間を比較します")
+parser.add_argument("--messages", type=int, default=20000, help="投入するメッセージ数")
+parser.add_argument("--page-size", type=int, default=50, help="1ページの件数")
+parser.add_argument("--repeat", type=int, default=5, help="各深さで計測する回数")
+parser.add_argument("--keep", action="store_true", help="投入したデータを削除しない")
+args = parser.parse_args()
+
+app = create_app()
+
+
+def seed(event_id, user_id):
+    base = datetime.now(JST) - timedelta(seconds=args.messages)
+    rows = []
+    for i in range(args.messages):
+        rows.append({
+            'id': str(uuid.uuid4()),
+            'event_id': event_id,
+            'sender_user_id': user_id,
+            'content': f"benchmark message {i}",
+            'message_type': 'text',
+            # 同じ時刻のメッセージも混ぜてタイブレークを確認する
+            'timestamp': (base + timedelta(seconds=i // 3)).replace(tzinfo=None)
+        })
+        if len(rows) >= 5000:
+            db.session.execute(EventMessage.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(EventMessage.__table__.insert(), rows)
+    db.session.commit()
+
+
+def timed(fn):
+    samples = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return round(samples[len(samples) // 2], 2)
+
+
+with app.app_context():
+    user = User.query.first()
+    if not user:
+        print("❌ ユーザーが存在しません。先に seed.py を実行してください")
+        sys.exit(1)
+
+    event = Event(
+        id=str(uuid.uuid4()),
+        title="pagination benchmark",
+        description="pagination benchmark",
+        author_user_id=user.id,
+        status='ended'
+    )
+    db.session.add(event)
+    db.session.commit()
+    event_id, user_id = event.id, user.id
+    seed(event_id, user_id)
+
+    base_query = lambda: EventMessage.query.filter_by(event_id=event_id)
+    depths = [d for d in (0, 10, 100, 1000, 5000, 10000, 50000) if d * args.page_size < args.messages]
+
+    # 各深さのカーソルを事前に求めておく（計測対象は1ページ分の取得のみ）
+    cursors = {}
+    cursor = None
+    page = 0
+    while page <= max(depths):
+        if page in depths:
+            cursors[page] = cursor
+        rows = apply_keyset(base_query(), EventMessage.timestamp, EventMessage.id, cursor).limit(args.page_size).all()
+        cursor = decode_cursor(next_cursor(rows, args.page_size, 'timestamp'))
+        db.session.expunge_all()
+        page += 1
+
+    results = []
+    for depth in depths:
+        offset_ms = timed(lambda: apply_keyset(base_query(), EventMessage.timestamp, EventMessage.id)
+                          .offset(depth * args.page_size).limit(args.page_size).all())
+        cursor_ms = timed(lambda: apply_keyset(base_query(), EventMessage.timestamp, EventMessage.id, cursors[depth])
+                          .limit(args.page_size).all())
+        db.session.expunge_all()
+        results.append({'page': depth, 'offset_ms': offset_ms, 'cursor_ms': cursor_ms})
+
+    print(f"📊 {args.messages}件 / 1ページ{args.page_size}件（中央値）")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    if not args.keep:
+        EventMessage.query.filter_by(event_id=event_id).delete(synchronize_session=False)
+        Event.query.filter_by(id=event_id).delete(synchronize_session=False)
+        db.session.commit()
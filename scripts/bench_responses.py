@@ -0,0 +1,85 @@
+import sys, os
+import argparse
+import json
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.utils.json_provider import _default
+from app.utils.compression import available_encodings, compress
+from app.utils.jwt import generate_token
+
+# 使い方:
+#   docker compose exec backend python scripts/bench_responses.py
+#   docker compose exec backend python scripts/bench_responses.py --user-id <ユーザーID> --url /api/event/<イベントID>
+#
+# 主要なGETのエンドポイントを実際に呼び出し、レスポンスごとに
+#   - JSONのバイト数（従来のjsonify / 現在の変換 / gzip / brotli）
+#   - JSONへの変換にかかるCPU時間（従来のjsonify相当の json.dumps / 現在の app.json）
+#   - 圧縮にかかるCPU時間
+# を表示する。データは現在のDBのものを使う（件数が多いほど差が分かりやすい）。
+
+parser = argparse.ArgumentParser(description="エンドポイントごとのレスポンスサイズとJSON変換・圧縮のCPU時間を計測します")
+parser.add_argument("--url", action="append", default=[], help="追加で計測するURL（複数指定可）")
+parser.add_argument("--user-id", help="認証が必要なエンドポイントを呼ぶユーザーのID")
+parser.add_argument("--repeat", type=int, default=50, help="変換・圧縮を計測する回数")
+args = parser.parse_args()
+
+DEFAULT_URLS = [
+    '/api/event/events?per_page=50',
+    '/api/event/popular?limit=50',
+    '/api/thread/threads?per_page=50',
+    '/api/area/list',
+    '/api/tag/list',
+    '/api/character/characters',
+]
+
+
+def legacy_dumps(obj):
+    # 変更前の jsonify と同じ設定（日本語を \uXXXX にエスケープし、キーをソートする）
+    return json.dumps(obj, default=_default, ensure_ascii=True, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def cpu_ms(fn, *fn_args):
+    started = time.process_time()
+    for _ in range(args.repeat):
+        result = fn(*fn_args)
+    return (time.process_time() - started) * 1000 / args.repeat, result
+
+
+app = create_app()
+client = app.test_client()
+headers = {}
+if args.user_id:
+    headers['Authorization'] = f"Bearer {generate_token(args.user_id)}"
+
+print(f"JSON変換: {'orjson' if app.json.use_orjson else '標準のjson'} / 圧縮: {', '.join(available_encodings())}")
+print(f"{'URL':45} {'従来':>9} {'現在':>9} {'gzip':>9} {'br':>9} {'変換(従来)':>10} {'変換(現在)':>10} {'圧縮':>8}")
+
+for url in DEFAULT_URLS + args.url:
+    response = client.get(url, headers={**headers, 'Accept-Encoding': 'identity'})
+    if response.status_code != 200 or not response.is_json:
+        print(f"{url:45} ⚠️ ステータス {response.status_code}")
+        continue
+    payload = response.get_json()
+
+    legacy_ms, legacy_body = cpu_ms(legacy_dumps, payload)
+    current_ms, body = cpu_ms(app.json.dumps_bytes, payload)
+
+    sizes = {}
+    compress_ms = {}
+    for encoding in ('gzip', 'br'):
+        if encoding in available_encodings():
+            compress_ms[encoding], compressed = cpu_ms(compress, body, encoding)
+            sizes[encoding] = f"{len(compressed):,}"
+        else:
+            sizes[encoding] = '-'
+    compress_label = '/'.join(f"{ms:.2f}" for ms in compress_ms.values())
+
+    print(
+        f"{url:45} {len(legacy_body):>9,} {len(body):>9,} {sizes['gzip']:>9} {sizes['br']:>9} "
+        f"{legacy_ms:>9.2f}ms {current_ms:>9.2f}ms {compress_label:>7}ms"
+    )
+
+print("✅ 計測が完了しました（バイト数は転送されるボディの大きさ、時間は1回あたりのCPU時間）")
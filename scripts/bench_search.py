@@ -0,0 +1,69 @@
+import sys, os
+import argparse
+import itertools
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.search_index import InvertedIndex
+
+# 使い方:
+#   docker compose exec backend python scripts/bench_search.py --documents 100000
+#
+# 合成した文書で転置インデックスを作り、BM25検索の応答時間を計測する（DBは使わない）。
+# 単語の出現頻度はZipf分布に近づけ、よく出る単語・まれな単語・複数語の検索をそれぞれ測る。
+
+parser = argparse.ArgumentParser(description="全文検索（BM25）の応答時間を計測します")
+parser.add_argument("--documents", type=int, default=100000, help="文書数")
+parser.add_argument("--vocabulary", type=int, default=20000, help="語彙数")
+parser.add_argument("--length", type=int, default=40, help="1文書あたりの単語数")
+parser.add_argument("--repeat", type=int, default=50, help="各検索を計測する回数")
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+random.seed(args.seed)
+vocabulary = [f"w{i}" for i in range(args.vocabulary)]
+cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(args.vocabulary)))
+areas = [f"area-{i}" for i in range(20)]
+statuses = ['pending', 'started', 'ended']
+base = datetime(2025, 1, 1)
+
+index = InvertedIndex()
+started = time.perf_counter()
+for doc_id in range(args.documents):
+    terms = random.choices(vocabulary, cum_weights=cum_weights, k=args.length)
+    index.add(str(doc_id), terms, random.choice(areas), random.choice(statuses),
+              base + timedelta(minutes=doc_id))
+print(f"インデックス作成: {args.documents}件 {time.perf_counter() - started:.1f}秒 語彙 {len(index.postings)}語")
+
+cases = [
+    ('よく出る単語', ['w0'], {}),
+    ('中程度の単語', ['w100'], {}),
+    ('まれな単語', [vocabulary[-1]], {}),
+    ('3語', ['w5', 'w50', 'w500'], {}),
+    ('よく出る単語＋エリア', ['w0'], {'area_id': 'area-3'}),
+    ('3語＋ステータス', ['w5', 'w50', 'w500'], {'status': 'pending'}),
+]
+
+for name, terms, filters in cases:
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        results, total = index.search(terms, limit=20, **filters)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"  {name}: 一致 {total}件 中央値 {statistics.median(timings):.1f}ms p95 {p95:.1f}ms")
+
+# 更新された単語は次の検索で配列を作り直すため、書き込み直後の1回目の検索も測る
+timings = []
+for i in range(args.repeat):
+    index.add(f"new-{i}", ['w0', 'w5'], areas[0], statuses[0], datetime.now())
+    started = time.perf_counter()
+    index.search(['w0'], limit=20)
+    timings.append((time.perf_counter() - started) * 1000)
+timings.sort()
+print(f"  書き込み直後のよく出る単語: 中央値 {statistics.median(timings):.1f}ms p95 {timings[int(len(timings) * 0.95) - 1]:.1f}ms")
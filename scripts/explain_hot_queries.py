@@ -0,0 +1,116 @@
+import sys, os
+import argparse
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.models import db
+from app.models.event import Event, TagMaster, UserTagAssociation, EventTagAssociation, ThreadTagAssociation
+from app.models.message import EventMessage, DirectMessage, FriendRelationship
+from app.utils.pagination import keyset_union_query
+
+# 使い方:
+#   docker compose exec backend python scripts/explain_hot_queries.py
+#   docker compose exec backend python scripts/explain_hot_queries.py --verbose
+#
+# よく実行されるクエリの実行計画（EXPLAIN）を確認し、テーブル全体を走査しているものがあれば
+# 終了コード1で終了する（CIやマイグレーション後の確認に使う）。
+# MySQLは行数が少ないテーブルではインデックスを使わないことがあるため、本番相当のデータで実行すること。
+
+parser = argparse.ArgumentParser(description="主要なクエリがフルスキャンになっていないかEXPLAINで確認します")
+parser.add_argument("--verbose", action="store_true", help="実行計画をすべて表示する")
+args = parser.parse_args()
+
+# EXPLAINするだけなので、値は実在しなくてよい
+SAMPLE_ID = '00000000-0000-0000-0000-000000000000'
+OTHER_ID = '00000000-0000-0000-0000-000000000001'
+
+
+def hot_queries():
+    """(名前, クエリ) のリスト。ルートやutilsで実際に使っている形に合わせる"""
+    return [
+        ('イベント一覧', Event.query.filter_by(is_deleted=False)
+            .order_by(Event.published_at.desc()).limit(10)),
+        ('イベント一覧（エリア）', Event.query.filter_by(is_deleted=False, area_id=SAMPLE_ID)
+            .order_by(Event.published_at.desc()).limit(10)),
+        ('イベント一覧（ステータス）', Event.query.filter_by(is_deleted=False, status='pending')
+            .order_by(Event.published_at.desc()).limit(10)),
+        ('作成者のイベント', Event.query.filter_by(author_user_id=SAMPLE_ID, is_deleted=False)
+            .order_by(Event.published_at.desc()).limit(5)),
+        ('イベントのメッセージ', EventMessage.query.filter_by(event_id=SAMPLE_ID)
+            .order_by(EventMessage.timestamp.desc(), EventMessage.id.desc()).limit(50)),
+        # 送信・受信の方向ごとの範囲検索を UNION ALL でつなぐ（friend_routes の DM取得と同じ）
+        ('DMの履歴', keyset_union_query(DirectMessage, [
+            DirectMessage.query.filter_by(sender_id=SAMPLE_ID, receiver_id=OTHER_ID),
+            DirectMessage.query.filter_by(sender_id=OTHER_ID, receiver_id=SAMPLE_ID)
+        ], 'sent_at', None, 50)),
+        ('フレンド関係の確認', FriendRelationship.query.filter_by(
+            user_id=SAMPLE_ID, friend_id=OTHER_ID, status='accepted')),
+        ('フレンド関係の読み込み', FriendRelationship.query.filter(
+            (FriendRelationship.user_id == SAMPLE_ID) | (FriendRelationship.friend_id == SAMPLE_ID))),
+        ('ユーザーのタグ', UserTagAssociation.query.filter_by(user_id=SAMPLE_ID)),
+        ('イベントのタグ', db.session.query(TagMaster)
+            .join(EventTagAssociation, TagMaster.id == EventTagAssociation.tag_id)
+            .filter(EventTagAssociation.event_id == SAMPLE_ID)),
+        ('タグからイベント', db.session.query(EventTagAssociation.event_id)
+            .filter(EventTagAssociation.tag_id == SAMPLE_ID)),
+        ('タグからスレッド', db.session.query(ThreadTagAssociation.thread_id)
+            .filter(ThreadTagAssociation.tag_id.in_([SAMPLE_ID, OTHER_ID]))
+            .group_by(ThreadTagAssociation.thread_id)),
+    ]
+
+
+def explain(query):
+    """
+    クエリの実行計画を取得する
+
+    Returns:
+        tuple: (実行計画の行のリスト, フルスキャンしているテーブル名のリスト)
+    """
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    if dialect.name == 'sqlite':
+        rows = [row[3] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+        # "SCAN event" はテーブル全体の走査。"SCAN event USING INDEX ..." はインデックス順の走査
+        # サブクエリの結果（CO-ROUTINE / MATERIALIZE）の走査は件数を絞った後なので除く
+        subqueries = {
+            detail.split()[1] for detail in rows
+            if detail.startswith(('CO-ROUTINE', 'MATERIALIZE'))
+        }
+        full_scans = [
+            detail.split()[1] for detail in rows
+            if detail.startswith('SCAN') and 'USING' not in detail and detail.split()[1] not in subqueries
+        ]
+        return rows, full_scans
+
+    result = db.session.execute(text(f"EXPLAIN {sql}"))
+    rows = [dict(row._mapping) for row in result]
+    # <derived2> や <union2,3> はサブクエリの結果の走査なので除く
+    full_scans = [
+        row['table'] for row in rows
+        if row.get('type') == 'ALL' and not (row.get('table') or '').startswith('<')
+    ]
+    return rows, full_scans
+
+
+app = create_app()
+
+with app.app_context():
+    failures = []
+    for name, query in hot_queries():
+        rows, full_scans = explain(query)
+        if full_scans:
+            failures.append(name)
+            print(f"❌ {name}: フルスキャン ({', '.join(full_scans)})")
+        else:
+            print(f"✅ {name}")
+        if args.verbose or full_scans:
+            for row in rows:
+                print(f"    {row}")
+
+    if failures:
+        print(f"⚠️ フルスキャンになっているクエリが {len(failures)}件 あります")
+        sys.exit(1)
+    print("✅ すべてのクエリがインデックスを使っています")
@@ -0,0 +1,32 @@
+import sys, os
+import argparse
+import json
+from datetime import timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.utils.image_gc import collect_orphan_images
+
+# 使い方:
+#   docker compose exec backend python scripts/gc_images.py --dry-run
+#   docker compose exec backend python scripts/gc_images.py --batch-size 1000 --grace-hours 48
+
+parser = argparse.ArgumentParser(description="参照されていない画像（ImageListとストレージ上のオブジェクト）を削除します")
+parser.add_argument("--dry-run", action="store_true", help="削除せずに対象件数だけ表示する")
+parser.add_argument("--batch-size", type=int, default=500, help="1回に走査する件数")
+parser.add_argument("--grace-hours", type=float, default=24, help="この時間内にアップロードされた画像は削除しない")
+parser.add_argument("--skip-objects", action="store_true", help="ストレージ上のオブジェクトの走査を省略する")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    stats = collect_orphan_images(
+        dry_run=args.dry_run,
+        batch_size=args.batch_size,
+        grace_period=timedelta(hours=args.grace_hours),
+        scan_objects=not args.skip_objects
+    )
+    print(("🔍 [dry-run] " if args.dry_run else "🧹 ") + "孤立画像のクリーンアップ結果:")
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
@@ -0,0 +1,22 @@
+import sys, os
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.utils.conversations import rebuild_conversations
+
+# 使い方:
+#   docker compose exec backend python scripts/rebuild_conversations.py
+#   docker compose exec backend python scripts/rebuild_conversations.py --user-id <user_id>
+
+parser = argparse.ArgumentParser(description="DirectMessageからDMの会話一覧（direct_conversation）を作り直します")
+parser.add_argument("--user-id", help="指定したユーザーが関与する会話だけ作り直す")
+parser.add_argument("--batch-size", type=int, default=1000, help="一度に読み込むメッセージ数")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    count = rebuild_conversations(user_id=args.user_id, batch_size=args.batch_size)
+    print(f"✅ 会話一覧を再構築しました: {count}件")
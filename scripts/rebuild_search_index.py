@@ -0,0 +1,24 @@
+import sys, os
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.utils.search_index import rebuild_search_documents
+
+# 使い方:
+#   docker compose exec backend python scripts/rebuild_search_index.py
+#
+# すべてのイベントとスレッドを分かち書きし直して search_document を作り直す。
+# 分かち書きの方法（recommend.py のストップワードなど）を変えたときに実行する。
+# 各ワーカーは数秒以内に差分を取り込むので、再起動は不要。
+
+parser = argparse.ArgumentParser(description="全文検索用のインデックス（search_document）を作り直します")
+parser.add_argument("--batch-size", type=int, default=500, help="一度に分かち書きする件数")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    count = rebuild_search_documents(batch_size=args.batch_size)
+    print(f"✅ 検索インデックスを作り直しました: {count}件")
@@ -0,0 +1,27 @@
+import sys, os
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.models import db
+from app.utils.counters import reconcile_counters
+
+# 使い方:
+#   docker compose exec backend python scripts/reconcile_counters.py
+#
+# スレッド・イベントのいいね数・メッセージ数と、イベントの参加者数を元のテーブルから数え直し、
+# ずれている行だけ修正する（定期実行してもよい）
+
+parser = argparse.ArgumentParser(description="いいね数・メッセージ数・参加者数のカラムを数え直します")
+parser.add_argument("--batch-size", type=int, default=1000, help="一度に確認する行数")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    results = reconcile_counters(batch_size=args.batch_size)
+    db.session.commit()
+    for key, fixed in results.items():
+        print(f"  {key}: {fixed}件")
+    print(f"✅ 件数を数え直しました: 修正 {sum(results.values())}件")
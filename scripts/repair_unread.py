@@ -0,0 +1,23 @@
+import sys, os
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.utils.conversations import rebuild_conversations
+from app.utils.read_tracking import recompute_unread_counts
+
+# 使い方:
+#   docker compose exec backend python scripts/repair_unread.py
+#   docker compose exec backend python scripts/repair_unread.py --user-id <user_id>
+
+parser = argparse.ArgumentParser(description="DMとイベントの未読数を元のテーブルから数え直します")
+parser.add_argument("--user-id", help="指定したユーザーの未読数だけ数え直す")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    conversations = rebuild_conversations(user_id=args.user_id)
+    watermarks = recompute_unread_counts(user_id=args.user_id)
+    print(f"✅ 未読数を再計算しました: DM {conversations}件 / イベント {watermarks}件")
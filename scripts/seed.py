@@ -4,6 +4,7 @@ from datetime import datetime, timedelta, timezone
 from sqlalchemy import text
 import json
 import random
+import mimetypes
 
 JST = timezone(timedelta(hours=9))
 
@@ -14,10 +15,12 @@ from app.models import db
 from app.models.user import User
 from app.models.event import Event, UserMemberGroup, UserHeartEvent, TagMaster, UserTagAssociation, EventTagAssociation, ThreadTagAssociation
 from app.models.area import AreaList
-from app.models.file import ImageList
+from app.models.file import ImageList, StoredObject
 from app.models.thread import Thread, ThreadMessage, UserHeartThread
 from app.models.message import EventMessage, FriendRelationship, DirectMessage
 from app.models.character import Character
+from app.utils.image_store import compute_content_hash
+from app.utils.storage import build_file_url, IMMUTABLE_CACHE_CONTROL
 import boto3
 from werkzeug.utils import secure_filename
 from botocore.exceptions import ClientError
@@ -27,8 +30,6 @@ MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "http://57.182.254.92:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "user-profile-images")
-EVENT_BUCKET = "event-images"
-THREAD_BUCKET = "thread-images"
 CHARACTER_BUCKET = "character-images"  # キャラクター画像用バケット
 TEST_IMAGE_PATH = os.path.join(os.path.dirname(__file__), "users", "test.png")
 
@@ -42,7 +43,7 @@ s3 = boto3.client(
 
 def create_buckets():
     """必要なバケットを作成"""
-    for bucket in [MINIO_BUCKET, EVENT_BUCKET, THREAD_BUCKET, CHARACTER_BUCKET]:  # キャラクターバケット追加
+    for bucket in [MINIO_BUCKET, CHARACTER_BUCKET]:  # キャラクターバケット追加
         try:
             s3.head_bucket(Bucket=bucket)
             print(f"📦 バケット '{bucket}' は既に存在します")
@@ -82,19 +83,66 @@ def create_buckets():
             )
             print(f"🔓 バケット '{bucket}' を公開アクセス可能に設定しました")
 
-def upload_image(bucket, path, key):
-    """画像をアップロード"""
+# 今回のシードでアップロード済みの画像（(バケット, プレフィックス, 内容ハッシュ) -> キー）
+uploaded_objects = {}
+# 今回のシードで追加したStoredObject（内容ハッシュ -> StoredObject）
+stored_objects = {}
+
+def upload_image(bucket, path, key, prefix=None):
+    """画像をアップロード（同じ内容の画像は内容ハッシュのキーで1度だけ保存する）"""
     try:
         with open(path, "rb") as f:
-            s3.upload_fileobj(f, bucket, key)
-            print(f"🖼️ 画像アップロード成功: {key}")
-        
-        # 直接MinIOエンドポイントのIPアドレスを使用
-        return f"http://57.182.254.92:9000/{bucket}/{key}"
+            content_hash = compute_content_hash(f)
+            object_key = uploaded_objects.get((bucket, prefix, content_hash))
+            if object_key is None:
+                object_key = f"{content_hash}{os.path.splitext(key)[1]}"
+                if prefix:
+                    object_key = f"{prefix}/{object_key}"
+                try:
+                    # 以前のシードで保存済みならアップロードしない
+                    s3.head_object(Bucket=bucket, Key=object_key)
+                    print(f"♻️ 画像は保存済みです: {object_key}")
+                except ClientError:
+                    s3.upload_fileobj(f, bucket, object_key, ExtraArgs={"CacheControl": IMMUTABLE_CACHE_CONTROL})
+                    print(f"🖼️ 画像アップロード成功: {object_key}")
+                uploaded_objects[(bucket, prefix, content_hash)] = object_key
+        
+        # 環境ごとに設定された公開URL（CDN/キャッシュプロキシ）を使用
+        return build_file_url(object_key, bucket)
     except FileNotFoundError:
         print(f"⚠️ {path} が見つかりません。")
         return None
 
+def add_image(image_id, path, prefix, uploader_id):
+    """
+    アプリからのアップロード（store_image）と同じ形式で画像を登録する
+
+    MINIO_BUCKET の <prefix>/<内容ハッシュ>.<拡張子> に保存し、StoredObject（参照カウント付き）と
+    content_hash を設定したImageListを追加する。画像のURLを返す（ファイルがない場合はNone）。
+    """
+    image_url = upload_image(MINIO_BUCKET, path, path, prefix=prefix)
+    if not image_url:
+        return None
+
+    with open(path, "rb") as f:
+        content_hash = compute_content_hash(f)
+    stored = stored_objects.get(content_hash)
+    if stored is None:
+        stored = StoredObject(
+            content_hash=content_hash,
+            object_key=uploaded_objects[(MINIO_BUCKET, prefix, content_hash)],
+            image_url=image_url,
+            content_type=mimetypes.guess_type(path)[0],
+            size=os.path.getsize(path),
+            ref_count=0
+        )
+        db.session.add(stored)
+        stored_objects[content_hash] = stored
+    stored.ref_count += 1
+
+    db.session.add(ImageList(id=image_id, image_url=stored.image_url, uploaded_by=uploader_id, content_hash=content_hash))
+    return stored.image_url
+
 app = create_app()
 
 ## テーブルのリセット
@@ -375,13 +423,9 @@ with app.app_context():
     
     # いちご狩りの画像をアップロード
     ichigo_image_id = str(uuid.uuid4())
-    ichigo_filename = f"event_{ichigo_image_id}.png"
     ichigo_image_path = os.path.join(os.path.dirname(__file__), "events", "いちご狩り.png")
-    ichigo_image_url = upload_image(EVENT_BUCKET, ichigo_image_path, ichigo_filename)
+    ichigo_image_url = add_image(ichigo_image_id, ichigo_image_path, "events", user_ids["test@example.com"])
     if ichigo_image_url:
-        uploader_id = user_ids["test@example.com"]
-        image = ImageList(id=ichigo_image_id, image_url=ichigo_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["いちご狩り"] = {
             "id": ichigo_image_id,
             "url": ichigo_image_url
@@ -389,13 +433,9 @@ with app.app_context():
     
     # たこ焼きパーティーの画像をアップロード
     takoyaki_image_id = str(uuid.uuid4())
-    takoyaki_filename = f"event_{takoyaki_image_id}.webp"
     takoyaki_image_path = os.path.join(os.path.dirname(__file__), "events", "たこ焼き.webp")
-    takoyaki_image_url = upload_image(EVENT_BUCKET, takoyaki_image_path, takoyaki_filename)
+    takoyaki_image_url = add_image(takoyaki_image_id, takoyaki_image_path, "events", user_ids["yamada@example.com"])
     if takoyaki_image_url:
-        uploader_id = user_ids["yamada@example.com"]
-        image = ImageList(id=takoyaki_image_id, image_url=takoyaki_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["たこ焼き"] = {
             "id": takoyaki_image_id,
             "url": takoyaki_image_url
@@ -403,13 +443,9 @@ with app.app_context():
     
     # 紅葉撮影会の画像をアップロード
     koyo_image_id = str(uuid.uuid4())
-    koyo_filename = f"event_{koyo_image_id}.webp"
     koyo_image_path = os.path.join(os.path.dirname(__file__), "events", "紅葉撮影会.webp")
-    koyo_image_url = upload_image(EVENT_BUCKET, koyo_image_path, koyo_filename)
+    koyo_image_url = add_image(koyo_image_id, koyo_image_path, "events", user_ids["tanaka@example.com"])
     if koyo_image_url:
-        uploader_id = user_ids["tanaka@example.com"]
-        image = ImageList(id=koyo_image_id, image_url=koyo_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["紅葉"] = {
             "id": koyo_image_id,
             "url": koyo_image_url
@@ -417,13 +453,9 @@ with app.app_context():
     
     # 東京スカイツリーの画像をアップロード
     skytree_image_id = str(uuid.uuid4())
-    skytree_filename = f"event_{skytree_image_id}.jpg"
     skytree_image_path = os.path.join(os.path.dirname(__file__), "events", "東京スカイツリー.jpg")
-    skytree_image_url = upload_image(EVENT_BUCKET, skytree_image_path, skytree_filename)
+    skytree_image_url = add_image(skytree_image_id, skytree_image_path, "events", user_ids["test@example.com"])
     if skytree_image_url:
-        uploader_id = user_ids["test@example.com"]
-        image = ImageList(id=skytree_image_id, image_url=skytree_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["東京スカイツリー"] = {
             "id": skytree_image_id,
             "url": skytree_image_url
@@ -431,13 +463,9 @@ with app.app_context():
     
     # 乗馬体験の画像をアップロード
     horse_image_id = str(uuid.uuid4())
-    horse_filename = f"event_{horse_image_id}.jpg"
     horse_image_path = os.path.join(os.path.dirname(__file__), "events", "乗馬体験.jpg")
-    horse_image_url = upload_image(EVENT_BUCKET, horse_image_path, horse_filename)
+    horse_image_url = add_image(horse_image_id, horse_image_path, "events", user_ids["uma@example.com"])
     if horse_image_url:
-        uploader_id = user_ids["uma@example.com"]
-        image = ImageList(id=horse_image_id, image_url=horse_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["乗馬体験"] = {
             "id": horse_image_id,
             "url": horse_image_url
@@ -445,13 +473,9 @@ with app.app_context():
     
     # 山岳トレッキングの画像をアップロード
     trekking_image_id = str(uuid.uuid4())
-    trekking_filename = f"event_{trekking_image_id}.jpg"
     trekking_image_path = os.path.join(os.path.dirname(__file__), "events", "山岳トレッキング.jpg")
-    trekking_image_url = upload_image(EVENT_BUCKET, trekking_image_path, trekking_filename)
+    trekking_image_url = add_image(trekking_image_id, trekking_image_path, "events", user_ids["okojo@example.com"])
     if trekking_image_url:
-        uploader_id = user_ids["okojo@example.com"]
-        image = ImageList(id=trekking_image_id, image_url=trekking_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["山岳トレッキング"] = {
             "id": trekking_image_id,
             "url": trekking_image_url
@@ -459,13 +483,9 @@ with app.app_context():
     
     # 早朝サンライズヨガの画像をアップロード
     yoga_image_id = str(uuid.uuid4())
-    yoga_filename = f"event_{yoga_image_id}.jpg"
     yoga_image_path = os.path.join(os.path.dirname(__file__), "events", "早朝サンライズヨガ.jpg")
-    yoga_image_url = upload_image(EVENT_BUCKET, yoga_image_path, yoga_filename)
+    yoga_image_url = add_image(yoga_image_id, yoga_image_path, "events", user_ids["niwatori@example.com"])
     if yoga_image_url:
-        uploader_id = user_ids["niwatori@example.com"]
-        image = ImageList(id=yoga_image_id, image_url=yoga_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["早朝サンライズヨガ"] = {
             "id": yoga_image_id,
             "url": yoga_image_url
@@ -473,13 +493,9 @@ with app.app_context():
     
     # 種集めウォーキングの画像をアップロード
     seedwalk_image_id = str(uuid.uuid4())
-    seedwalk_filename = f"event_{seedwalk_image_id}.jpg"
     seedwalk_image_path = os.path.join(os.path.dirname(__file__), "events", "種集めウォーキング.jpg")
-    seedwalk_image_url = upload_image(EVENT_BUCKET, seedwalk_image_path, seedwalk_filename)
+    seedwalk_image_url = add_image(seedwalk_image_id, seedwalk_image_path, "events", user_ids["hamster@example.com"])
     if seedwalk_image_url:
-        uploader_id = user_ids["hamster@example.com"]
-        image = ImageList(id=seedwalk_image_id, image_url=seedwalk_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["種集めウォーキング"] = {
             "id": seedwalk_image_id,
             "url": seedwalk_image_url
@@ -487,13 +503,9 @@ with app.app_context():
     
     # 砂漠ツアーガイドの画像をアップロード
     desert_image_id = str(uuid.uuid4())
-    desert_filename = f"event_{desert_image_id}.jpg"
     desert_image_path = os.path.join(os.path.dirname(__file__), "events", "砂漠ツアーガイド.jpg")
-    desert_image_url = upload_image(EVENT_BUCKET, desert_image_path, desert_filename)
+    desert_image_url = add_image(desert_image_id, desert_image_path, "events", user_ids["rakuda@example.com"])
     if desert_image_url:
-        uploader_id = user_ids["rakuda@example.com"]
-        image = ImageList(id=desert_image_id, image_url=desert_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["砂漠ツアーガイド"] = {
             "id": desert_image_id,
             "url": desert_image_url
@@ -501,13 +513,9 @@ with app.app_context():
     
     # 編み物ワークショップの画像をアップロード
     knitting_image_id = str(uuid.uuid4())
-    knitting_filename = f"event_{knitting_image_id}.jpg"
     knitting_image_path = os.path.join(os.path.dirname(__file__), "events", "編み物ワークショップ.jpg")
-    knitting_image_url = upload_image(EVENT_BUCKET, knitting_image_path, knitting_filename)
+    knitting_image_url = add_image(knitting_image_id, knitting_image_path, "events", user_ids["sheep@example.com"])
     if knitting_image_url:
-        uploader_id = user_ids["sheep@example.com"]
-        image = ImageList(id=knitting_image_id, image_url=knitting_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["編み物ワークショップ"] = {
             "id": knitting_image_id,
             "url": knitting_image_url
@@ -515,13 +523,9 @@ with app.app_context():
     
     # 寿司作り体験の画像をアップロード
     sushi_image_id = str(uuid.uuid4())
-    sushi_filename = f"event_{sushi_image_id}.jpg"
     sushi_image_path = os.path.join(os.path.dirname(__file__), "events", "寿司作り体験.jpg")
-    sushi_image_url = upload_image(EVENT_BUCKET, sushi_image_path, sushi_filename)
+    sushi_image_url = add_image(sushi_image_id, sushi_image_path, "events", user_ids["yamada@example.com"])
     if sushi_image_url:
-        uploader_id = user_ids["yamada@example.com"]
-        image = ImageList(id=sushi_image_id, image_url=sushi_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["寿司作り体験"] = {
             "id": sushi_image_id,
             "url": sushi_image_url
@@ -529,13 +533,9 @@ with app.app_context():
     
     # 鎌倉散策の画像をアップロード
     kamakura_image_id = str(uuid.uuid4())
-    kamakura_filename = f"event_{kamakura_image_id}.jpg"
     kamakura_image_path = os.path.join(os.path.dirname(__file__), "events", "鎌倉散策.jpg")
-    kamakura_image_url = upload_image(EVENT_BUCKET, kamakura_image_path, kamakura_filename)
+    kamakura_image_url = add_image(kamakura_image_id, kamakura_image_path, "events", user_ids["tanaka@example.com"])
     if kamakura_image_url:
-        uploader_id = user_ids["tanaka@example.com"]
-        image = ImageList(id=kamakura_image_id, image_url=kamakura_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["鎌倉散策"] = {
             "id": kamakura_image_id,
             "url": kamakura_image_url
@@ -543,13 +543,9 @@ with app.app_context():
     
     # クリスマスマーケットの画像をアップロード
     xmas_image_id = str(uuid.uuid4())
-    xmas_filename = f"event_{xmas_image_id}.jpg"
     xmas_image_path = os.path.join(os.path.dirname(__file__), "events", "クリスマスマーケット.jpg")
-    xmas_image_url = upload_image(EVENT_BUCKET, xmas_image_path, xmas_filename)
+    xmas_image_url = add_image(xmas_image_id, xmas_image_path, "events", user_ids["tonakai@example.com"])
     if xmas_image_url:
-        uploader_id = user_ids["tonakai@example.com"]
-        image = ImageList(id=xmas_image_id, image_url=xmas_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["クリスマスマーケット"] = {
             "id": xmas_image_id,
             "url": xmas_image_url
@@ -557,13 +553,9 @@ with app.app_context():
     
     # 岩場でのんびりピクニックの画像をアップロード
     picnic_image_id = str(uuid.uuid4())
-    picnic_filename = f"event_{picnic_image_id}.jpg"
     picnic_image_path = os.path.join(os.path.dirname(__file__), "events", "岩場でのんびりピクニック.jpg")
-    picnic_image_url = upload_image(EVENT_BUCKET, picnic_image_path, picnic_filename)
+    picnic_image_url = add_image(picnic_image_id, picnic_image_path, "events", user_ids["hyrax@example.com"])
     if picnic_image_url:
-        uploader_id = user_ids["hyrax@example.com"]
-        image = ImageList(id=picnic_image_id, image_url=picnic_image_url, uploaded_by=uploader_id)
-        db.session.add(image)
         event_images["岩場でのんびりピクニック"] = {
             "id": picnic_image_id,
             "url": picnic_image_url
@@ -1133,13 +1125,9 @@ with app.app_context():
     thread_images = []
     for i in range(2):
         image_id = str(uuid.uuid4())
-        filename = f"thread_{image_id}.jpg"
-        image_url = upload_image(THREAD_BUCKET, TEST_IMAGE_PATH, filename)
+        # テスト用に最初のユーザーをアップロード者として設定
+        image_url = add_image(image_id, TEST_IMAGE_PATH, "thread-messages", user_ids["test@example.com"])
         if image_url:
-            # テスト用に最初のユーザーをアップロード者として設定
-            uploader_id = user_ids["test@example.com"]
-            image = ImageList(id=image_id, image_url=image_url, uploaded_by=uploader_id)
-            db.session.add(image)
             thread_images.append(image_id)
     
     db.session.commit()